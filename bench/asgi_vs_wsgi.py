@@ -0,0 +1,133 @@
+"""
+同步(WSGI)和异步(ASGI)部署的压测对比
+同样的worker数量下,分别启动:
+1.WSGI: gunicorn dashop.wsgi (sync worker)
+2.ASGI: uvicorn dashop.asgi (DASHOP_ASYNC_VIEWS=1,首页、详情页、购物车使用异步视图)
+对首页、详情页、购物车查询接口压测,输出每秒请求数和p50/p99延迟
+
+需要先安装gunicorn和uvicorn,并准备好MySQL/Redis数据:
+pip install gunicorn uvicorn
+python bench/asgi_vs_wsgi.py --workers 4 --concurrency 64 --duration 20 --username liying
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT = os.path.join(ROOT, "dashop")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def wait_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def start_server(kind, port, workers, env):
+    if kind == "wsgi":
+        cmd = ["gunicorn", "dashop.wsgi:application", "-w", str(workers), "-b", f"127.0.0.1:{port}"]
+    else:
+        cmd = ["uvicorn", "dashop.asgi:application", "--workers", str(workers), "--port", str(port),
+               "--no-access-log"]
+        env = dict(env, DASHOP_ASYNC_VIEWS="1")
+    proc = subprocess.Popen(cmd, cwd=PROJECT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_port(port)
+    return proc
+
+
+def run_load(port, paths, headers, concurrency, duration):
+    """
+    功能函数:concurrency个线程循环请求paths,每个线程一个keep-alive连接
+    返回: (请求数, 错误数, 延迟列表(毫秒))
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(n):
+        conn = HTTPConnection("127.0.0.1", port, timeout=10)
+        local, failed, i = [], 0, n
+        while time.time() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    failed += 1
+            except Exception:
+                failed += 1
+                conn.close()
+                conn = HTTPConnection("127.0.0.1", port, timeout=10)
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return len(latencies), errors[0], latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--username", required=True, help="压测购物车接口使用的用户")
+    parser.add_argument("--sku-ids", default="1,2,3")
+    parser.add_argument("--settings", default=os.getenv("DJANGO_SETTINGS_MODULE", "dashop.settings"))
+    parser.add_argument("--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=args.settings,
+               PYTHONPATH=os.pathsep.join([PROJECT, os.path.join(ROOT, "bench"), os.getenv("PYTHONPATH", "")]))
+    token = jwt.encode({"exp": time.time() + 3600, "username": args.username},
+                       os.environ["JWT_TOKEN_KEY"], algorithm="HS256")
+    paths = ["/v1/goods/index", f"/v1/carts/{args.username}"]
+    paths += [f"/v1/goods/detail/{i}" for i in args.sku_ids.split(",")]
+    headers = {"Authorization": token}
+
+    print(f"workers={args.workers} concurrency={args.concurrency} duration={args.duration}s")
+    print(f"{'':6}{'req/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'errors':>8}")
+    for kind in ("wsgi", "asgi"):
+        proc = start_server(kind, args.port, args.workers, env)
+        try:
+            run_load(args.port, paths, headers, args.concurrency, args.warmup)
+            count, errors, latencies = run_load(args.port, paths, headers, args.concurrency, args.duration)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"{kind:6}{count / args.duration:>10.0f}{percentile(latencies, 50):>10.1f}"
+              f"{percentile(latencies, 99):>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
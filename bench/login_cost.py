@@ -0,0 +1,79 @@
+"""
+登录的CPU耗时
+1.不同PBKDF2迭代次数下校验一次密码的耗时,和旧的MD5对比,用于选择PASSWORD_HASH_ITERATIONS
+2.完整的登录流程(users.credentials.authenticate):成功、密码错误、失败次数超限被拒绝
+
+python bench/login_cost.py --iterations 100000,150000,260000,600000 --rounds 20
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "dashop"), os.path.join(ROOT, "bench")]
+
+
+def measure(func, rounds):
+    """
+    返回: (每次的CPU耗时毫秒, 每次的耗时毫秒)
+    """
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - cpu) * 1000 / rounds, (time.perf_counter() - wall) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", default="100000,150000,260000,600000")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DJANGO_SETTINGS_MODULE"] = "settings"
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from dashop import settings
+    from users import credentials
+    from users.models import UserProfile
+
+    password = "bench-password"
+    print(f"{'hasher':<24}{'cpu(ms)':>10}{'wall(ms)':>10}")
+    legacy = hashlib.md5(password.encode()).hexdigest()
+    cpu, wall = measure(lambda: credentials.check_password(password, legacy), args.rounds)
+    print(f"{'md5(legacy)':<24}{cpu:>10.3f}{wall:>10.3f}")
+
+    default_iterations = settings.PASSWORD_HASH_ITERATIONS
+    for iterations in [int(i) for i in args.iterations.split(",")]:
+        settings.PASSWORD_HASH_ITERATIONS = iterations
+        encoded = credentials.hash_password(password)
+        cpu, wall = measure(lambda: credentials.check_password(password, encoded), args.rounds)
+        print(f"{f'pbkdf2 {iterations}':<24}{cpu:>10.3f}{wall:>10.3f}")
+    settings.PASSWORD_HASH_ITERATIONS = default_iterations
+
+    # 完整登录流程
+    call_command("migrate", verbosity=0)
+    username, ip = "bench_login", "10.255.255.1"
+    UserProfile.objects.filter(username=username).delete()
+    UserProfile.objects.create(username=username, password=credentials.hash_password(password),
+                               email=f"{username}@bench.local", phone="19999999999", is_active=True)
+    credentials.get_redis().delete(*credentials.fail_keys(username, ip).values())
+
+    print(f"\nauthenticate (PASSWORD_HASH_ITERATIONS={default_iterations})")
+    print(f"{'case':<24}{'cpu(ms)':>10}{'wall(ms)':>10}")
+    cpu, wall = measure(lambda: credentials.authenticate(username, password, ip), args.rounds)
+    print(f"{'success':<24}{cpu:>10.3f}{wall:>10.3f}")
+    limit = min(limit for limit, _ in settings.LOGIN_FAIL_LIMITS.values())
+    cpu, wall = measure(lambda: credentials.authenticate(username, "wrong", ip), limit)
+    print(f"{'wrong password':<24}{cpu:>10.3f}{wall:>10.3f}")
+    cpu, wall = measure(lambda: credentials.authenticate(username, "wrong", ip), args.rounds)
+    print(f"{'blocked':<24}{cpu:>10.3f}{wall:>10.3f}")
+
+    credentials.get_redis().delete(*credentials.fail_keys(username, ip).values(), credentials.trusted_key(username))
+    UserProfile.objects.filter(username=username).delete()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
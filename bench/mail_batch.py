@@ -0,0 +1,117 @@
+"""
+激活邮件发送压测:逐封发送(每封一个连接) vs 发件箱批量发送(每批一个连接)
+本地使用Django的邮件backend,不连接真实的SMTP服务器:
+1.handshake: locmem + 每次建立连接时sleep --handshake毫秒,模拟SMTP+TLS握手
+2.locmem: django.core.mail.backends.locmem.EmailBackend
+3.file: django.core.mail.backends.filebased.EmailBackend(写入临时目录)
+
+python bench/mail_batch.py --emails 500 --handshake 150
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "dashop"), os.path.join(ROOT, "bench")]
+
+from django.core.mail.backends import locmem  # noqa: E402
+
+BACKENDS = {
+    "handshake": f"{__name__}.HandshakeBackend",
+    "locmem": "django.core.mail.backends.locmem.EmailBackend",
+    "file": "django.core.mail.backends.filebased.EmailBackend",
+}
+
+
+class HandshakeBackend(locmem.EmailBackend):
+    """
+    locmem + 建立连接的耗时,统计建立连接的次数
+    """
+    delay = 0.0
+    opens = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection = None
+
+    def open(self):
+        if self.connection:
+            return False
+        time.sleep(self.delay)
+        HandshakeBackend.opens += 1
+        self.connection = True
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, messages):
+        new_conn = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_conn:
+                self.close()
+
+
+def items(count):
+    return [{"email": f"bench_{i}@bench.local", "username": f"bench_{i}",
+             "verify_url": f"http://127.0.0.1:7000/active.html?code={i}", "attempts": 0} for i in range(count)]
+
+
+def send_one_by_one(emails):
+    """
+    改造前的发送方式:每封邮件调用一次send_mail
+    """
+    from django.core import mail
+    from users.mail_outbox import build_active_email
+
+    for item in emails:
+        msg = build_active_email(item)
+        mail.send_mail(msg.subject, msg.body, msg.from_email, msg.to)
+
+
+def send_batched(emails):
+    from users import mail_outbox
+
+    mail_outbox.get_redis().rpush(mail_outbox.OUTBOX_KEY, *[json.dumps(i) for i in emails])
+    return mail_outbox.flush(max_batches=len(emails))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--handshake", type=float, default=100, help="模拟的握手耗时(毫秒)")
+    parser.add_argument("--backends", default="handshake,locmem,file")
+    args = parser.parse_args()
+
+    os.environ["DJANGO_SETTINGS_MODULE"] = "settings"
+    import django
+    django.setup()
+    from django.conf import settings as django_settings
+    from dashop import settings
+
+    HandshakeBackend.delay = args.handshake / 1000
+    settings.MAIL_BATCH_SIZE = args.batch_size
+    django_settings.EMAIL_FILE_PATH = tempfile.mkdtemp(prefix="dashop_mail_")
+
+    emails = items(args.emails)
+    print(f"emails={args.emails} batch_size={args.batch_size} handshake={args.handshake}ms")
+    print(f"{'backend':<12}{'mode':<10}{'seconds':>10}{'mails/s':>10}{'opens':>8}")
+    for name in args.backends.split(","):
+        django_settings.EMAIL_BACKEND = BACKENDS[name]
+        for mode, func in (("single", send_one_by_one), ("batched", send_batched)):
+            HandshakeBackend.opens = 0
+            start = time.perf_counter()
+            func(emails)
+            elapsed = time.perf_counter() - start
+            opens = HandshakeBackend.opens if name == "handshake" else "-"
+            print(f"{name:<12}{mode:<10}{elapsed:>10.2f}{len(emails) / elapsed:>10.0f}{opens:>8}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
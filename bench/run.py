@@ -0,0 +1,277 @@
+"""
+核心流程压测
+每个虚拟用户依次请求:
+首页 -> 详情页 -> 加入购物车 -> 购物车+1 -> 查询购物车 -> 订单确认页 -> 生成订单 -> 支付同步通知
+请求在进程内通过django.test.Client执行(包含中间件和URL路由),记录每个接口的:
+吞吐量(req/s)、p50/p95/p99延迟、SQL查询次数
+(SQL查询次数只统计请求线程中的查询,订单确认页在线程池中执行的查询不计入)
+
+默认使用bench/settings.py(SQLite + fakeredis),不需要任何外部服务:
+python bench/run.py --users 50 --rounds 5
+使用真实的MySQL/Redis(需要先migrate):
+python bench/run.py --settings dashop.settings --concurrency 8
+保存结果并和上一次结果对比,p95变慢超过阈值或查询次数增加时返回非0:
+python bench/run.py --output result.json
+python bench/run.py --baseline result.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "bench")
+sys.path[:0] = [os.path.join(ROOT, "dashop"), BENCH_DIR]
+
+
+def setup(settings_module):
+    os.environ["DJANGO_SETTINGS_MODULE"] = settings_module
+    import django
+    django.setup()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def make_alipay_keys():
+    """
+    功能函数:生成压测用的支付宝密钥对(应用私钥和支付宝公钥使用同一对),已存在时跳过
+    """
+    from Cryptodome.PublicKey import RSA
+    from dashop import settings
+
+    key_dir = settings.ALIPAY_KEY_DIR
+    private_path = os.path.join(key_dir, "app_private_key.pem")
+    public_path = os.path.join(key_dir, "alipay_public_key.pem")
+    if os.path.exists(private_path) and os.path.exists(public_path):
+        return
+    os.makedirs(key_dir, exist_ok=True)
+    key = RSA.generate(2048)
+    with open(private_path, "wb") as f:
+        f.write(key.export_key())
+    with open(public_path, "wb") as f:
+        f.write(key.publickey().export_key())
+
+
+class Recorder:
+    """
+    记录每个接口的延迟和SQL查询次数
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name, ms, queries, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append((ms, queries))
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        result = {}
+        for name, samples in self.samples.items():
+            latencies = [s[0] for s in samples]
+            queries = [s[1] for s in samples]
+            result[name] = {
+                "count": len(samples),
+                "errors": self.errors.get(name, 0),
+                "rps": len(samples) / elapsed,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "queries_avg": sum(queries) / len(queries),
+                "queries_max": max(queries),
+            }
+        return result
+
+
+class Journey:
+    """
+    一个虚拟用户的完整购物流程
+    """
+
+    def __init__(self, username, sku_ids, recorder, rng):
+        from django.test import Client
+        from utils.helper import make_token
+
+        self.username = username
+        self.sku_ids = sku_ids
+        self.recorder = recorder
+        self.rng = rng
+        self.client = Client()
+        self.headers = {"HTTP_AUTHORIZATION": make_token(username)}
+
+    def call(self, name, method, path, data=None, query=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        if query:
+            path = f"{path}?{urlencode(query)}"
+        kwargs = dict(self.headers)
+        if data is not None:
+            kwargs.update(data=json.dumps(data), content_type="application/json")
+
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, **kwargs)
+            ms = (time.perf_counter() - start) * 1000
+
+        body = None
+        ok = response.status_code == 200
+        if ok and response.get("Content-Type", "").startswith("application/json"):
+            body = response.json()
+            ok = body.get("code") == 200
+        self.recorder.add(name, ms, len(ctx.captured_queries), ok)
+        return body
+
+    def run(self):
+        user = self.username
+        sku_id = self.rng.choice(self.sku_ids)
+
+        self.call("index", "get", "/v1/goods/index")
+        self.call("detail", "get", f"/v1/goods/detail/{sku_id}")
+        self.call("cart_add", "post", f"/v1/carts/{user}", {"sku_id": sku_id, "count": 1})
+        self.call("cart_put", "put", f"/v1/carts/{user}", {"sku_id": sku_id, "state": "add"})
+        self.call("cart_get", "get", f"/v1/carts/{user}")
+        advance = self.call("order_advance", "get", f"/v1/orders/{user}/advance", query={"settlement_type": "0"})
+        if not advance or not advance["data"]["addresses"]:
+            return
+
+        address_id = advance["data"]["addresses"][0]["id"]
+        order = self.call("order_create", "post", f"/v1/orders/{user}",
+                          {"address_id": address_id, "settlement_type": "0"})
+        if not order:
+            return
+        self.call_return_url(order["data"]["order_id"], order["data"]["total_amount"])
+
+    def call_return_url(self, order_id, total_amount):
+        from utils.alipay_client import get_alipay
+
+        params = {"out_trade_no": order_id, "trade_no": f"bench{order_id}", "total_amount": total_amount}
+        message = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        params["sign"] = get_alipay()._sign(message)
+        self.call("return_url", "get", "/v1/pays/return_url", query=params)
+
+
+def run(usernames, sku_ids, rounds, concurrency, seed=0):
+    """
+    功能函数:concurrency个线程执行所有用户的购物流程,重复rounds轮
+    返回: (各接口统计, 总耗时)
+    """
+    import random
+    from django.db import connection
+
+    recorder = Recorder()
+    jobs = [(r, u) for r in range(rounds) for u in usernames]
+    lock = threading.Lock()
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        journeys = {}
+        try:
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    _, username = jobs.pop()
+                journey = journeys.get(username)
+                if journey is None:
+                    journey = journeys[username] = Journey(username, sku_ids, recorder, rng)
+                journey.run()
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return recorder.report(elapsed), elapsed
+
+
+def print_report(report, elapsed):
+    total = sum(r["count"] for r in report.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} req/s")
+    print(f"{'endpoint':<15}{'count':>7}{'err':>5}{'req/s':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'sql':>6}{'max':>5}")
+    for name, r in report.items():
+        print(f"{name:<15}{r['count']:>7}{r['errors']:>5}{r['rps']:>8.0f}{r['p50']:>8.1f}{r['p95']:>8.1f}"
+              f"{r['p99']:>8.1f}{r['queries_avg']:>6.1f}{r['queries_max']:>5}")
+
+
+def compare(report, baseline, threshold):
+    """
+    功能函数:和基线结果对比
+    返回: 退化的接口说明列表
+    """
+    problems = []
+    for name, old in baseline.items():
+        new = report.get(name)
+        if new is None:
+            continue
+        if new["queries_max"] > old["queries_max"]:
+            problems.append(f"{name}: queries {old['queries_max']} -> {new['queries_max']}")
+        if new["p95"] > old["p95"] * (1 + threshold):
+            problems.append(f"{name}: p95 {old['p95']:.1f}ms -> {new['p95']:.1f}ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settings", default="settings", help="默认使用bench/settings.py")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="SQLite下建议为1")
+    parser.add_argument("--catalogs", type=int, default=5)
+    parser.add_argument("--spus", type=int, default=10, help="每个类别的SPU数量")
+    parser.add_argument("--sql", help="导入SQL脚本代替生成商品数据,如sql_script/1.sql")
+    parser.add_argument("--no-seed", action="store_true", help="使用数据库中已有的商品数据")
+    parser.add_argument("--output", help="结果保存为JSON")
+    parser.add_argument("--baseline", help="和之前保存的JSON结果对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95允许变慢的比例")
+    args = parser.parse_args()
+
+    setup(args.settings)
+    from django.core.management import call_command
+    from goods.models import SKU
+    import seed
+
+    if args.settings == "settings":
+        call_command("migrate", verbosity=0)
+    if args.sql:
+        print(f"loaded {seed.load_sql(args.sql)} statements from {args.sql}")
+    elif not args.no_seed and not SKU.objects.filter(spu__name__startswith=seed.BENCH_PREFIX).exists():
+        print(f"seeded {seed.seed_catalog(args.catalogs, args.spus)} skus")
+    usernames = seed.seed_users(args.users)
+    print(f"warmed {seed.warm_caches()} detail documents")
+    make_alipay_keys()
+
+    sku_ids = list(SKU.objects.filter(is_launched=True, stock__gt=0).values_list("id", flat=True))
+    report, elapsed = run(usernames, sku_ids, args.rounds, args.concurrency)
+    print_report(report, elapsed)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(report, json.load(f), args.threshold)
+        for p in problems:
+            print("REGRESSION", p)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+压测数据
+1.load_sql(): 导入SQL脚本(如sql_script/1.sql),只支持MySQL
+2.seed_catalog(): 生成商品数据:类别 -> SPU(销售属性、规格) -> SKU(销售属性值、图片、规格值)
+3.seed_users(): 生成用户和收货地址
+数据全部用bulk_create批量插入,不触发信号,插入后统一生成详情文档和首页数据
+"""
+import random
+from decimal import Decimal
+from itertools import product
+
+from django.db import connection, transaction
+
+BENCH_PREFIX = "bench"
+
+COLORS = ["黑色", "白色", "蓝色", "红色", "灰色"]
+SIZES = ["S", "M", "L", "XL"]
+
+
+def load_sql(path):
+    """
+    功能函数:执行SQL脚本
+    """
+    with open(path, encoding="utf-8") as f:
+        script = f.read()
+    statements = [s.strip() for s in script.split(";\n") if s.strip()]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    return len(statements)
+
+
+def seed_catalog(catalogs=5, spus=10, colors=3, sizes=3, stock=10 ** 6, rng=None):
+    """
+    功能函数:生成商品数据
+    每个类别spus个SPU,每个SPU有颜色、尺寸两个销售属性,SKU数量 = colors * sizes
+    返回: 生成的SKU数量
+    """
+    from goods.models import (Brand, Catalog, SKU, SKUImage, SPU, SPUSaleAttr, SaleAttrValue, SPUSpec,
+                              SPUSpecValue)
+
+    rng = rng or random.Random(0)
+    with transaction.atomic():
+        brand = Brand.objects.create(name=f"{BENCH_PREFIX}品牌", logo="brand/bench.png", first_letter="B")
+        # MySQL的bulk_create不返回主键,插入后按名称重新查询
+        tag = f"b{brand.id}_"
+        Catalog.objects.bulk_create([Catalog(name=f"{tag}{i}") for i in range(catalogs)])
+        cata_objs = list(Catalog.objects.filter(name__startswith=tag).order_by("id"))
+
+        SPU.objects.bulk_create([
+            SPU(name=f"{BENCH_PREFIX}_{c.id}_{i}", brand=brand, catalog=c)
+            for c in cata_objs for i in range(spus)
+        ])
+        spu_objs = list(SPU.objects.filter(brand=brand).order_by("id"))
+
+        SPUSaleAttr.objects.bulk_create(
+            [SPUSaleAttr(spu=s, name=name) for s in spu_objs for name in ("颜色", "尺寸")])
+        attrs = list(SPUSaleAttr.objects.filter(spu__in=spu_objs).order_by("spu_id", "id"))
+        SaleAttrValue.objects.bulk_create(
+            [SaleAttrValue(spu_sale_attr=a, name=v)
+             for a in attrs for v in (COLORS[:colors] if a.name == "颜色" else SIZES[:sizes])])
+        values = {}
+        for v in SaleAttrValue.objects.filter(spu_sale_attr__in=attrs).select_related("spu_sale_attr"):
+            values.setdefault((v.spu_sale_attr.spu_id, v.spu_sale_attr.name), []).append(v)
+
+        SPUSpec.objects.bulk_create([SPUSpec(spu=s, name="产地") for s in spu_objs])
+        specs = {s.spu_id: s for s in SPUSpec.objects.filter(spu__in=spu_objs)}
+
+        sku_objs, sku_values = [], []
+        for spu in spu_objs:
+            for color, size in product(values[(spu.id, "颜色")], values[(spu.id, "尺寸")]):
+                price = Decimal(rng.randint(50, 2000))
+                sku_objs.append(SKU(
+                    name=f"{spu.name}{color.name}{size.name}"[:50], caption="压测商品", spu=spu,
+                    price=price, cost_price=price * Decimal("0.6"), market_price=price * Decimal("1.2"),
+                    stock=stock, sales=rng.randint(0, 10000), default_image_url="sku/bench.png",
+                ))
+                sku_values.append((color, size))
+        SKU.objects.bulk_create(sku_objs)
+        sku_objs = list(SKU.objects.filter(spu__in=spu_objs).order_by("id"))
+
+        through = SKU.sale_attr_value.through
+        through.objects.bulk_create([
+            through(sku_id=sku.id, saleattrvalue_id=v.id)
+            for sku, pair in zip(sku_objs, sku_values) for v in pair
+        ])
+        SKUImage.objects.bulk_create([SKUImage(sku=sku, image="sku_images/bench.png") for sku in sku_objs])
+        SPUSpecValue.objects.bulk_create([
+            SPUSpecValue(sku=sku, spu_spec=specs[sku.spu_id], name="中国") for sku in sku_objs
+        ])
+
+    return len(sku_objs)
+
+
+def seed_users(count=100):
+    """
+    功能函数:生成压测用户(bench_0, bench_1 ...),每个用户一个默认收货地址
+    已存在的用户跳过
+    返回: 用户名列表
+    """
+    from users.models import Address, UserProfile
+
+    names = [f"{BENCH_PREFIX}_{i}" for i in range(count)]
+    exists = set(UserProfile.objects.filter(username__in=names).values_list("username", flat=True))
+    with transaction.atomic():
+        UserProfile.objects.bulk_create([
+            UserProfile(username=n, password="-", email=f"{n}@bench.local", phone=f"199{i:08d}", is_active=True)
+            for i, n in enumerate(names) if n not in exists
+        ])
+        users = UserProfile.objects.filter(username__in=names).exclude(username__in=exists)
+        Address.objects.bulk_create([
+            Address(user_profile=u, receiver="压测", address="北京市", postcode="100000",
+                    receiver_mobile="13800000000", tag="家", is_default=True)
+            for u in users
+        ])
+
+    return names
+
+
+def warm_caches():
+    """
+    功能函数:生成详情文档和首页数据(bulk_create不触发信号)
+    """
+    from goods.documents import warm_documents
+    from goods.homepage import refresh_index_data
+
+    count = warm_documents()
+    refresh_index_data()
+    return count
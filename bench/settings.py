@@ -0,0 +1,53 @@
+"""
+压测配置:不依赖MySQL/Redis,使用SQLite + fakeredis
+DJANGO_SETTINGS_MODULE=settings (bench目录在PYTHONPATH中)
+项目代码直接读取dashop.settings模块,所以覆盖的配置同时写回dashop.settings
+使用真实的MySQL/Redis压测时,使用dashop.settings即可(python bench/run.py --settings dashop.settings)
+"""
+import os
+import tempfile
+
+import fakeredis
+import fakeredis.aioredis
+
+from dashop import settings as project_settings
+from dashop.settings import *  # noqa
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("BENCH_DATA_DIR") or os.path.join(tempfile.gettempdir(), "dashop_bench")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# 所有缓存共用一个进程内的fakeredis
+_server = fakeredis.FakeServer()
+_caches = {}
+for _alias, _conf in CACHES.items():  # noqa
+    _conf = dict(_conf)
+    _conf["OPTIONS"] = dict(_conf.get("OPTIONS", {}),
+                            CONNECTION_POOL_KWARGS={"connection_class": fakeredis.FakeConnection, "server": _server})
+    _caches[_alias] = _conf
+
+OVERRIDES = {
+    "DEBUG": False,
+    "ALLOWED_HOSTS": ["*"],
+    "DATABASES": {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(DATA_DIR, "bench.sqlite3"),
+            "CONN_MAX_AGE": DATABASES["default"]["CONN_MAX_AGE"],  # noqa
+            "CONN_HEALTH_CHECKS": True,
+        }
+    },
+    "CACHES": _caches,
+    "ASYNC_REDIS_POOL_KWARGS": {"connection_class": fakeredis.aioredis.FakeConnection, "server": _server},
+    "JWT_TOKEN_KEY": os.getenv("JWT_TOKEN_KEY") or "bench-jwt-key-0123456789abcdef0123456789",
+    # 压测时生成的支付宝密钥对(bench/run.py)
+    "ALIPAY_APPID": "bench",
+    "ALIPAY_KEY_DIR": os.path.join(DATA_DIR, "key_files") + os.sep,
+    "PAY_GATEWAY": "fake",
+    "SMS_PROVIDER": "stub",
+    "ORDER_ID_HOST_ID": 0,
+}
+
+globals().update(OVERRIDES)
+for _name, _value in OVERRIDES.items():
+    setattr(project_settings, _name, _value)
@@ -0,0 +1,18 @@
+"""
+一次性迁移旧版本购物车数据
+python manage.py migrate_carts
+"""
+from django.core.management.base import BaseCommand
+
+from carts.store import migrate_legacy_carts
+
+
+class Command(BaseCommand):
+    help = "把pickle存储的购物车数据迁移到Redis Hash结构"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", action="store_true", help="迁移后保留旧数据")
+
+    def handle(self, *args, **options):
+        migrated = migrate_legacy_carts(delete=not options["keep"])
+        self.stdout.write(self.style.SUCCESS(f"迁移完成,共迁移{migrated}个购物车"))
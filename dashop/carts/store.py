@@ -0,0 +1,271 @@
+"""
+购物车存储引擎
+每个用户的购物车是Redis中的一个Hash:
+"carts_hash_1": {
+    "1": 7,
+    "2": 4,
+}
+# Redis-key: carts_hash_1 其中1代表用户id
+# field: 商品的sku_id
+# value: 数量和选中状态打包后的整数 -> count * 2 + selected
+#        7 -> [3,1]  4 -> [2,0]
+所有的修改操作都是单条Redis命令或者一个Lua脚本,保证原子性,
+多个标签页同时操作购物车时不会互相覆盖
+"""
+from django.core.cache import caches
+from django_redis import get_redis_connection
+
+from utils.async_redis import get_async_redis
+
+# 购物车最多商品种类
+MAX_CART_SKUS = 100
+
+# 添加商品:数量累加并选中,其他商品全部取消选中
+# 返回值: -1代表超过商品种类上限,否则为购物车商品种类数
+ADD_SCRIPT = """
+if redis.call('HLEN', KEYS[1]) >= tonumber(ARGV[3]) and redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local vals = redis.call('HGETALL', KEYS[1])
+for i = 1, #vals, 2 do
+    local v = tonumber(vals[i + 1])
+    if vals[i] ~= ARGV[1] and v % 2 == 1 then
+        redis.call('HSET', KEYS[1], vals[i], v - 1)
+    end
+end
+local cur = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+redis.call('HSET', KEYS[1], ARGV[1], cur - cur % 2 + 2 * tonumber(ARGV[2]) + 1)
+return redis.call('HLEN', KEYS[1])
+"""
+
+# 修改数量:商品不存在时返回nil
+INCR_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return nil
+end
+return redis.call('HINCRBY', KEYS[1], ARGV[1], 2 * tonumber(ARGV[2]))
+"""
+
+# 单选/取消单选:商品不存在时返回nil
+SELECT_SCRIPT = """
+local cur = redis.call('HGET', KEYS[1], ARGV[1])
+if not cur then
+    return nil
+end
+cur = tonumber(cur)
+local v = cur - cur % 2 + tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], v)
+return v
+"""
+
+# 全选/取消全选:返回购物车商品种类数
+SELECT_ALL_SCRIPT = """
+local vals = redis.call('HGETALL', KEYS[1])
+for i = 1, #vals, 2 do
+    local v = tonumber(vals[i + 1])
+    redis.call('HSET', KEYS[1], vals[i], v - v % 2 + tonumber(ARGV[1]))
+end
+return #vals / 2
+"""
+
+
+def pack(count, selected):
+    """
+    功能函数:把[数量,选中状态]打包为一个整数
+    """
+    return int(count) * 2 + (1 if selected else 0)
+
+
+def unpack(value):
+    """
+    功能函数:把打包后的整数还原为[数量,选中状态]
+    """
+    count, selected = divmod(int(value), 2)
+    return [count, selected]
+
+
+def cart_key(user_id):
+    return f"carts_hash_{user_id}"
+
+
+def decode_items(raw):
+    """
+    功能函数:HGETALL的结果按sku_id排序并解包
+    {b"1": b"7"} -> {"1": [3, 1]}
+    """
+    items = sorted(raw.items(), key=lambda item: int(item[0]))
+    return {k.decode(): unpack(v) for k, v in items}
+
+
+# 购物车的Lua脚本操作: (脚本, 参数, 返回值转换)
+# CartStore和AsyncCartStore共用,同步和异步版本的参数和返回值不会不一致
+
+def add_op(sku_id, count, limit):
+    return ADD_SCRIPT, [str(sku_id), int(count), limit], lambda n: None if n == -1 else n
+
+
+def incr_op(sku_id, delta):
+    return INCR_SCRIPT, [str(sku_id), int(delta)], lambda v: None if v is None else unpack(v)[0]
+
+
+def select_op(sku_id, selected):
+    return SELECT_SCRIPT, [str(sku_id), 1 if selected else 0], lambda v: None if v is None else unpack(v)[1]
+
+
+def select_all_op(selected):
+    return SELECT_ALL_SCRIPT, [1 if selected else 0], int
+
+
+class BaseCartStore:
+    """
+    单个用户的购物车,子类只负责执行Redis命令(同步/异步)
+    """
+    # 注册后的Lua脚本,同步和异步客户端注册的脚本对象不同,每个子类一个
+    _scripts = None
+
+    def __init__(self, user_id, redis):
+        self.user_id = user_id
+        self.key = cart_key(user_id)
+        self.redis = redis
+
+    def _script(self, source):
+        # Lua脚本只注册一次,之后通过EVALSHA调用
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self.redis.register_script(source)
+        return script
+
+
+class CartStore(BaseCartStore):
+    """
+    单个用户的购物车
+    """
+    _scripts = {}
+
+    def __init__(self, user_id):
+        super().__init__(user_id, get_redis_connection("carts"))
+
+    def _run(self, op):
+        source, args, decode = op
+        return decode(self._script(source)(keys=[self.key], args=args, client=self.redis))
+
+    def all(self):
+        """
+        获取购物车数据的字典
+        {"1":[3,1], "2":[5,0]}
+        """
+        return decode_items(self.redis.hgetall(self.key))
+
+    def count(self):
+        """
+        购物车商品种类数
+        """
+        return self.redis.hlen(self.key)
+
+    def add(self, sku_id, count, limit=MAX_CART_SKUS):
+        """
+        添加商品:返回商品种类数,超过上限返回None
+        """
+        return self._run(add_op(sku_id, count, limit))
+
+    def incr(self, sku_id, delta=1):
+        """
+        修改商品数量:返回修改后的数量,商品不存在返回None
+        """
+        return self._run(incr_op(sku_id, delta))
+
+    def select(self, sku_id, selected=1):
+        """
+        单选/取消单选:商品不存在返回None
+        """
+        return self._run(select_op(sku_id, selected))
+
+    def select_all(self, selected=1):
+        """
+        全选/取消全选:返回商品种类数
+        """
+        return self._run(select_all_op(selected))
+
+    def remove(self, *sku_ids):
+        """
+        删除商品:返回(删除的种类数, 剩余的种类数)
+        """
+        if not sku_ids:
+            return 0, self.count()
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key, *[str(i) for i in sku_ids])
+        pipe.hlen(self.key)
+        removed, remain = pipe.execute()
+        return removed, remain
+
+    def replace(self, carts_dict):
+        """
+        用字典整体覆盖购物车(兼容旧接口)
+        """
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key)
+        if carts_dict:
+            mapping = {str(k): pack(*v) for k, v in carts_dict.items()}
+            pipe.hset(self.key, mapping=mapping)
+        pipe.execute()
+
+
+class AsyncCartStore(BaseCartStore):
+    """
+    单个用户的购物车(异步版本),方法和返回值与CartStore相同
+    """
+    _scripts = {}
+
+    def __init__(self, user_id):
+        super().__init__(user_id, get_async_redis("carts"))
+
+    async def _run(self, op):
+        source, args, decode = op
+        return decode(await self._script(source)(keys=[self.key], args=args, client=self.redis))
+
+    async def all(self):
+        return decode_items(await self.redis.hgetall(self.key))
+
+    async def count(self):
+        return await self.redis.hlen(self.key)
+
+    async def add(self, sku_id, count, limit=MAX_CART_SKUS):
+        return await self._run(add_op(sku_id, count, limit))
+
+    async def incr(self, sku_id, delta=1):
+        return await self._run(incr_op(sku_id, delta))
+
+    async def select(self, sku_id, selected=1):
+        return await self._run(select_op(sku_id, selected))
+
+    async def select_all(self, selected=1):
+        return await self._run(select_all_op(selected))
+
+    async def remove(self, *sku_ids):
+        if not sku_ids:
+            return 0, await self.count()
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key, *[str(i) for i in sku_ids])
+        pipe.hlen(self.key)
+        removed, remain = await pipe.execute()
+        return removed, remain
+
+
+def migrate_legacy_carts(delete=True):
+    """
+    功能函数:把旧版本pickle存储的购物车(carts_<user_id>)迁移到Hash结构
+    返回迁移的购物车数量
+    """
+    cache = caches["carts"]
+    migrated = 0
+    for key in cache.iter_keys("carts_*"):
+        carts_dict = cache.get(key)
+        store = CartStore(key[len("carts_"):])
+        # 新结构中已经有数据的以新数据为准
+        if carts_dict and not store.count():
+            store.replace(carts_dict)
+            migrated += 1
+        if delete:
+            cache.delete(key)
+
+    return migrated
@@ -1,3 +1,105 @@
-from django.test import TestCase
+from django.core.cache import caches
+
+from carts.store import AsyncCartStore, CartStore, migrate_legacy_carts, pack, unpack
+from utils.testing import RedisTestCase
+
+
+class CartStoreTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = CartStore(1)
+
+    def test_pack(self):
+        self.assertEqual(pack(3, 1), 7)
+        self.assertEqual(pack(2, 0), 4)
+        self.assertEqual(unpack(7), [3, 1])
+        self.assertEqual(unpack(b"4"), [2, 0])
+
+    def test_add(self):
+        self.assertEqual(self.store.add(1, 2), 1)
+        self.assertEqual(self.store.add(2, 1), 2)
+        self.assertEqual(self.store.add(1, 3), 2)
+
+        # 新添加的商品选中,其他商品取消选中
+        self.assertEqual(self.store.all(), {"1": [5, 1], "2": [1, 0]})
+
+    def test_add_limit(self):
+        self.store.add(1, 1, limit=2)
+        self.store.add(2, 1, limit=2)
+
+        self.assertIsNone(self.store.add(3, 1, limit=2))
+        self.assertEqual(self.store.add(2, 1, limit=2), 2)
+        self.assertEqual(self.store.count(), 2)
+
+    def test_incr(self):
+        self.store.add(1, 2)
+
+        self.assertEqual(self.store.incr(1), 3)
+        self.assertEqual(self.store.incr(1, -2), 1)
+        self.assertIsNone(self.store.incr(2))
+        self.assertEqual(self.store.all(), {"1": [1, 1]})
+
+    def test_select(self):
+        self.store.add(1, 2)
+        self.store.add(2, 3)
+
+        self.assertEqual(self.store.select(2, 0), 0)
+        self.assertIsNone(self.store.select(3, 1))
+        self.assertEqual(self.store.select_all(1), 2)
+        self.assertEqual(self.store.all(), {"1": [2, 1], "2": [3, 1]})
+        self.store.select_all(0)
+        self.assertEqual(self.store.all(), {"1": [2, 0], "2": [3, 0]})
+
+    def test_remove(self):
+        self.store.add(1, 1)
+        self.store.add(2, 1)
+
+        self.assertEqual(self.store.remove(1, 3), (1, 1))
+        self.assertEqual(self.store.remove(), (0, 1))
+        self.assertEqual(self.store.all(), {"2": [1, 1]})
+
+    def test_carts_are_per_user(self):
+        self.store.add(1, 1)
+
+        self.assertEqual(CartStore(2).all(), {})
+
+    def test_replace(self):
+        self.store.add(9, 1)
+
+        self.store.replace({"1": [3, 1], "2": [5, 0]})
+
+        self.assertEqual(self.store.all(), {"1": [3, 1], "2": [5, 0]})
+
+    def test_migrate_legacy_carts(self):
+        cache = caches["carts"]
+        cache.set("carts_1", {"1": [3, 1]})
+        cache.set("carts_2", {"2": [1, 1]})
+        CartStore(2).add(5, 1)
+
+        self.assertEqual(migrate_legacy_carts(), 1)
+
+        self.assertEqual(self.store.all(), {"1": [3, 1]})
+        # 新结构中已经有数据的以新数据为准
+        self.assertEqual(CartStore(2).all(), {"5": [1, 1]})
+        self.assertIsNone(cache.get("carts_1"))
+
+
+class AsyncCartStoreTest(RedisTestCase):
+    async def test_same_results_as_sync(self):
+        store = AsyncCartStore(1)
+
+        self.assertEqual(await store.add(1, 2), 1)
+        self.assertEqual(await store.add(2, 1), 2)
+        self.assertIsNone(await store.add(3, 1, limit=2))
+        self.assertEqual(await store.incr(2, 3), 4)
+        self.assertIsNone(await store.incr(3))
+        self.assertEqual(await store.select(1, 1), 1)
+        self.assertIsNone(await store.select(3, 1))
+        self.assertEqual(await store.select_all(0), 2)
+        self.assertEqual(await store.all(), {"1": [2, 0], "2": [4, 0]})
+        # 同步版本读写同一个购物车
+        self.assertEqual(CartStore(1).all(), await store.all())
+        self.assertEqual(await store.remove(1), (1, 1))
+        self.assertEqual(await store.remove(), (0, 1))
+        self.assertEqual(await store.count(), 1)
 
-# Create your tests here.
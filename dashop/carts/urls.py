@@ -1,7 +1,12 @@
 from django.urls import path
+
+from dashop import settings
 from . import views
 
+# ASGI部署时使用异步视图
+carts_view = views.AsyncCartsView if settings.ASYNC_VIEWS else views.CartsView
+
 urlpatterns = [
     # 购物车:v1/carts/<username>
-    path("<str:username>", views.CartsView.as_view()),
+    path("<str:username>", carts_view.as_view()),
 ]
@@ -14,3 +14,32 @@ app = Celery("dashop_group",
 
 # 3.设置自动发现任务
 app.autodiscover_tasks(settings.INSTALLED_APPS)
+
+# 4.定时任务
+app.conf.beat_schedule = {
+    # 刷新首页数据
+    "refresh-index": {
+        "task": "goods.tasks.refresh_index_task",
+        "schedule": settings.INDEX_REFRESH_INTERVAL,
+    },
+    # 秒杀商品销量同步到MySQL
+    "sync-flash-sales": {
+        "task": "orders.tasks.sync_flash_sales",
+        "schedule": settings.FLASH_SYNC_INTERVAL,
+    },
+    # 秒杀订单超时归还库存
+    "release-expired-flash-orders": {
+        "task": "orders.tasks.release_expired_flash_orders",
+        "schedule": 60,
+    },
+    # 发送发件箱中遗留的激活邮件(延迟任务丢失时兜底)
+    "flush-mail-outbox": {
+        "task": "users.tasks.flush_mail_outbox",
+        "schedule": 60,
+    },
+    # 待付款订单对账
+    "reconcile-unpaid-orders": {
+        "task": "orders.tasks.reconcile_unpaid_orders_task",
+        "schedule": settings.RECONCILE_INTERVAL,
+    },
+}
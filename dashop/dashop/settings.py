@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "utils.metrics.MetricsMiddleware",
+    "utils.log.RequestIdMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -87,6 +89,11 @@ DATABASES = {
         'USER': 'root',
         'PASSWORD': DB_PASSWORD,
         'NAME': 'dashop',
+        # 持久连接(秒):请求线程和并发查询线程池(utils/parallel.py)中的线程复用连接,不在每次调用前后重新连接
+        # ASGI部署(DASHOP_ASYNC_VIEWS=1)时按Django文档的建议关闭持久连接
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 0 if os.getenv("DASHOP_ASYNC_VIEWS") == "1" else 60)),
+        # 复用连接前检查连接是否可用(MySQL wait_timeout断开的连接自动重连)
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -108,6 +115,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# 用户密码哈希,迭代次数越大越安全,登录时CPU耗时越长(python bench/login_cost.py)
+PASSWORD_HASHERS = [
+    "users.credentials.PBKDF2PasswordHasher",
+]
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "150000"))
+
+# 登录失败限制: {维度: (窗口内最多失败次数, 窗口秒数)}
+# user_ip: 同一个IP登录同一个用户名 ip: 同一个IP user: 同一个用户名(所有IP,超限后只允许登录成功过的IP)
+LOGIN_FAIL_LIMITS = {
+    "user_ip": (5, 60 * 15),
+    "ip": (50, 60 * 15),
+    "user": (100, 60 * 60),
+}
+# 登录成功过的IP的保存时间(秒)
+LOGIN_TRUSTED_IP_TTL = 3600 * 24 * 30
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -162,6 +185,72 @@ CORS_PREFLIGHT_MAX_AGE = 3600 * 24  # 一天
 # -------------jwt配置-------------- #
 JWT_TOKEN_KEY = os.getenv("JWT_TOKEN_KEY")
 
+# -------------登录用户缓存配置-------------- #
+# 进程内LRU的容量和过期时间(秒)
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60
+# Redis中的过期时间(秒)
+USER_CACHE_REDIS_TTL = 3600 * 24
+
+# -------------收货地址缓存配置-------------- #
+ADDRESS_CACHE_TTL = 3600 * 24
+
+# -------------并发查询配置-------------- #
+# 订单确认页等聚合接口并发查询使用的线程数
+PARALLEL_WORKERS = 16
+# SKU卡片缓存时间(秒)
+SKU_CARD_TTL = 3600 * 24
+
+# -------------异步视图配置-------------- #
+# DASHOP_ASYNC_VIEWS=1时首页、详情页、购物车使用异步视图,用于ASGI部署(uvicorn)
+ASYNC_VIEWS = os.getenv("DASHOP_ASYNC_VIEWS") == "1"
+# 异步Redis连接池参数
+ASYNC_REDIS_POOL_KWARGS = {}
+
+# -------------请求统计配置-------------- #
+# 抽样统计的请求比例(0-1)
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0.1"))
+# True时统计所有请求,并在Server-Timing响应头中返回SQL/Redis次数和耗时
+METRICS_HEADER = DEBUG
+# 进程内数据合并到Redis的间隔(秒)
+METRICS_FLUSH_INTERVAL = 10
+# 允许访问/metrics的IP
+METRICS_ALLOWED_IPS = ["127.0.0.1"]
+
+# -------------日志配置-------------- #
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# 日志队列容量,队列满(输出跟不上)时丢弃日志
+LOG_QUEUE_SIZE = 10000
+# INFO及以下日志的抽样率,WARNING及以上全部输出
+LOG_SAMPLE_RATE = 1.0
+# 按路由设置抽样率,如 {"v1/goods/index": 0.01}
+LOG_SAMPLE_RATES = {}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "utils.log.JsonFormatter"},
+    },
+    "filters": {
+        "request": {"()": "utils.log.RequestFilter"},
+        "sampling": {"()": "utils.log.SamplingFilter"},
+    },
+    "handlers": {
+        # 请求线程只入队,后台线程输出到stderr
+        "queue": {
+            "class": "utils.log.QueueLogHandler",
+            "target": "logging.StreamHandler",
+            "formatter": "json",
+            "filters": ["request", "sampling"],
+        },
+    },
+    "root": {"handlers": ["queue"], "level": LOG_LEVEL},
+    "loggers": {
+        "django": {"handlers": ["queue"], "level": LOG_LEVEL, "propagate": False},
+    },
+}
+
 # -------------发送邮件设置-------------- #
 # 1.固定写法
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -175,6 +264,18 @@ EMAIL_HOST_USER = os.getenv("MAIL_HOST")
 EMAIL_HOST_PASSWORD = os.getenv("MAIL_TOKEN")
 # 与SMTP服务器通信时，是否启动TLS链接(安全链接)默认false
 EMAIL_USE_TLS = True
+# 6.SMTP连接超时时间(秒)
+EMAIL_TIMEOUT = 10
+
+# -------------激活邮件批量发送配置-------------- #
+# 每批邮件数量,发件箱积累到该数量时立即发送
+MAIL_BATCH_SIZE = 50
+# 发件箱中第一封邮件最多等待的时间(秒)
+MAIL_BATCH_WINDOW = 2
+# 单封邮件的最大发送次数,超过后进入死信队列
+MAIL_MAX_RETRIES = 3
+# 一批邮件超过该时间(秒)还没有处理完(发送进程退出),放回发件箱
+MAIL_PROCESSING_TIMEOUT = 60 * 10
 
 # -------------缓存配置-------------- #
 CACHES = {
@@ -223,12 +324,64 @@ CACHES = {
             # "PASSWORD": "",
         }
     },
+    # db6:秒杀商品库存
+    "flash": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/6",
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
 
+# -------------首页配置-------------- #
+# 每个类别展示的SKU数量
+INDEX_SKU_COUNT = 3
+# SKU排序方式: id-上架顺序, sales-销量
+INDEX_SKU_ORDER = "id"
+# 首页数据刷新间隔(秒)
+INDEX_REFRESH_INTERVAL = 60
+
+# -------------详情页配置-------------- #
+# 不存在或已下架的SKU的标记缓存时间(秒),重新上架时由信号覆盖
+SKU_DETAIL_GONE_TTL = 300
+
+# -------------订单编号配置-------------- #
+# 主机号(0-99),每个进程在主机内从Redis租用一个空闲的进程号(0-99),机器号 = 主机号 * 100 + 进程号
+# 不配置时每个进程从Redis租用一个空闲的全局机器号(0-9999)
+ORDER_ID_HOST_ID = os.getenv("ORDER_ID_HOST_ID")
+# 机器号的租约时间(秒),生成订单编号时每过三分之一的租约时间续期一次,进程退出后租约到期释放
+ORDER_ID_LEASE_TTL = 60
+
+# -------------秒杀配置-------------- #
+# 预扣库存后超过该时间(秒)还没有写入MySQL的订单,归还库存
+FLASH_ORDER_TIMEOUT = 60 * 5
+# 秒杀商品销量同步到MySQL的间隔(秒)
+FLASH_SYNC_INTERVAL = 10
+
 # -------------短信接口配置-------------- #
 SMS_ACCOUNT_SID = os.getenv("SMS_ACCOUNT_SID")
 SMS_TOKEN = os.getenv("SMS_TOKEN")
 SMS_APP_ID = os.getenv("SMS_APP_ID")
+# 短信服务商: ronglian-容联云 stub-本地模拟(压测用,不发送短信)
+SMS_PROVIDER = os.getenv("SMS_PROVIDER", "ronglian")
+# 每个进程保持的HTTPS连接数
+SMS_POOL_SIZE = 10
+# 模拟短信接口的耗时(秒)
+SMS_STUB_DELAY = 0
+
+# -------------短信验证码配置-------------- #
+# 滑动窗口限流规则: [(窗口秒数, 最多发送次数), ...]
+SMS_RATE_LIMITS = {
+    "phone": [(60, 1), (3600, 5), (86400, 10)],
+    "ip": [(3600, 20)],
+    "global": [(60, 1000)],
+}
+# 验证码有效期(秒)
+SMS_CODE_TTL = 300
+# 验证码最多校验次数,超过后需要重新获取
+SMS_CODE_MAX_ATTEMPTS = 5
 
 # -------------微博配置-------------- #
 WEIBO_CLIENT_ID = os.getenv("WEIBO_APP_KEY")
@@ -250,3 +403,22 @@ ALIPAY_NOTIFY_URL = "http://127.0.0.1:8000/v1/pays/notify_url"
 ALIPAY_RETURN_URL = "http://127.0.0.1:8000/v1/pays/return_url"
 # project/dashop/utils/key_files/
 ALIPAY_KEY_DIR = os.path.join(BASE_DIR, "utils/key_files/")
+# 检查密钥文件是否更新的间隔(秒)
+ALIPAY_KEY_CHECK_INTERVAL = 30
+# 支付成功通知时订单还不存在(秒杀订单还没有写入MySQL)的重试间隔(秒)和次数
+# 重试的总时间要超过秒杀订单的写入超时时间,重试用完后记录支付异常
+PAY_NOTIFY_RETRY_DELAY = 30
+PAY_NOTIFY_MAX_RETRIES = FLASH_ORDER_TIMEOUT * 2 // PAY_NOTIFY_RETRY_DELAY
+
+# -------------订单对账配置-------------- #
+# 支付网关: alipay-支付宝 fake-本地模拟网关(测试用)
+PAY_GATEWAY = os.getenv("PAY_GATEWAY", "alipay")
+# 订单支付超时时间(秒),超时未支付的订单取消并归还库存
+ORDER_PAY_TIMEOUT = 30 * 60
+# 创建不到该时间(秒)的订单不对账
+RECONCILE_MIN_AGE = 60
+# 每批订单数量、并发查询数量
+RECONCILE_BATCH_SIZE = 200
+RECONCILE_WORKERS = 8
+# 对账间隔(秒)
+RECONCILE_INTERVAL = 300
@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.urls import path, include
 
 from dashop import settings
+from utils.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -26,6 +27,8 @@ urlpatterns = [
     path("v1/goods/", include("goods.urls")),
     path("v1/carts/", include("carts.urls")),
     path("v1/orders/", include("orders.urls")),
+    path("v1/pays/", include("pays.urls")),
+    path("metrics", metrics_view),
 ]
 # MEDIA_URL: /media/
 # MEDIA_ROOT: /project/dashop/media
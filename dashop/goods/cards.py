@@ -0,0 +1,137 @@
+"""
+SKU卡片:购物车、订单确认页展示的商品信息
+卡片缓存在Redis(detail缓存)中,一次get_many读取
+# Redis-key: sku_card_1 其中1代表sku_id
+未命中的sku_id无论多少个,都只需要固定的SQL查询次数:
+1.SKU表 id__in 查询
+2.销售属性值表 + 销售属性表(JOIN)的预取查询
+商品数据变更时由信号(goods/signals.py)删除卡片缓存
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db.models import Prefetch
+
+from dashop import settings
+from goods.models import SKU, SaleAttrValue
+from utils import async_redis
+
+
+def card_key(sku_id):
+    return f"sku_card_{sku_id}"
+
+
+def sku_card_queryset():
+    """
+    功能函数:预取了销售属性和销售属性名称的SKU查询集
+    """
+    values = SaleAttrValue.objects.select_related("spu_sale_attr")
+    return SKU.objects.prefetch_related(Prefetch("sale_attr_value", queryset=values))
+
+
+def make_card(sku):
+    """
+    功能函数:组装单个SKU卡片
+    """
+    values = sku.sale_attr_value.all()
+    return {
+        "id": sku.id,
+        "name": sku.name,
+        "default_image_url": str(sku.default_image_url),
+        "price": sku.price,
+        "sku_sale_attr_name": [i.spu_sale_attr.name for i in values],
+        "sku_sale_attr_val": [i.name for i in values],
+        "is_launched": sku.is_launched
+    }
+
+
+def get_sku_cards(sku_ids, launched_only=False):
+    """
+    功能函数:批量获取SKU卡片,先读缓存,未命中的再查询MySQL
+    返回: {sku_id: card},不存在的sku_id不在字典中
+    """
+    sku_ids = {int(i) for i in sku_ids}
+    if not sku_ids:
+        return {}
+
+    cache = caches["detail"]
+    cached = cache.get_many([card_key(i) for i in sku_ids])
+    cards = {card["id"]: card for card in cached.values()}
+
+    missing = sku_ids - set(cards)
+    if missing:
+        built = {sku.id: make_card(sku) for sku in sku_card_queryset().filter(id__in=missing)}
+        if built:
+            cache.set_many({card_key(k): v for k, v in built.items()}, settings.SKU_CARD_TTL)
+        cards.update(built)
+
+    if launched_only:
+        cards = {k: v for k, v in cards.items() if v["is_launched"]}
+
+    return cards
+
+
+def invalidate_cards(sku_ids):
+    """
+    功能函数:删除SKU卡片缓存
+    """
+    sku_ids = set(sku_ids)
+    if sku_ids:
+        caches["detail"].delete_many([card_key(i) for i in sku_ids])
+
+
+def make_line(card, count, selected):
+    """
+    功能函数:SKU卡片 + 数量和选中状态 = 购物车中的一行
+    """
+    return {
+        "id": card["id"],
+        "name": card["name"],
+        "count": count,
+        "selected": selected,
+        "default_image_url": card["default_image_url"],
+        "price": card["price"],
+        "sku_sale_attr_name": card["sku_sale_attr_name"],
+        "sku_sale_attr_val": card["sku_sale_attr_val"]
+    }
+
+
+async def aget_sku_cards(sku_ids, launched_only=False):
+    """
+    功能函数:get_sku_cards的异步版本,缓存未命中的SKU在线程中查询MySQL
+    """
+    sku_ids = {int(i) for i in sku_ids}
+    cached = await async_redis.cache_get_many("detail", [card_key(i) for i in sku_ids])
+    cards = {card["id"]: card for card in cached.values()}
+
+    missing = sku_ids - set(cards)
+    if missing:
+        cards.update(await sync_to_async(get_sku_cards)(missing))
+
+    if launched_only:
+        cards = {k: v for k, v in cards.items() if v["is_launched"]}
+
+    return cards
+
+
+def build_cart_lines(carts_dict, launched_only=False):
+    """
+    功能函数:根据购物车数据字典组装商品列表,顺序和购物车一致
+    carts_dict: {"1":[3,1], "2":[5,0]}
+    """
+    return make_cart_lines(carts_dict, get_sku_cards(carts_dict, launched_only))
+
+
+async def abuild_cart_lines(carts_dict, launched_only=False):
+    return make_cart_lines(carts_dict, await aget_sku_cards(carts_dict, launched_only))
+
+
+def make_cart_lines(carts_dict, cards):
+    lines = []
+    for sku_id, (count, selected) in carts_dict.items():
+        card = cards.get(int(sku_id))
+        # 商品已被删除
+        if card is None:
+            continue
+        lines.append(make_line(card, count, selected))
+
+    return lines
@@ -0,0 +1,167 @@
+"""
+SKU详情文档
+详情页的数据按sku_id预先生成,永久存储在Redis(detail缓存)中
+# Redis-key: sku_detail_1 其中1代表sku_id
+商品数据变更时由信号(goods/signals.py)重建文档,详情页请求直接读取文档,不查询MySQL
+不存在或已下架的SKU保存一个短期的标记(GONE),扫描不存在的id时不会每次都查询MySQL
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db.models import Prefetch
+
+from dashop import settings
+from goods.models import SKU, SKUImage, SPUSaleAttr, SaleAttrValue, SPUSpecValue
+from utils import async_redis
+from utils.swr_cache import arecord, record, single_flight
+
+# 批量生成文档时每批的SKU数量
+BATCH_SIZE = 500
+# 不存在或已下架的SKU的标记,过期时间为SKU_DETAIL_GONE_TTL
+GONE = "gone"
+
+
+def detail_key(sku_id):
+    return f"sku_detail_{sku_id}"
+
+
+def detail_queryset():
+    """
+    功能函数:生成详情文档需要的所有数据,查询次数固定,和SKU数量无关
+    """
+    return SKU.objects.filter(is_launched=True).select_related("spu__catalog").prefetch_related(
+        Prefetch("skuimage_set", queryset=SKUImage.objects.order_by("id")),
+        Prefetch("sale_attr_value", queryset=SaleAttrValue.objects.select_related("spu_sale_attr")),
+        Prefetch("spu__spusaleattr_set", queryset=SPUSaleAttr.objects.prefetch_related("saleattrvalue_set")),
+        Prefetch("spuspecvalue_set", queryset=SPUSpecValue.objects.select_related("spu_spec")),
+    )
+
+
+def build_document(sku):
+    """
+    功能函数:组装单个SKU的详情文档
+    sku必须来自detail_queryset()
+    """
+    data = {}
+
+    # 类1:类别id 类别name
+    cata = sku.spu.catalog
+    data["catalog_id"] = cata.id
+    data["catalog_name"] = cata.name
+
+    # 类2：SKU
+    data["name"] = sku.name
+    data["caption"] = sku.caption
+    data["price"] = sku.price
+    data["image"] = str(sku.default_image_url)
+    data["spu"] = sku.spu.id
+
+    # 类3：详情图片
+    imgs = sku.skuimage_set.all()
+    data["detail_image"] = str(imgs[0].image) if imgs else ""
+
+    # 类4：销售属性
+    attr_values = sku.sale_attr_value.all()
+    data["sku_sale_attr_id"] = [i.spu_sale_attr.id for i in attr_values]
+    data["sku_sale_attr_names"] = [i.spu_sale_attr.name for i in attr_values]
+
+    # 类5：销售属性值
+    data["sku_sale_attr_val_id"] = [i.id for i in attr_values]
+    data["sku_sale_attr_val_names"] = [i.name for i in attr_values]
+
+    # 销售属性和销售属性值的对应关系
+    """
+    "sku_all_sale_attr_vals_id": {
+        "7": [11, 12],
+        "8": [13]
+    },
+    "sku_all_sale_attr_vals_name": {
+        "7": ["18寸", "19寸"],
+        "8": ["蓝色"]
+    },
+    """
+    dic1 = {}
+    dic2 = {}
+    for attr in sku.spu.spusaleattr_set.all():
+        values = attr.saleattrvalue_set.all()
+        dic1[attr.id] = [i.id for i in values]
+        dic2[attr.id] = [i.name for i in values]
+
+    data["sku_all_sale_attr_vals_id"] = dic1
+    data["sku_all_sale_attr_vals_name"] = dic2
+
+    # 类6和类7：规格属性名和规格属性值
+    spec = {}
+    for spe in sku.spuspecvalue_set.all():
+        # key: 规格属性的名字 value: 规格属性值的名字
+        spec[spe.spu_spec.name] = spe.name
+
+    data["spec"] = spec
+
+    return data
+
+
+def rebuild_documents(sku_ids):
+    """
+    功能函数:重建指定SKU的详情文档
+    已下架或已删除的SKU的文档替换为GONE标记
+    返回: {sku_id: 文档}
+    """
+    sku_ids = set(sku_ids)
+    if not sku_ids:
+        return {}
+
+    docs = {sku.id: build_document(sku) for sku in detail_queryset().filter(id__in=sku_ids)}
+
+    cache = caches["detail"]
+    if docs:
+        cache.set_many({detail_key(k): v for k, v in docs.items()}, timeout=None)
+    gone = sku_ids - set(docs)
+    if gone:
+        cache.set_many({detail_key(i): GONE for i in gone}, timeout=settings.SKU_DETAIL_GONE_TTL)
+
+    return docs
+
+
+def warm_documents(batch_size=BATCH_SIZE):
+    """
+    功能函数:批量生成所有上架SKU的详情文档
+    返回: 生成的文档数量
+    """
+    ids = list(SKU.objects.filter(is_launched=True).order_by("id").values_list("id", flat=True))
+    total = 0
+    for i in range(0, len(ids), batch_size):
+        total += len(rebuild_documents(ids[i:i + batch_size]))
+
+    return total
+
+
+def get_document(sku_id):
+    """
+    功能函数:获取SKU详情文档
+    文档不存在时(新上架、Redis数据丢失)现场生成,同一个SKU只有一个请求生成
+    SKU不存在或已下架返回None
+    """
+    key = detail_key(sku_id)
+    doc = caches["detail"].get(key)
+    if doc is not None:
+        record("detail", "hit")
+        return None if doc == GONE else doc
+
+    doc = single_flight("detail", key,
+                        build=lambda: rebuild_documents([sku_id]).get(sku_id, GONE),
+                        read=lambda: caches["detail"].get(key),
+                        name="detail")
+    return None if doc == GONE else doc
+
+
+async def aget_document(sku_id):
+    """
+    功能函数:get_document的异步版本
+    命中时只有一次异步Redis读取,未命中时在线程中生成
+    """
+    doc = await async_redis.cache_get("detail", detail_key(sku_id))
+    if doc is not None:
+        await arecord("detail", "hit")
+        return None if doc == GONE else doc
+
+    return await sync_to_async(get_document)(sku_id)
@@ -0,0 +1,123 @@
+"""
+首页数据
+所有类别的前N个SKU用一条窗口函数查询获取:
+ROW_NUMBER() OVER (PARTITION BY catalog_id ORDER BY ...)
+首页数据由celery定时任务(goods.tasks.refresh_index_task)刷新,
+首页请求始终读取最后一次成功生成的数据
+"""
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from dashop import settings
+from goods.models import Catalog, SKU
+from utils import async_redis
+from utils.swr_cache import arecord, record, single_flight
+
+# Redis-key: 首页数据
+INDEX_KEY = "index_data"
+
+# 排序方式
+ORDERINGS = {
+    "id": ["id"],
+    "sales": ["-sales", "id"],
+}
+
+
+def top_skus(limit, order="id"):
+    """
+    功能函数:查询每个类别的前limit个SKU
+    返回: {catalog_id: [sku, sku, ...]}
+    """
+    ordering = ORDERINGS[order]
+    skus = SKU.objects.only("id", "name", "caption", "price", "default_image_url", "sales").annotate(
+        cata_id=F("spu__catalog_id"))
+    result = {}
+
+    if connection.features.supports_over_clause:
+        # 一条查询:窗口函数按类别分组编号,只取每组前limit个
+        skus = skus.annotate(
+            cata_rank=Window(RowNumber(), partition_by=F("spu__catalog_id"), order_by=ordering)
+        ).filter(cata_rank__lte=limit).order_by("cata_id", "cata_rank")
+        for sku in skus:
+            result.setdefault(sku.cata_id, []).append(sku)
+    else:
+        # 不支持窗口函数的数据库:一条按类别排序的查询,在Python中截取
+        for sku in skus.order_by("cata_id", *ordering).iterator():
+            cata_skus = result.setdefault(sku.cata_id, [])
+            if len(cata_skus) < limit:
+                cata_skus.append(sku)
+
+    return result
+
+
+def build_index_data(limit=None, order=None):
+    """
+    功能函数:生成首页数据
+    [{"catalog_id":1, "catalog_name":"xxx", "sku":[{},{},{}]}, ...]
+    """
+    limit = limit or settings.INDEX_SKU_COUNT
+    order = order or settings.INDEX_SKU_ORDER
+    cata_skus = top_skus(limit, order)
+
+    data = []
+    for cata in Catalog.objects.all():
+        sku_list = []
+        for sku in cata_skus.get(cata.id, []):
+            sku_dict = {
+                "skuid": sku.id,
+                "caption": sku.caption,
+                "name": sku.name,
+                "price": sku.price,
+                "image": str(sku.default_image_url)
+            }
+            sku_list.append(sku_dict)
+
+        cata_dict = {
+            "catalog_id": cata.id,
+            "catalog_name": cata.name,
+            "sku": sku_list
+        }
+        data.append(cata_dict)
+
+    return data
+
+
+def refresh_index_data():
+    """
+    功能函数:重新生成首页数据并存入Redis
+    生成失败时抛出异常,Redis中保留上一次的数据
+    """
+    data = build_index_data()
+    caches["index"].set(INDEX_KEY, data, timeout=None)
+    return data
+
+
+def get_index_data():
+    """
+    功能函数:获取首页数据
+    定时任务还没有运行过(首次部署、Redis数据丢失)时现场生成,只有一个请求生成
+    """
+    data = caches["index"].get(INDEX_KEY)
+    if data is not None:
+        record("index", "hit")
+        return data
+
+    return single_flight("index", INDEX_KEY,
+                         build=refresh_index_data,
+                         read=lambda: caches["index"].get(INDEX_KEY),
+                         name="index")
+
+
+async def aget_index_data():
+    """
+    功能函数:get_index_data的异步版本
+    """
+    data = await async_redis.cache_get("index", INDEX_KEY)
+    if data is not None:
+        await arecord("index", "hit")
+        return data
+
+    return await sync_to_async(get_index_data)()
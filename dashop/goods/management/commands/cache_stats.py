@@ -0,0 +1,25 @@
+"""
+查看缓存命中统计
+python manage.py cache_stats
+"""
+from django.core.management.base import BaseCommand
+
+from utils.swr_cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "查看缓存命中/未命中/返回旧数据/刷新/等待重建的次数(各进程每METRICS_FLUSH_INTERVAL秒合并一次)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="查看后清空统计数据")
+
+    def handle(self, *args, **options):
+        for name, counts in sorted(get_stats().items()):
+            total = sum(counts.values())
+            hit = counts.get("hit", 0)
+            rate = hit / total * 100 if total else 0
+            detail = " ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+            self.stdout.write(f"{name}: {detail} hit_rate={rate:.1f}%")
+
+        if options["reset"]:
+            reset_stats()
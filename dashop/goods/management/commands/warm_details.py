@@ -0,0 +1,18 @@
+"""
+批量生成所有上架SKU的详情文档
+python manage.py warm_details
+"""
+from django.core.management.base import BaseCommand
+
+from goods.documents import BATCH_SIZE, warm_documents
+
+
+class Command(BaseCommand):
+    help = "批量生成所有上架SKU的详情文档"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每批的SKU数量")
+
+    def handle(self, *args, **options):
+        total = warm_documents(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"生成完成,共{total}个详情文档"))
@@ -0,0 +1,78 @@
+"""
+商品数据变更信号
+数据变更提交后,重建受影响SKU的详情文档,删除SKU卡片缓存
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from goods.cards import invalidate_cards
+from goods.documents import rebuild_documents
+from goods.models import Catalog, SPU, SKU, SKUImage, SPUSaleAttr, SaleAttrValue, SPUSpec, SPUSpecValue
+
+
+def schedule_rebuild(sku_ids):
+    """
+    功能函数:事务提交之后再重建,避免读到未提交的数据
+    """
+    sku_ids = set(sku_ids)
+    if sku_ids:
+        def rebuild():
+            invalidate_cards(sku_ids)
+            rebuild_documents(sku_ids)
+
+        transaction.on_commit(rebuild)
+
+
+def skus_of_spu(spu_id):
+    return SKU.objects.filter(spu_id=spu_id).values_list("id", flat=True)
+
+
+@receiver([post_save, post_delete], sender=SKU)
+def sku_changed(sender, instance, **kwargs):
+    schedule_rebuild([instance.id])
+
+
+@receiver([post_save, post_delete], sender=SKUImage)
+@receiver([post_save, post_delete], sender=SPUSpecValue)
+def sku_part_changed(sender, instance, **kwargs):
+    schedule_rebuild([instance.sku_id])
+
+
+@receiver([post_save, post_delete], sender=SPU)
+def spu_changed(sender, instance, **kwargs):
+    schedule_rebuild(skus_of_spu(instance.id))
+
+
+@receiver([post_save, post_delete], sender=SPUSaleAttr)
+@receiver([post_save, post_delete], sender=SPUSpec)
+def spu_part_changed(sender, instance, **kwargs):
+    schedule_rebuild(skus_of_spu(instance.spu_id))
+
+
+@receiver([post_save, post_delete], sender=SaleAttrValue)
+def sale_attr_value_changed(sender, instance, **kwargs):
+    skus = SKU.objects.filter(spu__spusaleattr=instance.spu_sale_attr_id).values_list("id", flat=True)
+    schedule_rebuild(skus)
+
+
+@receiver(post_save, sender=Catalog)
+def catalog_changed(sender, instance, **kwargs):
+    skus = SKU.objects.filter(spu__catalog=instance).values_list("id", flat=True)
+    schedule_rebuild(skus)
+
+
+@receiver(m2m_changed, sender=SKU.sale_attr_value.through)
+def sku_sale_attr_value_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        # sku.sale_attr_value.add(...)
+        schedule_rebuild([instance.id])
+    elif pk_set:
+        # sale_attr_value.sku_set.add(...)
+        schedule_rebuild(pk_set)
+    else:
+        # sale_attr_value.sku_set.clear()
+        schedule_rebuild(SKU.objects.filter(spu__spusaleattr=instance.spu_sale_attr_id).values_list("id", flat=True))
@@ -0,0 +1,95 @@
+"""
+库存扣减
+一条SQL完成库存检查和扣减:
+UPDATE goods_sku SET stock=stock-n, sales=sales+n, version=version+1
+WHERE id=? AND is_launched=1 AND stock>=n
+不会超卖,也不会在Python代码执行期间一直持有行锁
+购物车结算一次扣减多个SKU,见decrement_locked
+"""
+from datetime import datetime
+
+from django.db.models import Case, F, IntegerField, When
+
+from goods.models import SKU
+
+# 失败原因
+OFF_SHELF = "off_shelf"
+NOT_ENOUGH = "not_enough"
+
+
+class StockError(Exception):
+    """
+    库存扣减失败
+    failures: [{"sku_id":1, "name":"xxx", "reason":"not_enough", "count":3, "stock":1}, ...]
+    """
+
+    def __init__(self, failures):
+        super().__init__(failures)
+        self.failures = failures
+
+
+def decrement(sku_id, count):
+    """
+    功能函数:条件UPDATE扣减库存,返回是否成功
+    """
+    rows = SKU.objects.filter(id=sku_id, is_launched=True, stock__gte=count).update(
+        stock=F("stock") - count,
+        sales=F("sales") + count,
+        version=F("version") + 1,
+        updated_time=datetime.now(),
+    )
+    return rows == 1
+
+
+def reserve(sku_id, count):
+    """
+    功能函数:扣减单个SKU的库存
+    UPDATE没有命中时重新查询,区分下架和库存不足
+    失败抛出StockError
+    """
+    if decrement(sku_id, count):
+        return
+
+    sku = SKU.objects.filter(id=sku_id).values("name", "stock", "is_launched").first()
+    failure = {"sku_id": sku_id, "count": count}
+    if not sku or not sku["is_launched"]:
+        raise StockError([dict(failure, reason=OFF_SHELF, name=sku and sku["name"], stock=0)])
+    raise StockError([dict(failure, reason=NOT_ENOUGH, name=sku["name"], stock=sku["stock"])])
+
+
+def adjust(items, sign):
+    """
+    功能函数:一条UPDATE修改多个SKU的库存和销量
+    UPDATE goods_sku SET stock = CASE id WHEN 1 THEN stock-3 ... END, ...
+    sign: -1扣减库存 1归还库存
+    """
+    if not items:
+        return 0
+
+    def case(field, s):
+        whens = [When(id=k, then=F(field) + s * v) for k, v in items.items()]
+        return Case(*whens, default=F(field), output_field=IntegerField())
+
+    return SKU.objects.filter(id__in=items).update(
+        stock=case("stock", sign),
+        sales=case("sales", -sign),
+        version=F("version") + 1,
+        updated_time=datetime.now(),
+    )
+
+
+def decrement_locked(items):
+    """
+    功能函数:扣减多个SKU的库存
+    调用前SKU已经被select_for_update锁定,并且已经校验过库存
+    items: {sku_id: count}
+    """
+    return adjust(items, -1)
+
+
+def release(items):
+    """
+    功能函数:归还库存(订单取消、下单失败)
+    items: {sku_id: count}
+    """
+    return adjust(items, 1)
@@ -0,0 +1,14 @@
+"""
+goods/tasks.py
+存放商品模块应用下所有的异步任务
+"""
+from dashop.celery import app
+from goods.homepage import refresh_index_data
+
+
+@app.task
+def refresh_index_task():
+    """
+    定时任务:刷新首页数据
+    """
+    refresh_index_data()
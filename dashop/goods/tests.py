@@ -1,3 +1,231 @@
-from django.test import TestCase
+import hashlib
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from goods import cards, documents, stock
+from goods.models import SKU, SPUSaleAttr, SaleAttrValue
+from orders.tests import make_sku
+from utils import swr_cache
+from utils.testing import RedisTestCase
+
+
+class DocumentTest(RedisTestCase):
+    def test_document_built_on_miss(self):
+        sku = make_sku()
+
+        doc = documents.get_document(sku.id)
+
+        self.assertEqual(doc["name"], sku.name)
+        with self.assertNumQueries(0):
+            self.assertEqual(documents.get_document(sku.id), doc)
+
+    def test_missing_sku_marked_gone(self):
+        self.assertIsNone(documents.get_document(999))
+
+        self.assertEqual(caches["detail"].get(documents.detail_key(999)), documents.GONE)
+        with self.assertNumQueries(0):
+            self.assertIsNone(documents.get_document(999))
+
+    def test_unlaunched_sku_replaced_by_gone(self):
+        sku = make_sku()
+        documents.get_document(sku.id)
+        sku.is_launched = False
+        sku.save()
+
+        documents.rebuild_documents([sku.id])
+
+        self.assertIsNone(documents.get_document(sku.id))
+
+
+class StockTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sku = make_sku(stock=5)
+
+    def stock_and_sales(self):
+        sku = SKU.objects.get(id=self.sku.id)
+        return sku.stock, sku.sales
+
+    def test_reserve(self):
+        stock.reserve(self.sku.id, 2)
+
+        self.assertEqual(self.stock_and_sales(), (3, 2))
+
+    def test_reserve_all(self):
+        stock.reserve(self.sku.id, 5)
+
+        self.assertEqual(self.stock_and_sales(), (0, 5))
+
+    def test_not_enough(self):
+        with self.assertRaises(stock.StockError) as cm:
+            stock.reserve(self.sku.id, 6)
+
+        self.assertEqual(cm.exception.failures[0]["reason"], stock.NOT_ENOUGH)
+        self.assertEqual(cm.exception.failures[0]["stock"], 5)
+        self.assertEqual(self.stock_and_sales(), (5, 0))
+
+    def test_off_shelf(self):
+        SKU.objects.filter(id=self.sku.id).update(is_launched=False)
+
+        for sku_id in (self.sku.id, 999):
+            with self.subTest(sku_id=sku_id), self.assertRaises(stock.StockError) as cm:
+                stock.reserve(sku_id, 1)
+            self.assertEqual(cm.exception.failures[0]["reason"], stock.OFF_SHELF)
+        self.assertEqual(self.stock_and_sales(), (5, 0))
+
+    def test_decrement_and_release_many(self):
+        other = make_sku(stock=5)
+
+        stock.decrement_locked({self.sku.id: 2, other.id: 3})
+        self.assertEqual(self.stock_and_sales(), (3, 2))
+        self.assertEqual(SKU.objects.get(id=other.id).stock, 2)
+
+        stock.release({self.sku.id: 2, other.id: 3})
+        self.assertEqual(self.stock_and_sales(), (5, 0))
+        self.assertEqual(SKU.objects.get(id=other.id).stock, 5)
+
+
+class SwrCachePageTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        swr_cache.reset_stats()
+        self.calls = 0
+
+        @swr_cache.swr_cache_page(60, name="test")
+        def view(request):
+            self.calls += 1
+            if request.GET.get("missing"):
+                return JsonResponse({"code": 404}, status=404)
+            return JsonResponse({"code": 200, "calls": self.calls})
+
+        self.view = view
+        self.factory = RequestFactory()
+
+    def get(self, path="/page"):
+        return self.view(self.factory.get(path))
+
+    def expire(self, path="/page", age=1):
+        # 缓存中的数据在age秒前过期
+        cache = caches["default"]
+        key = next(k for k in cache.keys("swr_page:*") if k.endswith(self.key_suffix(path)))
+        value, _, delta = cache.get(key)
+        cache.set(key, (value, time.time() - age, delta), 60)
+        return key
+
+    def key_suffix(self, path):
+        return hashlib.md5(f"http://testserver{path}".encode()).hexdigest()
+
+    def test_miss_then_hit(self):
+        first, second = self.get(), self.get()
+
+        self.assertEqual((first["X-Cache"], second["X-Cache"]), ("miss", "hit"))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(swr_cache.get_stats()["test"], {"miss": 1, "hit": 1})
+
+    def test_stale_served_while_refreshing(self):
+        self.get()
+        key = self.expire()
+        lock = caches["default"].lock(f"lock:{key}", timeout=10)
+        lock.acquire()
+        self.addCleanup(swr_cache.release, lock)
+
+        response = self.get()
+
+        self.assertEqual(response["X-Cache"], "stale")
+        self.assertIn(b'"calls": 1', response.content)
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_refreshed(self):
+        self.get()
+        self.expire()
+
+        response = self.get()
+
+        self.assertEqual(response["X-Cache"], "refresh")
+        self.assertIn(b'"calls": 2', response.content)
+        self.assertEqual(self.get()["X-Cache"], "hit")
+
+    def test_early_refresh(self):
+        # 重建耗时越长、越接近过期,越早刷新
+        self.get()
+        key = self.expire(age=-1)
+        value, expire, _ = caches["default"].get(key)
+        caches["default"].set(key, (value, expire, 5.0), 60)
+
+        with mock.patch.object(swr_cache.random, "random", return_value=0.1):
+            self.assertEqual(self.get()["X-Cache"], "refresh")
+
+    def test_error_response_not_cached(self):
+        self.assertEqual(self.get("/page?missing=1").status_code, 404)
+        self.assertEqual(self.get("/page?missing=1").status_code, 404)
+
+        self.assertEqual(self.calls, 2)
+
+    def test_post_not_cached(self):
+        self.view(self.factory.post("/page"))
+        self.view(self.factory.post("/page"))
+
+        self.assertEqual(self.calls, 2)
+
+
+class SkuCardTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.skus = [make_sku(price=p) for p in ("10.00", "20.00", "30.00")]
+        attr = SPUSaleAttr.objects.create(spu=self.skus[0].spu, name="颜色")
+        self.skus[0].sale_attr_value.add(SaleAttrValue.objects.create(spu_sale_attr=attr, name="红色"))
+        self.ids = [sku.id for sku in self.skus]
+
+    def test_fixed_queries_then_cached(self):
+        with self.assertNumQueries(2):
+            result = cards.get_sku_cards(self.ids)
+
+        self.assertEqual(set(result), set(self.ids))
+        card = result[self.ids[0]]
+        self.assertEqual((card["sku_sale_attr_name"], card["sku_sale_attr_val"]), (["颜色"], ["红色"]))
+        with self.assertNumQueries(0):
+            self.assertEqual(cards.get_sku_cards(self.ids), result)
+
+    def test_only_missing_queried(self):
+        cards.get_sku_cards(self.ids[:2])
+        caches["detail"].delete(cards.card_key(self.ids[0]))
+
+        with self.assertNumQueries(2):
+            result = cards.get_sku_cards(self.ids + [999])
+
+        self.assertEqual(set(result), set(self.ids))
+
+    def test_launched_only(self):
+        SKU.objects.filter(id=self.ids[1]).update(is_launched=False)
+
+        self.assertEqual(set(cards.get_sku_cards(self.ids, launched_only=True)), {self.ids[0], self.ids[2]})
+
+    def test_signal_invalidates_card(self):
+        cards.get_sku_cards(self.ids)
+        sku = self.skus[0]
+        sku.name = "新名称"
+        with self.captureOnCommitCallbacks(execute=True):
+            sku.save()
+
+        self.assertEqual(cards.get_sku_cards([sku.id])[sku.id]["name"], "新名称")
+
+    def test_cart_lines(self):
+        carts_dict = {str(self.ids[2]): [1, 1], "999": [2, 1], str(self.ids[0]): [3, 0]}
+
+        lines = cards.build_cart_lines(carts_dict)
+
+        # 顺序和购物车一致,已删除的商品跳过
+        self.assertEqual([(i["id"], i["count"], i["selected"]) for i in lines],
+                         [(self.ids[2], 1, 1), (self.ids[0], 3, 0)])
+
+    async def test_async_cards(self):
+        result = await cards.aget_sku_cards(self.ids)
+
+        self.assertEqual(set(result), set(self.ids))
+        self.assertEqual(await cards.aget_sku_cards(self.ids), result)
 
-# Create your tests here.
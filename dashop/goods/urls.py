@@ -1,9 +1,15 @@
 from django.urls import path
+
+from dashop import settings
 from . import views
 
+# ASGI部署时使用异步视图
+index_view = views.async_index_view if settings.ASYNC_VIEWS else views.index_view
+detail_view = views.async_detail_view if settings.ASYNC_VIEWS else views.detail_view
+
 urlpatterns = [
     # 首页展示:v1/goods/index
-    path("index", views.index_view),
+    path("index", index_view),
     # 详情页展示:v1/goods/detail/<sku_id>
-    path("detail/<int:sku_id>", views.detail_view),
+    path("detail/<int:sku_id>", detail_view),
 ]
@@ -0,0 +1,283 @@
+"""
+秒杀(热点商品)库存
+秒杀商品的库存预先加载到Redis,下单时由Lua脚本原子地检查并扣减,不访问MySQL的goods_sku行
+订单由celery任务异步写入MySQL,goods_sku的库存和销量由定时任务批量同步
+Redis中存储的数据结构如下:
+"flash_stock_1": 100                                    # 秒杀商品剩余库存,1代表sku_id
+"flash_info": {"1": '{"name":"xxx","price":"88.00"}'}    # 秒杀商品名称和价格
+"flash_orders": {"<order_id>": '{订单数据}'}              # 已预扣库存、还没有确认写入MySQL的订单
+"flash_deadline": zset <order_id> -> 预扣/开始写入的时间    # 超时未写入的订单归还库存
+订单在写入MySQL的事务提交后才从flash_orders中删除,写入过程中进程退出时由超时任务处理
+"flash_sales": {"1": 3}                                  # 已写入订单、还没有同步到goods_sku的数量
+"""
+import json
+import time
+
+from django_redis import get_redis_connection
+
+from goods import stock
+from goods.models import SKU
+
+ORDERS_KEY = "flash_orders"
+DEADLINE_KEY = "flash_deadline"
+INFO_KEY = "flash_info"
+SALES_KEY = "flash_sales"
+
+# 检查并扣减所有商品的库存,全部足够才扣减
+# KEYS: 库存key..., flash_orders, flash_deadline
+# ARGV: 数量..., order_id, 当前时间, 订单数据
+# 返回: {1}成功 {-1, i}第i个商品不是秒杀商品 {-2, i, 剩余库存}第i个商品库存不足
+RESERVE_SCRIPT = """
+local n = #ARGV - 3
+for i = 1, n do
+    local s = redis.call('GET', KEYS[i])
+    if not s then
+        return {-1, i}
+    end
+    if tonumber(s) < tonumber(ARGV[i]) then
+        return {-2, i, tonumber(s)}
+    end
+end
+for i = 1, n do
+    redis.call('DECRBY', KEYS[i], ARGV[i])
+end
+redis.call('HSET', KEYS[n + 1], ARGV[n + 1], ARGV[n + 3])
+redis.call('ZADD', KEYS[n + 2], ARGV[n + 2], ARGV[n + 1])
+return {1}
+"""
+
+# 读取待写入的订单,超时时间从开始写入时重新计算
+# KEYS: flash_orders, flash_deadline  ARGV: order_id, 当前时间
+CLAIM_SCRIPT = """
+local data = redis.call('HGET', KEYS[1], ARGV[1])
+if not data then
+    return nil
+end
+redis.call('ZADD', KEYS[2], 'XX', ARGV[2], ARGV[1])
+return data
+"""
+
+# 订单已写入MySQL:删除待写入的订单并记录销量,同一个订单只会记录一次
+# KEYS: flash_orders, flash_deadline, flash_sales  ARGV: order_id
+FINISH_SCRIPT = """
+local data = redis.call('HGET', KEYS[1], ARGV[1])
+if not data then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+for sku_id, count in pairs(cjson.decode(data)['items']) do
+    redis.call('HINCRBY', KEYS[3], sku_id, count)
+end
+return 1
+"""
+
+# 归还待写入订单的库存,同一个订单只会归还一次
+# 截止时间不为空时,只归还预扣/开始写入的时间不晚于截止时间的订单(超时任务读取后被worker读取的订单不归还)
+# KEYS: flash_orders, flash_deadline, 库存key...  ARGV: order_id, 截止时间, 数量...
+RELEASE_SCRIPT = """
+if ARGV[2] ~= '' then
+    local score = redis.call('ZSCORE', KEYS[2], ARGV[1])
+    if not score or tonumber(score) > tonumber(ARGV[2]) then
+        return 0
+    end
+end
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+for i = 3, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('INCRBY', KEYS[i], ARGV[i])
+    end
+end
+return 1
+"""
+
+# 归还库存,已经不是秒杀商品的跳过
+RESTOCK_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('INCRBY', KEYS[i], ARGV[i])
+    end
+end
+return 1
+"""
+
+# 取出并清空待同步的销量
+TAKE_SALES_SCRIPT = """
+local vals = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return vals
+"""
+
+_scripts = {}
+
+
+def get_redis():
+    return get_redis_connection("flash")
+
+
+def run(source, keys, args):
+    # Lua脚本只注册一次,之后通过EVALSHA调用
+    r = get_redis()
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = r.register_script(source)
+    return script(keys=keys, args=args, client=r)
+
+
+def stock_key(sku_id):
+    return f"flash_stock_{sku_id}"
+
+
+def hot_skus(sku_ids):
+    """
+    功能函数:返回sku_ids中的秒杀商品
+    """
+    sku_ids = list(sku_ids)
+    if not sku_ids:
+        return set()
+    pipe = get_redis().pipeline(transaction=False)
+    for sku_id in sku_ids:
+        pipe.exists(stock_key(sku_id))
+
+    return {i for i, e in zip(sku_ids, pipe.execute()) if e}
+
+
+def get_info(sku_ids):
+    """
+    功能函数:获取秒杀商品名称和价格
+    返回: {sku_id: {"name":"xxx", "price":"88.00"}}
+    """
+    sku_ids = list(sku_ids)
+    values = get_redis().hmget(INFO_KEY, [str(i) for i in sku_ids])
+    return {i: json.loads(v) for i, v in zip(sku_ids, values) if v}
+
+
+def load(sku_ids):
+    """
+    功能函数:把商品设置为秒杀商品,以MySQL中的库存为准加载到Redis
+    """
+    sync_sales()
+    skus = SKU.objects.filter(id__in=sku_ids, is_launched=True).only("id", "name", "price", "stock")
+    pipe = get_redis().pipeline()
+    for sku in skus:
+        pipe.set(stock_key(sku.id), sku.stock)
+        pipe.hset(INFO_KEY, sku.id, json.dumps({"name": sku.name, "price": str(sku.price)}))
+    pipe.execute()
+
+    return [sku.id for sku in skus]
+
+
+def unload(sku_ids):
+    """
+    功能函数:取消秒杀商品,之后下单直接扣减MySQL中的库存
+    """
+    pipe = get_redis().pipeline()
+    for sku_id in sku_ids:
+        pipe.delete(stock_key(sku_id))
+        pipe.hdel(INFO_KEY, sku_id)
+    pipe.execute()
+    sync_sales()
+
+
+def reserve(order_id, items, data):
+    """
+    功能函数:预扣秒杀商品库存,并记录待写入的订单
+    items: {sku_id: count}
+    data: 订单数据,由celery任务写入MySQL
+    失败抛出StockError
+    """
+    sku_ids = list(items)
+    keys = [stock_key(i) for i in sku_ids] + [ORDERS_KEY, DEADLINE_KEY]
+    args = [items[i] for i in sku_ids] + [order_id, time.time(), json.dumps(data)]
+    result = run(RESERVE_SCRIPT, keys, args)
+    if result[0] == 1:
+        return
+
+    sku_id = sku_ids[result[1] - 1]
+    failure = {"sku_id": sku_id, "count": items[sku_id], "name": get_info([sku_id]).get(sku_id, {}).get("name")}
+    if result[0] == -1:
+        failure.update(reason=stock.OFF_SHELF, stock=0)
+    else:
+        failure.update(reason=stock.NOT_ENOUGH, stock=result[2])
+    raise stock.StockError([failure])
+
+
+def claim(order_id):
+    """
+    功能函数:读取待写入的订单数据
+    订单仍保留在Redis中,写入的事务提交后由finish()删除
+    订单已被超时任务释放(或已经写入)时返回None
+    """
+    data = run(CLAIM_SCRIPT, [ORDERS_KEY, DEADLINE_KEY], [order_id, time.time()])
+    return None if data is None else json.loads(data)
+
+
+def finish(order_id):
+    """
+    功能函数:订单已写入MySQL,删除待写入的订单并记录销量
+    返回: 是否删除(重复调用返回False)
+    """
+    return run(FINISH_SCRIPT, [ORDERS_KEY, DEADLINE_KEY, SALES_KEY], [order_id]) == 1
+
+
+def release(order_id, cutoff=None):
+    """
+    功能函数:订单超时未写入(或写入失败),归还预扣的库存
+    cutoff: 超时任务读取订单时的截止时间,订单在这之后被worker读取时不归还
+    返回: 是否归还
+    """
+    data = get_redis().hget(ORDERS_KEY, order_id)
+    if data is None:
+        return False
+    items = json.loads(data)["items"]
+    keys = [ORDERS_KEY, DEADLINE_KEY] + [stock_key(i) for i in items]
+    args = [order_id, "" if cutoff is None else cutoff] + list(items.values())
+    return run(RELEASE_SCRIPT, keys, args) == 1
+
+
+def restock(items):
+    """
+    功能函数:归还秒杀商品库存(写入订单失败、订单取消)
+    items: {sku_id: count}
+    """
+    if items:
+        run(RESTOCK_SCRIPT, [stock_key(i) for i in items], list(items.values()))
+
+
+def expired_orders(cutoff):
+    """
+    功能函数:预扣(或开始写入)的时间不晚于cutoff、还没有确认写入MySQL的订单
+    """
+    ids = get_redis().zrangebyscore(DEADLINE_KEY, "-inf", cutoff)
+    return [i.decode() for i in ids]
+
+
+def record_sales(items):
+    """
+    功能函数:记录已写入订单的销量,等待同步到goods_sku
+    """
+    pipe = get_redis().pipeline()
+    for sku_id, count in items.items():
+        pipe.hincrby(SALES_KEY, sku_id, count)
+    pipe.execute()
+
+
+def sync_sales():
+    """
+    功能函数:把累计的销量一次性同步到goods_sku的库存和销量
+    同步失败时放回Redis,下次重试
+    """
+    vals = run(TAKE_SALES_SCRIPT, [SALES_KEY], [])
+    items = {int(vals[i]): int(vals[i + 1]) for i in range(0, len(vals), 2)}
+    if not items:
+        return items
+    try:
+        stock.adjust(items, -1)
+    except Exception:
+        record_sales(items)
+        raise
+
+    return items
@@ -0,0 +1,89 @@
+"""
+用户订单列表
+按(created_time, order_id)倒序的游标分页,不使用OFFSET,翻到第几页查询耗时都一样
+WHERE user_profile_id=? [AND status=?] AND (created_time<? OR (created_time=? AND order_id<?))
+ORDER BY created_time DESC, order_id DESC LIMIT ?
+使用索引(user_profile_id, created_time, order_id)
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Prefetch, Q
+
+from orders.models import OrderInfo, OrderGoods
+
+# 每页订单数量
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+def encode_cursor(order):
+    raw = f"{order.created_time.isoformat()}|{order.order_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    功能函数:解析游标,格式错误抛出ValueError
+    返回: (created_time, order_id)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_time, order_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_time), order_id
+    except Exception:
+        raise ValueError(cursor)
+
+
+def order_page(user_id, cursor=None, status=None, page_size=PAGE_SIZE):
+    """
+    功能函数:查询一页订单,订单商品和SKU一次预取
+    共2次查询,和订单数量、商品数量无关
+    返回: (订单列表, 下一页游标),没有下一页时游标为None
+    """
+    query = OrderInfo.objects.filter(user_profile_id=user_id)
+    if status is not None:
+        query = query.filter(status=status)
+    if cursor:
+        created_time, order_id = decode_cursor(cursor)
+        query = query.filter(Q(created_time__lt=created_time) | Q(created_time=created_time, order_id__lt=order_id))
+
+    goods = OrderGoods.objects.select_related("sku").only(
+        "order_info_id", "count", "price", "sku__id", "sku__name", "sku__default_image_url"
+    ).order_by("id")
+    orders = list(
+        query.order_by("-created_time", "-order_id")
+        .prefetch_related(Prefetch("ordergoods_set", queryset=goods))[:page_size + 1]
+    )
+
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_cursor(orders[-1])
+
+    return orders, next_cursor
+
+
+def make_order(order):
+    return {
+        "order_id": order.order_id,
+        "total_amount": order.total_amount,
+        "total_count": order.total_count,
+        "freight": order.freight,
+        "status": order.status,
+        "created_time": order.created_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "receiver": order.receiver,
+        "address": order.address,
+        "receiver_mobile": order.receiver_mobile,
+        "tag": order.tag,
+        "goods": [
+            {
+                "sku_id": g.sku.id,
+                "name": g.sku.name,
+                "default_image_url": str(g.sku.default_image_url),
+                "count": g.count,
+                "price": g.price,
+            }
+            for g in order.ordergoods_set.all()
+        ],
+    }
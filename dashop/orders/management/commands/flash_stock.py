@@ -0,0 +1,25 @@
+"""
+设置/取消秒杀商品
+python manage.py flash_stock 1 2 3
+python manage.py flash_stock 1 2 3 --unload
+"""
+from django.core.management.base import BaseCommand
+
+from orders import flash_sale
+
+
+class Command(BaseCommand):
+    help = "把商品库存加载到Redis作为秒杀商品,或者取消秒杀商品"
+
+    def add_arguments(self, parser):
+        parser.add_argument("sku_ids", nargs="+", type=int, help="sku_id")
+        parser.add_argument("--unload", action="store_true", help="取消秒杀商品")
+
+    def handle(self, *args, **options):
+        sku_ids = options["sku_ids"]
+        if options["unload"]:
+            flash_sale.unload(sku_ids)
+            self.stdout.write(self.style.SUCCESS(f"已取消秒杀商品: {sku_ids}"))
+        else:
+            loaded = flash_sale.load(sku_ids)
+            self.stdout.write(self.style.SUCCESS(f"已加载秒杀商品: {loaded}"))
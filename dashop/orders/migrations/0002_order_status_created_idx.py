@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderinfo',
+            name='status',
+            field=models.SmallIntegerField(choices=[(1, '待付款'), (2, '待发货'), (3, '待收货'), (4, '订单完成'), (5, '已取消')], verbose_name='订单状态'),
+        ),
+        migrations.AddIndex(
+            model_name='orderinfo',
+            index=models.Index(fields=['status', 'created_time'], name='order_status_created_idx'),
+        ),
+    ]
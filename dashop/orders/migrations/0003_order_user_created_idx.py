@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderinfo',
+            index=models.Index(fields=['user_profile', 'created_time', 'order_id'], name='order_user_created_idx'),
+        ),
+    ]
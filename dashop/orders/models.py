@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django.db import models
 from goods.models import SKU
 from users.models import UserProfile
@@ -6,7 +8,8 @@ STATUS_CHOICES = (
     (1, "待付款"),
     (2, "待发货"),
     (3, "待收货"),
-    (4, "订单完成")
+    (4, "订单完成"),
+    (5, "已取消")
 )
 
 
@@ -15,7 +18,7 @@ class OrderInfo(models.Model):
     # 用户表:订单表 ---> 1:n
     # 订单编号、订单总金额、支付方式、运费、订单状态、收货地址相关字段[反范式]
     user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
-    # 20220301143930007
+    # 2022030114393000700070001
     order_id = models.CharField(max_length=64, primary_key=True, verbose_name="订单编号")
     # 订单总金额、商品总数量
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="订单总金额")
@@ -38,6 +41,55 @@ class OrderInfo(models.Model):
 
     class Meta:
         db_table = "orders_order_info"
+        indexes = [
+            # 对账任务按创建时间扫描待付款订单
+            models.Index(fields=["status", "created_time"], name="order_status_created_idx"),
+            # 订单列表按用户、创建时间分页
+            models.Index(fields=["user_profile", "created_time", "order_id"], name="order_user_created_idx"),
+        ]
+
+    @classmethod
+    def create_order(cls, user, addr, order_id, skus, items):
+        """
+        功能函数:先算好总金额和总数量,订单表插入一次,订单商品表批量插入
+        items: {sku_id: count}
+        返回: (总金额, 总数量)
+        """
+        total_amount = sum(sku.price * items[sku.id] for sku in skus)
+        total_count = sum(items[sku.id] for sku in skus)
+
+        order = cls.objects.create(
+            user_profile=user,
+            order_id=order_id,
+            total_amount=total_amount,
+            total_count=total_count,
+            pay_method=1,
+            freight=0,
+            status=1,
+            receiver=addr.receiver,
+            address=addr.address,
+            receiver_mobile=addr.receiver_mobile,
+            tag=addr.tag,
+        )
+        OrderGoods.objects.bulk_create([
+            OrderGoods(order_info=order, sku=sku, count=items[sku.id], price=sku.price) for sku in skus
+        ])
+
+        return total_amount, total_count
+
+    @classmethod
+    def mark_paid(cls, order_id, total_amount):
+        """
+        功能函数:待付款 ---> 待发货
+        UPDATE ... WHERE order_id=? AND status=1 AND total_amount=?
+        重复通知、并发通知只有一次生效
+        返回: 是否修改
+        """
+        rows = cls.objects.filter(order_id=order_id, status=1, total_amount=total_amount).update(
+            status=2,
+            updated_time=datetime.now(),
+        )
+        return rows == 1
 
 
 class OrderGoods(models.Model):
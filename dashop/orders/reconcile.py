@@ -0,0 +1,155 @@
+"""
+待付款订单对账
+1.按(status, created_time)索引分批扫描待付款订单,每批按(created_time, order_id)继续,不使用OFFSET
+2.每批订单并发查询支付网关,并发数由RECONCILE_WORKERS限制
+3.已支付的订单: 待付款 ---> 待发货
+4.超过ORDER_PAY_TIMEOUT还没有支付的订单:先关闭支付宝交易(用户不能再支付),关闭成功或交易不存在时
+  待付款 ---> 已取消,批量归还库存;关闭失败(刚刚支付等)的订单下次对账时重新查询
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from dashop import settings
+from goods import stock
+from orders import flash_sale
+from orders.models import OrderInfo, OrderGoods
+from pays.gateway import CLOSED_STATUS, GatewayError, PAID_STATUS, get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+def pending_batches(before, batch_size):
+    """
+    功能函数:分批返回created_time早于before的待付款订单
+    WHERE status=1 AND created_time<? AND (created_time>? OR (created_time=? AND order_id>?))
+    ORDER BY created_time, order_id LIMIT ?
+    """
+    query = OrderInfo.objects.filter(status=1, created_time__lt=before).order_by("created_time", "order_id")
+    last = None
+    while True:
+        batch = query
+        if last is not None:
+            batch = batch.filter(
+                Q(created_time__gt=last["created_time"]) |
+                Q(created_time=last["created_time"], order_id__gt=last["order_id"])
+            )
+        batch = list(batch.values("order_id", "total_amount", "created_time")[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def call_gateway(func, order_ids, workers, action):
+    """
+    功能函数:并发调用网关接口
+    返回: {order_id: 返回值},调用失败的订单不在结果中
+    """
+
+    def call(order_id):
+        try:
+            return order_id, func(order_id)
+        except GatewayError as e:
+            logger.warning("trade %s error: order=%s %s", action, order_id, e)
+            return order_id, GatewayError
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(call, order_ids)
+        return {k: v for k, v in results if v is not GatewayError}
+
+
+def query_trades(gateway, order_ids, workers):
+    """
+    功能函数:并发查询交易状态
+    返回: {order_id: 交易信息或None},查询失败的订单不在结果中
+    """
+    return call_gateway(gateway.query, order_ids, workers, "query")
+
+
+def close_trades(gateway, order_ids, workers):
+    """
+    功能函数:并发关闭交易
+    返回: 关闭成功(或交易不存在)的订单
+    """
+    return list(call_gateway(gateway.close, order_ids, workers, "close"))
+
+
+def cancel_orders(order_ids):
+    """
+    功能函数:取消待付款订单并归还库存
+    秒杀商品的库存归还到Redis,销量差额由sync_sales同步到goods_sku
+    返回: 取消的订单数量
+    """
+    with transaction.atomic():
+        # 锁定订单,只处理仍然是待付款的订单(并发支付通知已修改的跳过)
+        ids = list(OrderInfo.objects.select_for_update().filter(order_id__in=order_ids, status=1)
+                   .values_list("order_id", flat=True))
+        if not ids:
+            return 0
+
+        OrderInfo.objects.filter(order_id__in=ids).update(status=5, updated_time=datetime.now())
+        rows = OrderGoods.objects.filter(order_info_id__in=ids).values("sku_id").annotate(total=Sum("count"))
+        items = {row["sku_id"]: row["total"] for row in rows}
+
+        hot = flash_sale.hot_skus(items)
+        stock.release({k: v for k, v in items.items() if k not in hot})
+        flash_items = {k: v for k, v in items.items() if k in hot}
+        if flash_items:
+            def restock():
+                flash_sale.restock(flash_items)
+                flash_sale.record_sales({k: -v for k, v in flash_items.items()})
+
+            transaction.on_commit(restock)
+
+    return len(ids)
+
+
+def reconcile_unpaid_orders(batch_size=None, workers=None, gateway=None):
+    """
+    功能函数:待付款订单对账
+    创建不到RECONCILE_MIN_AGE秒的订单用户可能正在支付,跳过
+    返回: {"paid": 已支付, "cancelled": 已取消, "pending": 仍待付款, "failed": 查询/关闭交易失败}
+    """
+    batch_size = batch_size or settings.RECONCILE_BATCH_SIZE
+    workers = workers or settings.RECONCILE_WORKERS
+    gateway = gateway or get_gateway()
+
+    now = datetime.now()
+    expire = now - timedelta(seconds=settings.ORDER_PAY_TIMEOUT)
+    stats = {"paid": 0, "cancelled": 0, "pending": 0, "failed": 0}
+
+    for batch in pending_batches(now - timedelta(seconds=settings.RECONCILE_MIN_AGE), batch_size):
+        trades = query_trades(gateway, [o["order_id"] for o in batch], workers)
+        expired, closed = [], []
+        for order in batch:
+            order_id = order["order_id"]
+            if order_id not in trades:
+                stats["failed"] += 1
+                continue
+
+            trade = trades[order_id]
+            if trade and trade.get("trade_status") in PAID_STATUS:
+                if OrderInfo.mark_paid(order_id, Decimal(trade.get("total_amount"))):
+                    stats["paid"] += 1
+                else:
+                    logger.error("reconcile paid order not updated: order=%s trade=%s", order_id, trade)
+            elif order["created_time"] < expire:
+                expired.append(order_id)
+                if trade and trade.get("trade_status") == CLOSED_STATUS:
+                    closed.append(order_id)
+            else:
+                stats["pending"] += 1
+
+        # 只取消支付宝交易已经关闭(或不存在)的订单
+        to_close = [i for i in expired if i not in closed]
+        closed += close_trades(gateway, to_close, workers) if to_close else []
+        stats["failed"] += len(expired) - len(closed)
+        if closed:
+            stats["cancelled"] += cancel_orders(closed)
+
+    return stats
@@ -0,0 +1,80 @@
+"""
+orders/tasks.py
+存放订单模块应用下所有的异步任务
+"""
+import time
+from decimal import Decimal
+
+from django.db import transaction
+
+from dashop import settings
+from dashop.celery import app
+from goods.models import SKU
+from orders import flash_sale
+from orders.models import OrderInfo
+from orders.reconcile import reconcile_unpaid_orders
+from users.models import UserProfile, Address
+
+
+@app.task
+def create_flash_order(order_id):
+    """
+    秒杀订单写入MySQL
+    库存已在Redis中预扣,这里只插入订单表和订单商品表
+    事务提交后才删除Redis中待写入的订单,提交前进程退出时由release_expired_flash_orders处理
+    """
+    data = flash_sale.claim(order_id)
+    if data is None:
+        # 已超时归还库存,或者已经写入
+        return
+
+    items = {int(k): v for k, v in data["items"].items()}
+    try:
+        # 下单时的用户、地址和价格都在订单数据中,不需要再查询
+        user = UserProfile(id=data["user_id"])
+        addr = Address(**data["address"])
+        skus = [SKU(id=int(k), price=Decimal(v)) for k, v in data["prices"].items()]
+        with transaction.atomic():
+            OrderInfo.create_order(user, addr, order_id, skus, items)
+            transaction.on_commit(lambda: flash_sale.finish(order_id))
+    except Exception:
+        if OrderInfo.objects.filter(order_id=order_id).exists():
+            # 重复投递的任务:订单已经写入
+            flash_sale.finish(order_id)
+            return
+        # 补偿:归还Redis中预扣的库存
+        flash_sale.release(order_id)
+        raise
+
+
+@app.task
+def sync_flash_sales():
+    """
+    定时任务:秒杀商品的销量批量同步到goods_sku
+    """
+    flash_sale.sync_sales()
+
+
+@app.task
+def release_expired_flash_orders():
+    """
+    定时任务:预扣库存后超时没有写入的订单,归还库存
+    已经写入MySQL(写入后进程退出,没有执行finish)的订单只删除待写入记录并记录销量
+    读取超时订单后、归还前被worker读取的订单重新计时,不归还
+    """
+    cutoff = time.time() - settings.FLASH_ORDER_TIMEOUT
+    order_ids = flash_sale.expired_orders(cutoff)
+    written = set(OrderInfo.objects.filter(order_id__in=order_ids).values_list("order_id", flat=True))
+    for order_id in order_ids:
+        if order_id in written:
+            flash_sale.finish(order_id)
+        else:
+            flash_sale.release(order_id, cutoff)
+
+
+@app.task
+def reconcile_unpaid_orders_task():
+    """
+    定时任务:待付款订单对账,已支付的修改状态,超时未支付的取消并归还库存
+    """
+    return reconcile_unpaid_orders()
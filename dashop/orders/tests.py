@@ -1,3 +1,572 @@
-from django.test import TestCase
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from carts.store import CartStore
+from dashop import settings
+from goods.cards import get_sku_cards
+from goods.models import Brand, Catalog, SKU, SPU
+from orders import flash_sale, history
+from orders.models import OrderGoods, OrderInfo
+from orders.reconcile import reconcile_unpaid_orders
+from orders.tasks import create_flash_order, release_expired_flash_orders
+from pays.gateway import FakeGateway, GatewayError
+from users.address_book import get_addresses
+from users.models import Address, UserProfile
+from utils import order_id, parallel
+from utils.helper import make_token
+from utils.testing import RedisTestCase
+
+
+def make_sku(stock=10, price="10.00"):
+    catalog = Catalog.objects.create(name="类别")
+    brand = Brand.objects.create(name="品牌", logo="brand/1.png", first_letter="P")
+    spu = SPU.objects.create(name="SPU", brand=brand, catalog=catalog)
+    return SKU.objects.create(name="SKU", caption="副标题", spu=spu, price=Decimal(price), cost_price=1,
+                              market_price=Decimal(price), stock=stock, default_image_url="sku/1.png")
+
+
+def make_user(username="tester"):
+    return UserProfile.objects.create(username=username, password="x", email=f"{username}@test.com",
+                                      phone="13800000000")
+
+
+class ReconcileTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeGateway.clear()
+        self.addCleanup(FakeGateway.clear)
+        self.user = make_user()
+        self.sku = make_sku(stock=10)
+
+    def make_order(self, order_id, count=2, age=3600 * 2):
+        order = OrderInfo.objects.create(
+            user_profile=self.user, order_id=order_id, total_amount=self.sku.price * count, total_count=count,
+            freight=0, status=1, receiver="张三", address="北京", receiver_mobile="13800000000", tag="家",
+        )
+        OrderGoods.objects.create(order_info=order, sku=self.sku, count=count, price=self.sku.price)
+        OrderInfo.objects.filter(order_id=order_id).update(created_time=datetime.now() - timedelta(seconds=age))
+        SKU.objects.filter(id=self.sku.id).update(stock=self.sku.stock - count)
+        return order
+
+    def status(self, order_id):
+        return OrderInfo.objects.get(order_id=order_id).status
+
+    def stock(self):
+        return SKU.objects.get(id=self.sku.id).stock
+
+    def test_paid_order(self):
+        self.make_order("A1")
+        FakeGateway.set_trade("A1", "TRADE_SUCCESS", "20.00")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["paid"], 1)
+        self.assertEqual(self.status("A1"), 2)
+        self.assertEqual(self.stock(), 8)
+
+    def test_paid_amount_mismatch_not_updated(self):
+        self.make_order("A1")
+        FakeGateway.set_trade("A1", "TRADE_SUCCESS", "0.01")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["paid"], 0)
+        self.assertEqual(self.status("A1"), 1)
+
+    def test_expired_without_trade_cancelled(self):
+        self.make_order("A1")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["cancelled"], 1)
+        self.assertEqual(self.status("A1"), 5)
+        self.assertEqual(self.stock(), 10)
+
+    def test_expired_waiting_trade_closed_before_cancel(self):
+        self.make_order("A1")
+        FakeGateway.set_trade("A1", "WAIT_BUYER_PAY", "20.00")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["cancelled"], 1)
+        self.assertEqual(FakeGateway.trades["A1"]["trade_status"], "TRADE_CLOSED")
+        self.assertEqual(self.status("A1"), 5)
+
+    def test_not_expired_order_pending(self):
+        self.make_order("A1", age=settings.RECONCILE_MIN_AGE + 60)
+        FakeGateway.set_trade("A1", "WAIT_BUYER_PAY", "20.00")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["pending"], 1)
+        self.assertEqual(FakeGateway.trades["A1"]["trade_status"], "WAIT_BUYER_PAY")
+        self.assertEqual(self.status("A1"), 1)
+
+    def test_recent_order_skipped(self):
+        self.make_order("A1", age=0)
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(sum(stats.values()), 0)
+
+    def test_paid_between_query_and_close_not_cancelled(self):
+        # 查询时等待支付,关闭前用户完成支付:关闭失败,订单保持待付款,下次对账时修改为已支付
+        class PayingGateway(FakeGateway):
+            def close(self, order_id):
+                FakeGateway.set_trade(order_id, "TRADE_SUCCESS", "20.00")
+                return super().close(order_id)
+
+        self.make_order("A1")
+        FakeGateway.set_trade("A1", "WAIT_BUYER_PAY", "20.00")
+
+        stats = reconcile_unpaid_orders(gateway=PayingGateway())
+
+        self.assertEqual(stats["cancelled"], 0)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(self.status("A1"), 1)
+        self.assertEqual(self.stock(), 8)
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+        self.assertEqual(stats["paid"], 1)
+        self.assertEqual(self.status("A1"), 2)
+
+    def test_gateway_error_left_pending(self):
+        self.make_order("A1")
+        FakeGateway.set_trade("A1", "ERROR", "20.00")
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(self.status("A1"), 1)
+
+    def test_close_error_left_pending(self):
+        self.make_order("A1")
+        with mock.patch.object(FakeGateway, "close", side_effect=GatewayError("timeout")):
+            stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(self.status("A1"), 1)
+        self.assertEqual(self.stock(), 8)
+
+    def test_cancel_skips_order_paid_concurrently(self):
+        self.make_order("A1")
+        OrderInfo.mark_paid("A1", Decimal("20.00"))
+
+        stats = reconcile_unpaid_orders(gateway=FakeGateway())
+
+        self.assertEqual(stats["cancelled"], 0)
+        self.assertEqual(self.status("A1"), 2)
+
+
+class FlashOrderTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.sku = make_sku(stock=10)
+        flash_sale.load([self.sku.id])
+        self.redis = flash_sale.get_redis()
+
+    def reserve(self, order_id, count=2, age=0):
+        data = {
+            "user_id": self.user.id,
+            "address": {"receiver": "张三", "address": "北京", "receiver_mobile": "13800000000", "tag": "家"},
+            "items": {self.sku.id: count},
+            "prices": {self.sku.id: str(self.sku.price)},
+        }
+        with self.clock(age):
+            flash_sale.reserve(order_id, {self.sku.id: count}, data)
+
+    @contextmanager
+    def clock(self, age):
+        # 秒杀模块和超时任务的当前时间提前age秒
+        fake = mock.Mock(time=lambda: time.time() - age)
+        with mock.patch("orders.flash_sale.time", fake), mock.patch("orders.tasks.time", fake):
+            yield
+
+    def redis_stock(self):
+        return int(self.redis.get(flash_sale.stock_key(self.sku.id)))
+
+    def pending(self, order_id):
+        return self.redis.hexists(flash_sale.ORDERS_KEY, order_id)
+
+    def sales(self):
+        return int(self.redis.hget(flash_sale.SALES_KEY, self.sku.id) or 0)
+
+    def test_order_written(self):
+        self.reserve("F1")
+        with self.captureOnCommitCallbacks(execute=True):
+            create_flash_order("F1")
+
+        self.assertTrue(OrderInfo.objects.filter(order_id="F1", status=1).exists())
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+        self.assertEqual(self.sales(), 2)
+
+    def test_not_enough_stock(self):
+        with self.assertRaises(flash_sale.stock.StockError):
+            self.reserve("F1", count=11)
+        self.assertEqual(self.redis_stock(), 10)
+
+    def test_expired_order_released(self):
+        self.reserve("F1", age=settings.FLASH_ORDER_TIMEOUT + 1)
+
+        release_expired_flash_orders()
+
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 10)
+        self.assertEqual(self.sales(), 0)
+
+    def test_claimed_order_kept_until_commit(self):
+        # 读取订单后进程退出:订单仍在Redis中,超时后才归还库存
+        self.reserve("F1", age=settings.FLASH_ORDER_TIMEOUT + 1)
+        flash_sale.claim("F1")
+
+        release_expired_flash_orders()
+        self.assertTrue(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+
+        with self.clock(-settings.FLASH_ORDER_TIMEOUT - 1):
+            release_expired_flash_orders()
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 10)
+
+    def test_claimed_during_release_not_restocked(self):
+        # 超时任务读取超时订单后、归还前,worker开始写入:不归还库存,写入后记录销量
+        self.reserve("F1", age=settings.FLASH_ORDER_TIMEOUT + 1)
+        expired_orders = flash_sale.expired_orders
+
+        def claimed_after_read(cutoff):
+            order_ids = expired_orders(cutoff)
+            flash_sale.claim("F1")
+            return order_ids
+
+        with mock.patch.object(flash_sale, "expired_orders", claimed_after_read):
+            release_expired_flash_orders()
+        self.assertTrue(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_flash_order("F1")
+
+        self.assertTrue(OrderInfo.objects.filter(order_id="F1").exists())
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+        self.assertEqual(self.sales(), 2)
+
+    def test_written_order_not_restocked_by_expiry(self):
+        # 事务已提交、finish没有执行:超时任务只删除待写入记录并记录销量
+        self.reserve("F1")
+        with mock.patch.object(flash_sale, "finish"), self.captureOnCommitCallbacks(execute=True):
+            create_flash_order("F1")
+        self.assertTrue(self.pending("F1"))
+
+        with self.clock(-settings.FLASH_ORDER_TIMEOUT - 1):
+            release_expired_flash_orders()
+
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+        self.assertEqual(self.sales(), 2)
+
+    def test_redelivered_task(self):
+        self.reserve("F1")
+        with mock.patch.object(flash_sale, "finish"), self.captureOnCommitCallbacks(execute=True):
+            create_flash_order("F1")
+
+        create_flash_order("F1")
+
+        self.assertEqual(OrderInfo.objects.filter(order_id="F1").count(), 1)
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 8)
+        self.assertEqual(self.sales(), 2)
+
+    def test_failed_insert_restocks(self):
+        self.reserve("F1")
+        with mock.patch.object(OrderInfo, "create_order", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                create_flash_order("F1")
+
+        self.assertFalse(self.pending("F1"))
+        self.assertEqual(self.redis_stock(), 10)
+
+
+class OrderIdTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis = order_id.get_redis_connection("default")
+
+    def make_generator(self, host_id=5):
+        generator = order_id.OrderIdGenerator(host_id)
+        self.addCleanup(generator.release)
+        return generator
+
+    def worker_id(self, oid):
+        return int(oid[17:21])
+
+    def test_format(self):
+        before = time.strftime("%Y%m%d%H%M%S")
+        oid = self.make_generator().next_id()
+
+        self.assertRegex(oid, r"^\d{25}$")
+        self.assertGreaterEqual(oid[:14], before)
+        self.assertIn(self.worker_id(oid), range(500, 600))
+
+    def test_unique_and_sorted(self):
+        generator = self.make_generator()
+        ids = [generator.next_id() for _ in range(order_id.MAX_SEQ * 2)]
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+
+    def test_processes_get_different_workers(self):
+        workers = {self.worker_id(self.make_generator().next_id()) for _ in range(order_id.MAX_SLOT + 1)}
+
+        self.assertEqual(workers, set(range(500, 600)))
+
+    def test_all_workers_in_use(self):
+        for slot in range(order_id.MAX_SLOT + 1):
+            self.redis.set(order_id.lease_key(500 + slot), "other", ex=60)
+
+        with self.assertRaises(order_id.OrderIdError):
+            self.make_generator().next_id()
+
+    def test_release_frees_worker(self):
+        generator = self.make_generator()
+        worker_id = self.worker_id(generator.next_id())
+
+        generator.release()
+
+        self.assertFalse(self.redis.exists(order_id.lease_key(worker_id)))
+
+    def test_heartbeat_renews_lease(self):
+        generator = self.make_generator()
+        worker_id = self.worker_id(generator.next_id())
+        key = order_id.lease_key(worker_id)
+        self.redis.expire(key, 5)
+        generator._renewed -= settings.ORDER_ID_LEASE_TTL / 2
+
+        self.assertEqual(self.worker_id(generator.next_id()), worker_id)
+        self.assertGreater(self.redis.ttl(key), 5)
+
+    def test_lost_lease_reacquired(self):
+        # 进程空闲超过租约时间,机器号已被其他进程占用:重新租用,不使用其他进程的机器号
+        generator = self.make_generator()
+        worker_id = self.worker_id(generator.next_id())
+        self.redis.set(order_id.lease_key(worker_id), "other", ex=60)
+        generator._renewed -= settings.ORDER_ID_LEASE_TTL
+
+        new_worker_id = self.worker_id(generator.next_id())
+
+        self.assertNotEqual(new_worker_id, worker_id)
+        self.assertEqual(self.redis.get(order_id.lease_key(worker_id)), b"other")
+
+    def test_renew_error_within_lease(self):
+        generator = self.make_generator()
+        worker_id = self.worker_id(generator.next_id())
+        generator._renewed -= settings.ORDER_ID_LEASE_TTL / 2
+
+        with mock.patch.object(order_id, "get_redis_connection", side_effect=ConnectionError("redis down")):
+            self.assertEqual(self.worker_id(generator.next_id()), worker_id)
+            generator._renewed -= settings.ORDER_ID_LEASE_TTL
+            with self.assertRaises(order_id.OrderIdError):
+                generator.next_id()
+
+
+
+class CheckoutTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.addr = Address.objects.create(user_profile=self.user, receiver="张三", address="北京", postcode="100000",
+                                           receiver_mobile="13800000000", tag="家", is_default=True)
+        self.sku = make_sku(stock=10)
+        self.other = make_sku(stock=1, price="5.00")
+        self.carts = CartStore(self.user.id)
+
+    def post_order(self, **data):
+        body = dict({"address_id": self.addr.id, "settlement_type": "0"}, **data)
+        return self.client.post("/v1/orders/tester", json.dumps(body), content_type="application/json",
+                                HTTP_AUTHORIZATION=make_token("tester")).json()
+
+    def stock(self, sku):
+        return SKU.objects.get(id=sku.id).stock
+
+    def test_cart_checkout(self):
+        self.carts.add(self.sku.id, 3)
+        self.carts.add(self.other.id, 1)
+        self.carts.select_all()
+
+        result = self.post_order()
+
+        self.assertEqual(result["code"], 200)
+        self.assertEqual(result["data"]["carts_count"], 0)
+        self.assertEqual((self.stock(self.sku), self.stock(self.other)), (7, 0))
+        order = OrderInfo.objects.get(order_id=result["data"]["order_id"])
+        self.assertEqual((order.total_count, order.total_amount), (4, Decimal("35.00")))
+        self.assertEqual(OrderGoods.objects.filter(order_info=order).count(), 2)
+
+    def test_cart_not_enough_stock(self):
+        self.carts.add(self.sku.id, 3)
+        self.carts.add(self.other.id, 2)
+        self.carts.select_all()
+
+        self.assertEqual(self.post_order()["code"], 10407)
+
+        self.assertEqual((self.stock(self.sku), self.stock(self.other)), (10, 1))
+        self.assertFalse(OrderInfo.objects.exists())
+        self.assertEqual(self.carts.count(), 2)
+
+    def test_cart_off_shelf(self):
+        self.carts.add(self.sku.id, 1)
+        SKU.objects.filter(id=self.sku.id).update(is_launched=False)
+
+        self.assertEqual(self.post_order()["code"], 10406)
+        self.assertFalse(OrderInfo.objects.exists())
+
+    def test_buy_now(self):
+        self.carts.add(self.other.id, 1)
+
+        result = self.post_order(settlement_type="1", sku_id=self.sku.id, buy_count=4)
+
+        self.assertEqual(result["code"], 200)
+        self.assertEqual(result["data"]["carts_count"], 1)
+        self.assertEqual(self.stock(self.sku), 6)
+        self.assertEqual(OrderInfo.objects.get(order_id=result["data"]["order_id"]).total_count, 4)
+
+    def test_buy_now_not_enough_stock(self):
+        result = self.post_order(settlement_type="1", sku_id=self.other.id, buy_count=2)
+
+        self.assertEqual(result["code"], 10409)
+        self.assertEqual(self.stock(self.other), 1)
+        self.assertFalse(OrderInfo.objects.exists())
+
+    def test_buy_now_off_shelf(self):
+        SKU.objects.filter(id=self.sku.id).update(is_launched=False)
+
+        self.assertEqual(self.post_order(settlement_type="1", sku_id=self.sku.id, buy_count=1)["code"], 10408)
+
+    def test_deleted_address(self):
+        self.carts.add(self.sku.id, 1)
+        Address.objects.filter(id=self.addr.id).update(is_delete=True)
+
+        self.assertEqual(self.post_order()["code"], 10405)
+        self.assertEqual(self.stock(self.sku), 10)
+
+
+class OrderHistoryTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.sku = make_sku()
+        now = datetime.now().replace(microsecond=0)
+        # 两个订单创建时间相同,翻页时按order_id区分
+        ages = {"A1": 50, "A2": 40, "A3": 40, "A4": 30, "A5": 20}
+        for i, (oid, age) in enumerate(ages.items()):
+            self.make_order(oid, status=2 if i % 2 else 1, created_time=now - timedelta(seconds=age))
+
+    def make_order(self, oid, status, created_time):
+        order = OrderInfo.objects.create(
+            user_profile=self.user, order_id=oid, total_amount=self.sku.price, total_count=1, freight=0,
+            status=status, receiver="张三", address="北京", receiver_mobile="13800000000", tag="家",
+        )
+        OrderGoods.objects.create(order_info=order, sku=self.sku, count=1, price=self.sku.price)
+        OrderInfo.objects.filter(order_id=oid).update(created_time=created_time)
+
+    def all_pages(self, **kwargs):
+        pages, cursor = [], None
+        while True:
+            orders, cursor = history.order_page(self.user.id, cursor, page_size=2, **kwargs)
+            pages.append([o.order_id for o in orders])
+            if cursor is None:
+                return pages
+
+    def test_pages(self):
+        self.assertEqual(self.all_pages(), [["A5", "A4"], ["A3", "A2"], ["A1"]])
+
+    def test_status_filter(self):
+        self.assertEqual(self.all_pages(status=1), [["A5", "A3"], ["A1"]])
+
+    def test_fixed_queries(self):
+        with self.assertNumQueries(2):
+            orders, _ = history.order_page(self.user.id, page_size=5)
+            goods = [history.make_order(o)["goods"] for o in orders]
+
+        self.assertEqual(len(goods), 5)
+        self.assertEqual(goods[0][0]["sku_id"], self.sku.id)
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            history.order_page(self.user.id, "not-a-cursor")
+
+    def get_list(self, **params):
+        return self.client.get("/v1/orders/tester/list", params, HTTP_AUTHORIZATION=make_token("tester")).json()
+
+    def test_list_view(self):
+        first = self.get_list(page_size=3)
+        second = self.get_list(page_size=3, cursor=first["data"]["next_cursor"])
+
+        self.assertEqual([o["order_id"] for o in first["data"]["orders"]], ["A5", "A4", "A3"])
+        self.assertEqual([o["order_id"] for o in second["data"]["orders"]], ["A2", "A1"])
+        self.assertIsNone(second["data"]["next_cursor"])
+
+    def test_list_view_bad_params(self):
+        for params in [{"cursor": "not-a-cursor"}, {"status": "9"}, {"page_size": "x"}, {"page_size": "0"}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.get_list(**params)["code"], 10411)
+
+
+class ParallelTest(RedisTestCase):
+    def test_results_and_timings(self):
+        # 两个调用互相等待,串行执行时会超时
+        barrier = threading.Barrier(2, timeout=5)
+
+        def call(value):
+            barrier.wait()
+            return value
+
+        results, timings = parallel.run_parallel({"a": lambda: call(1), "b": lambda: call(2)})
+
+        self.assertEqual(results, {"a": 1, "b": 2})
+        self.assertEqual(list(timings), ["a", "b"])
+
+    def test_exception_raised(self):
+        def fail():
+            raise KeyError("missing")
+
+        with self.assertRaises(KeyError):
+            parallel.run_parallel({"ok": lambda: 1, "fail": fail})
+
+    def test_context_copied(self):
+        var = contextvars.ContextVar("var")
+        var.set("request")
+
+        results, _ = parallel.run_parallel({"value": var.get})
+
+        self.assertEqual(results["value"], "request")
+
+    def test_server_timing(self):
+        self.assertEqual(parallel.server_timing({"addresses": 1.234, "skus": 10}), "addresses;dur=1.2, skus;dur=10.0")
+
+    def test_advance_view(self):
+        user = make_user()
+        sku = make_sku()
+        addr = Address.objects.create(user_profile=user, receiver="张三", address="北京", postcode="100000",
+                                      receiver_mobile="13800000000", tag="家", is_default=True)
+        # 查询在线程池中执行,使用各自的数据库连接,看不到测试事务中未提交的数据,先写入缓存
+        get_addresses(user.id)
+        get_sku_cards([sku.id])
+        CartStore(user.id).add(sku.id, 2)
+
+        response = self.client.get("/v1/orders/tester/advance", {"settlement_type": "0"},
+                                   HTTP_AUTHORIZATION=make_token("tester"))
+
+        data = response.json()["data"]
+        self.assertEqual([a["id"] for a in data["addresses"]], [addr.id])
+        self.assertEqual([(line["id"], line["count"]) for line in data["sku_list"]], [(sku.id, 2)])
+        names = [item.split(";")[0] for item in response["Server-Timing"].split(", ")]
+        self.assertEqual(names[:3], ["addresses", "skus", "total"])
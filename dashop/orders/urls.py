@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     # 订单确认页:v1/orders/<username>/advance
     path("<str:username>/advance", views.OrdersAdvanceView.as_view()),
+    # 订单列表:v1/orders/<username>/list
+    path("<str:username>/list", views.OrdersListView.as_view()),
     # 生成订单:v1/orders/<username>
     path("<str:username>", views.OrdersView.as_view()),
 ]
@@ -1,16 +1,26 @@
 import time
-from alipay import AliPay
+from decimal import Decimal
 
 from django.db import transaction
 from django.http import JsonResponse
 from django.views import View
 
+from carts.store import CartStore
 from carts.views import CartsView
 from dashop import settings
+from goods import stock
+from goods.cards import build_cart_lines, get_sku_cards, make_line
 from goods.models import SKU
-from orders.models import OrderInfo, OrderGoods
+from orders import flash_sale
+from orders.history import MAX_PAGE_SIZE, PAGE_SIZE, make_order, order_page
+from orders.models import OrderInfo, STATUS_CHOICES
+from orders.tasks import create_flash_order
+from users.address_book import get_addresses
 from users.models import Address
+from utils.alipay_client import get_alipay
 from utils.logging_dec import logging_check
+from utils.order_id import new_order_id
+from utils.parallel import run_parallel, server_timing
 
 
 # Create your views here.
@@ -29,6 +39,7 @@ class OrdersAdvanceView(View):
          "base_url":"xxx"
         }
         """
+        start = time.perf_counter()
         buy_num = 0
         sku_id = 0
 
@@ -36,69 +47,50 @@ class OrdersAdvanceView(View):
         if settle not in ["0", "1"]:
             return JsonResponse({"code": 10400, "error": "违法请求"})
 
-        # 1.查询收货地址相关信息
-        addresses = []
-        user = request.myuser
-        addrs = Address.objects.filter(user_profile=user, is_delete=False)
-        for addr in addrs:
-            addr_dict = {
-                "id": addr.id,
-                "name": addr.receiver,
-                "mobile": addr.receiver_mobile,
-                "title": addr.tag,
-                "address": addr.address
-            }
-            # 默认地址要放在列表中的第1个元素
-            if addr.is_default:
-                addresses.insert(0, addr_dict)
-            else:
-                addresses.append(addr_dict)
-
-        # 2.查询商品相关信息
-        sku_list = []
+        user_id = request.myuser.id
+        # 收货地址和商品信息互不依赖,并发查询
+        calls = {"addresses": lambda: get_addresses(user_id)}
         if settle == "0":
             # 购物车链接
             # Redis中查询数据字典
             # {"1":[3,1], "2":[5,1]}
-            carts_dict = CartsView().get_carts_dict(user.id)
-            carts_dict_select = {k: v for k, v in carts_dict.items() if v[1] == 1}
-            skus = SKU.objects.filter(id__in=carts_dict_select)
-            for sku in skus:
-                vals = sku.sale_attr_value.all()
-                sku_dict = {
-                    "id": sku.id,
-                    "name": sku.name,
-                    # {"1":[3,1], "2":[5,1]}
-                    "count": carts_dict_select[str(sku.id)][0],
-                    "selected": 1,
-                    "default_image_url": str(sku.default_image_url),
-                    "price": sku.price,
-                    "sku_sale_attr_name": [i.spu_sale_attr.name for i in vals],
-                    "sku_sale_attr_val": [i.name for i in vals]
-                }
-                sku_list.append(sku_dict)
+            def cart_lines():
+                carts_dict = CartsView().get_carts_dict(user_id)
+                return build_cart_lines({k: v for k, v in carts_dict.items() if v[1] == 1})
+
+            calls["skus"] = cart_lines
         else:
             # 立即购买链条
-            sku_id = request.GET.get("sku_id")
-            buy_num = request.GET.get("buy_num")
-            buy_num = int(buy_num)
-
             try:
-                sku = SKU.objects.get(id=sku_id, is_launched=True)
-            except Exception as e:
-                return JsonResponse({"code": 10402, "error": "该商品已下架"})
+                sku_id = int(request.GET.get("sku_id"))
+                buy_num = int(request.GET.get("buy_num"))
+            except (TypeError, ValueError):
+                return JsonResponse({"code": 10400, "error": "违法请求"})
 
-            vals = sku.sale_attr_value.all()
-            sku_list = [{
-                "id": sku.id,
-                "name": sku.name,
-                "count": buy_num,
-                "selected": 1,
-                "default_image_url": str(sku.default_image_url),
-                "price": sku.price,
-                "sku_sale_attr_name": [i.spu_sale_attr.name for i in vals],
-                "sku_sale_attr_val": [i.name for i in vals]
-            }]
+            calls["skus"] = lambda: get_sku_cards([sku_id], launched_only=True).get(sku_id)
+
+        results, timings = run_parallel(calls)
+
+        # 1.收货地址:默认地址要放在列表中的第1个元素(缓存中已排好)
+        addresses = [
+            {
+                "id": addr["id"],
+                "name": addr["receiver"],
+                "mobile": addr["receiver_mobile"],
+                "title": addr["tag"],
+                "address": addr["address"]
+            }
+            for addr in results["addresses"]
+        ]
+
+        # 2.商品相关信息
+        if settle == "0":
+            sku_list = results["skus"]
+        else:
+            card = results["skus"]
+            if card is None:
+                return JsonResponse({"code": 10402, "error": "该商品已下架"})
+            sku_list = [make_line(card, buy_num, 1)]
 
         result = {
             "code": 200,
@@ -111,7 +103,11 @@ class OrdersAdvanceView(View):
             "base_url": settings.PIC_URL
         }
 
-        return JsonResponse(result)
+        response = JsonResponse(result)
+        # 各阶段耗时
+        timings["total"] = (time.perf_counter() - start) * 1000
+        response["Server-Timing"] = server_timing(timings)
+        return response
 
 
 class OrdersView(View):
@@ -120,10 +116,11 @@ class OrdersView(View):
         """
         创建订单视图逻辑
         1.获取请求体数据
-        2.3个ORM操作
-          2.1 订单表中插入数据
-          2.2 订单商品表中插入数据
-          2.3 更新sku的库存和销量
+        2.固定次数的ORM操作,和商品种类数无关
+          2.1 一条查询锁定并校验所有SKU
+          2.2 一条UPDATE更新sku的库存和销量
+          2.3 订单表中插入数据[先算好总金额和总数量]
+          2.4 订单商品表中批量插入数据
         3.返回响应[API文档]
         """
         data = request.mydata
@@ -134,124 +131,80 @@ class OrdersView(View):
             return JsonResponse({"code": 10404, "error": "违法请求"})
 
         user = request.myuser
-        # 订单编号:20230815104500+用户ID
-        order_id = time.strftime("%Y%m%d%H%M%S") + str(user.id)
-        total_amount = 0
-        total_count = 0
+        # 订单编号:时间+机器号+序号,同一用户同一秒多次下单也不会重复
+        order_id = new_order_id()
         # 收货地址
         try:
             addr = Address.objects.get(id=addr_id, is_delete=False)
         except Exception as e:
             return JsonResponse({"code": 10405, "error": "收货地址不存在"})
 
-        # 购物车链条
-        # 开启事务
-        with transaction.atomic():
-            # 创建存储点
-            sid = transaction.savepoint()
-            # 1.订单表中插入数据
-            order = OrderInfo.objects.create(
-                user_profile=user,
-                order_id=order_id,
-                total_amount=total_amount,
-                total_count=total_count,
-                pay_method=1,
-                freight=0,
-                status=1,
-                receiver=addr.receiver,
-                address=addr.address,
-                receiver_mobile=addr.receiver_mobile,
-                tag=addr.tag,
-            )
+        if settle == "0":
+            # 购物车链条
+            # {"1":[3,1],"2":[5,1]} ---> {1: 3, 2: 5}
             carts_dict = CartsView().get_carts_dict(user.id)
-            if settle == "0":
-                # 购物车链条
-                # 2.更新sku的库存和销量
-                # {"1":[3,1],"2":[5,1]}
-                carts_dict_1 = {k: v for k, v in carts_dict.items() if v[1] == 1}
-                for skuid in carts_dict_1:
-                    # 校验上下架状态
-                    try:
-                        sku = SKU.objects.get(id=skuid, is_launched=True)
-                    except Exception as e:
-                        # 回滚+返回
-                        transaction.savepoint_rollback(sid)
-                        return JsonResponse({"code": 10406, "error": "该商品已下架"})
+            items = {int(k): v[0] for k, v in carts_dict.items() if v[1] == 1}
+            hot = flash_sale.hot_skus(items)
+            if hot and len(hot) != len(items):
+                return JsonResponse({"code": 10410, "error": "秒杀商品请单独下单"})
 
-                    # 校验库存
-                    # {"1":[3,1],"2":[5,1]}
-                    count = carts_dict_1[skuid][0]
-                    if count > sku.stock:
-                        # 回滚+返回
-                        transaction.savepoint_rollback(sid)
-                        return JsonResponse({"code": 10407, "error": f"{sku.name}库存不足,仅剩{sku.stock}件"})
-
-                    # 更新库存和销量[一查二改三保存]
-                    sku.stock -= count
-                    sku.sales += count
-                    sku.save()
-
-                    # 3.订单商品表中插入数据
-                    OrderGoods.objects.create(
-                        order_info=order,
-                        sku=sku,
-                        count=count,
-                        price=sku.price,
-                    )
-
-                    # 处理总金额和总销量
-                    total_amount += sku.price * count
-                    total_count += count
-
-                # 更新总金额和总销量
-                order.total_amount = total_amount
-                order.total_count = total_count
-                order.save()
-
-                # 提交事务
-                transaction.savepoint_commit(sid)
-            else:
-                # 立即购买链条
-                buy_count = int(data.get("buy_count"))
-                sku_id = data.get("sku_id")
-                # 2.更新sku的库存和销量
+            if hot:
+                # 秒杀商品:Redis中预扣库存,订单异步写入
                 try:
-                    sku = SKU.objects.get(id=sku_id, is_launched=True)
-                except Exception as e:
-                    # 回滚+返回
-                    transaction.savepoint_rollback(sid)
-                    return JsonResponse({"code": 10408, "error": "该商品已下架"})
+                    total_amount, total_count = self.flash_order(user, addr, order_id, items)
+                except stock.StockError as e:
+                    failure = e.failures[0]
+                    return JsonResponse(
+                        {"code": 10407, "error": f"{failure['name']}库存不足,仅剩{failure['stock']}件"})
+            else:
+                # 开启事务
+                with transaction.atomic():
+                    # 1.一条查询锁定所有SKU,按id顺序加锁,并发下单不会死锁
+                    skus = list(SKU.objects.select_for_update().filter(id__in=items).order_by("id")
+                                .only("id", "name", "price", "stock", "is_launched"))
+                    # 2.校验上下架状态和库存
+                    if len(skus) != len(items) or not all(sku.is_launched for sku in skus):
+                        return JsonResponse({"code": 10406, "error": "该商品已下架"})
+                    for sku in skus:
+                        if items[sku.id] > sku.stock:
+                            return JsonResponse({"code": 10407, "error": f"{sku.name}库存不足,仅剩{sku.stock}件"})
+
+                    # 3.一条UPDATE更新所有sku的库存和销量
+                    stock.decrement_locked(items)
+                    # 4.订单表和订单商品表中插入数据
+                    total_amount, total_count = OrderInfo.create_order(user, addr, order_id, skus, items)
 
-                if buy_count > sku.stock:
+            # 删除购物车中已下单的商品
+            _, carts_count = CartStore(user.id).remove(*items)
+        else:
+            # 立即购买链条
+            buy_count = int(data.get("buy_count"))
+            sku_id = data.get("sku_id")
+            if flash_sale.hot_skus([sku_id]):
+                # 秒杀商品:Redis中预扣库存,订单异步写入
+                try:
+                    total_amount, total_count = self.flash_order(user, addr, order_id, {int(sku_id): buy_count})
+                except stock.StockError as e:
                     return JsonResponse({"code": 10409, "error": "库存不足"})
+            else:
+                with transaction.atomic():
+                    try:
+                        sku = SKU.objects.only("id", "name", "price").get(id=sku_id, is_launched=True)
+                    except Exception as e:
+                        return JsonResponse({"code": 10408, "error": "该商品已下架"})
 
-                sku.stock -= buy_count
-                sku.sales += buy_count
-                sku.save()
-                # 3.订单商品表中插入数据
-                OrderGoods.objects.create(
-                    order_info=order,
-                    sku=sku,
-                    count=buy_count,
-                    price=sku.price,
-                )
-                total_amount += sku.price * buy_count
-                total_count += buy_count
-
-                order.total_amount = total_amount
-                order.total_count = total_count
-                order.save()
-
-                transaction.savepoint_commit(sid)
+                    # 一条条件UPDATE校验并扣减库存
+                    try:
+                        stock.reserve(sku.id, buy_count)
+                    except stock.StockError as e:
+                        if e.failures[0]["reason"] == stock.OFF_SHELF:
+                            return JsonResponse({"code": 10408, "error": "该商品已下架"})
+                        return JsonResponse({"code": 10409, "error": "库存不足"})
 
-        if settle == "0":
-            # 删除购物车中选中状态为1的商品
-            carts_dict_0 = {k: v for k, v in carts_dict.items() if v[1] == 0}
-            # 更新到Redis数据库
-            CartsView().update_carts(user.id, carts_dict_0)
-            carts_count = len(carts_dict_0)
-        else:
-            carts_count = len(carts_dict)
+                    items = {sku.id: buy_count}
+                    total_amount, total_count = OrderInfo.create_order(user, addr, order_id, [sku], items)
+
+            carts_count = CartStore(user.id).count()
 
         # 返回响应
         result = {
@@ -268,25 +221,41 @@ class OrdersView(View):
 
         return JsonResponse(result)
 
+    @staticmethod
+    def flash_order(user, addr, order_id, items):
+        """
+        功能函数:秒杀商品下单
+        1.Lua脚本预扣Redis中的库存[失败抛出StockError]
+        2.celery任务写入订单表和订单商品表
+        items: {sku_id: count}
+        返回: (总金额, 总数量)
+        """
+        info = flash_sale.get_info(items)
+        prices = {k: v["price"] for k, v in info.items()}
+        data = {
+            "user_id": user.id,
+            "address": {
+                "receiver": addr.receiver,
+                "address": addr.address,
+                "receiver_mobile": addr.receiver_mobile,
+                "tag": addr.tag,
+            },
+            "items": items,
+            "prices": prices,
+        }
+        flash_sale.reserve(order_id, items, data)
+        create_flash_order.delay(order_id)
+
+        total_amount = sum(Decimal(prices[k]) * v for k, v in items.items())
+        total_count = sum(items.values())
+        return total_amount, total_count
+
     def get_pay_url(self, order_id, total_amount):
         """
         获取第三方支付宝支付的路由
         alipay.trade.page.pay
         """
-        alipay = AliPay(
-            # 应用ID:控制台获取
-            appid=settings.ALIPAY_APPID,
-            # 异步通知地址[有支付结果]
-            app_notify_url=settings.ALIPAY_NOTIFY_URL,
-            # 应用私钥[用于签名]
-            app_private_key_string=open(settings.ALIPAY_KEY_DIR + "app_private_key.pem").read(),
-            # 支付宝公钥[用于签名]
-            alipay_public_key_string=open(settings.ALIPAY_KEY_DIR + "alipay_public_key.pem").read(),
-            # 签名使用算法:非对称加密
-            sign_type="RSA2",
-            # False:线上环境,True:沙箱环境
-            debug=True
-        )
+        alipay = get_alipay()
         # params:支付路由的查询参数
         params = alipay.api_alipay_trade_page_pay(
             # 订单标题
@@ -300,3 +269,42 @@ class OrdersView(View):
         )
 
         return "https://openapi.alipaydev.com/gateway.do?" + params
+
+
+class OrdersListView(View):
+    @logging_check
+    def get(self, request, username):
+        """
+        订单列表视图逻辑
+        查询参数: cursor-上一页返回的游标 status-订单状态 page_size-每页数量
+        {"code":200,
+         "data":{"orders":[],"next_cursor":"xxx"},
+         "base_url":"xxx"
+        }
+        """
+        status = request.GET.get("status")
+        if status is not None and status not in [str(i) for i, _ in STATUS_CHOICES]:
+            return JsonResponse({"code": 10411, "error": "订单状态有误"})
+
+        try:
+            page_size = min(int(request.GET.get("page_size", PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({"code": 10411, "error": "违法请求"})
+        if page_size < 1:
+            return JsonResponse({"code": 10411, "error": "违法请求"})
+
+        try:
+            orders, next_cursor = order_page(request.myuser.id, request.GET.get("cursor"),
+                                             status and int(status), page_size)
+        except ValueError:
+            return JsonResponse({"code": 10411, "error": "违法请求"})
+
+        result = {
+            "code": 200,
+            "data": {
+                "orders": [make_order(order) for order in orders],
+                "next_cursor": next_cursor,
+            },
+            "base_url": settings.PIC_URL
+        }
+        return JsonResponse(result)
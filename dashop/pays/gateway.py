@@ -0,0 +1,99 @@
+"""
+支付网关
+对账任务通过网关查询交易状态、关闭超时的交易,PAY_GATEWAY配置使用哪个网关:
+alipay: 支付宝主动查询/关闭交易接口
+fake: 本地模拟网关,不访问外网,交易状态通过FakeGateway.set_trade()设置
+"""
+import threading
+
+from dashop import settings
+from utils.alipay_client import get_alipay
+
+# 支付成功的交易状态
+PAID_STATUS = ("TRADE_SUCCESS", "TRADE_FINISHED")
+# 已关闭的交易状态,不能再支付
+CLOSED_STATUS = "TRADE_CLOSED"
+
+
+class GatewayError(Exception):
+    """
+    查询/关闭失败(网络错误、网关返回错误、交易已支付不能关闭),下次对账时重试
+    """
+
+
+class AlipayGateway:
+    def query(self, order_id):
+        """
+        功能函数:查询交易
+        返回: {"trade_status": "TRADE_SUCCESS", "total_amount": "88.00", ...}
+        用户还没有打开支付页面时交易不存在,返回None
+        """
+        try:
+            result = get_alipay().api_alipay_trade_query(out_trade_no=order_id)
+        except Exception as e:
+            raise GatewayError(e)
+
+        if result.get("code") == "10000":
+            return result
+        if result.get("sub_code") == "ACQ.TRADE_NOT_EXIST":
+            return None
+        raise GatewayError(result)
+
+    def close(self, order_id):
+        """
+        功能函数:关闭等待支付的交易,关闭后用户不能再支付
+        交易不存在(用户还没有打开支付页面)也视为成功
+        交易已支付等不能关闭时抛出GatewayError
+        """
+        try:
+            result = get_alipay().api_alipay_trade_close(out_trade_no=order_id)
+        except Exception as e:
+            raise GatewayError(e)
+
+        if result.get("code") == "10000" or result.get("sub_code") == "ACQ.TRADE_NOT_EXIST":
+            return
+        raise GatewayError(result)
+
+
+class FakeGateway:
+    # {order_id: {"trade_status": "TRADE_SUCCESS", "total_amount": "88.00"}}
+    # 交易状态为ERROR时查询和关闭都抛出GatewayError(模拟网络错误)
+    trades = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def set_trade(cls, order_id, trade_status, total_amount):
+        with cls._lock:
+            cls.trades[order_id] = {"trade_status": trade_status, "total_amount": str(total_amount)}
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls.trades.clear()
+
+    def query(self, order_id):
+        with self._lock:
+            trade = self.trades.get(order_id)
+        if trade is not None and trade["trade_status"] == "ERROR":
+            raise GatewayError("fake gateway error")
+        return None if trade is None else dict(trade, out_trade_no=order_id)
+
+    def close(self, order_id):
+        with self._lock:
+            trade = self.trades.get(order_id)
+            if trade is None:
+                return
+            if trade["trade_status"] == "WAIT_BUYER_PAY":
+                trade["trade_status"] = CLOSED_STATUS
+                return
+        raise GatewayError({"sub_code": "ACQ.TRADE_STATUS_ERROR", "trade_status": trade["trade_status"]})
+
+
+GATEWAYS = {
+    "alipay": AlipayGateway,
+    "fake": FakeGateway,
+}
+
+
+def get_gateway():
+    return GATEWAYS[settings.PAY_GATEWAY]()
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayIssue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(max_length=64, verbose_name='订单编号')),
+                ('trade_no', models.CharField(max_length=64, verbose_name='支付宝交易号')),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='支付金额')),
+                ('reason', models.SmallIntegerField(choices=[(1, '订单已取消,需要退款'), (2, '支付金额和订单金额不一致')], verbose_name='原因')),
+                ('status', models.SmallIntegerField(choices=[(1, '待处理'), (2, '已处理')], default=1, verbose_name='处理状态')),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'pays_pay_issue',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='payissue',
+            constraint=models.UniqueConstraint(fields=('order_id', 'trade_no'), name='pay_issue_trade_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pays', '0001_pay_issue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payissue',
+            name='reason',
+            field=models.SmallIntegerField(choices=[(1, '订单已取消,需要退款'), (2, '支付金额和订单金额不一致'), (3, '订单不存在')], verbose_name='原因'),
+        ),
+    ]
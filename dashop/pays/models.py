@@ -1,3 +1,41 @@
 from django.db import models
 
-# Create your models here.
+REASON_CHOICES = (
+    (1, "订单已取消,需要退款"),
+    (2, "支付金额和订单金额不一致"),
+    (3, "订单不存在"),
+)
+
+ISSUE_STATUS_CHOICES = (
+    (1, "待处理"),
+    (2, "已处理"),
+)
+
+
+class PayIssue(models.Model):
+    # 支付异常表:支付成功的通知没有修改订单状态,需要人工退款或核对
+    # 订单编号、支付宝交易号、支付金额、原因、处理状态
+    order_id = models.CharField(max_length=64, verbose_name="订单编号")
+    trade_no = models.CharField(max_length=64, verbose_name="支付宝交易号")
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="支付金额")
+    reason = models.SmallIntegerField(verbose_name="原因", choices=REASON_CHOICES)
+    status = models.SmallIntegerField(default=1, verbose_name="处理状态", choices=ISSUE_STATUS_CHOICES)
+
+    created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "pays_pay_issue"
+        constraints = [
+            # 支付宝重复通知只记录一次
+            models.UniqueConstraint(fields=["order_id", "trade_no"], name="pay_issue_trade_uniq"),
+        ]
+
+    @classmethod
+    def record(cls, order_id, trade_no, total_amount, reason):
+        """
+        功能函数:记录支付异常,重复通知不重复记录
+        返回: (记录, 是否新建)
+        """
+        return cls.objects.get_or_create(order_id=order_id, trade_no=trade_no or "",
+                                         defaults={"total_amount": total_amount, "reason": reason})
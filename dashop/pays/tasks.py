@@ -0,0 +1,41 @@
+"""
+pays/tasks.py
+存放支付模块应用下所有的异步任务
+"""
+import logging
+from decimal import Decimal
+
+from dashop import settings
+from dashop.celery import app
+from orders.models import OrderInfo
+from pays.models import PayIssue
+
+logger = logging.getLogger(__name__)
+
+
+@app.task(bind=True, max_retries=settings.PAY_NOTIFY_MAX_RETRIES,
+          default_retry_delay=settings.PAY_NOTIFY_RETRY_DELAY)
+def apply_trade_status(self, order_id, trade_no, total_amount):
+    """
+    支付宝异步通知:支付成功,修改订单状态
+    秒杀订单可能还没有写入MySQL,稍后重试,重试用完后订单仍不存在时记录支付异常
+    订单已取消、金额不一致时记录支付异常(PayIssue),由人工退款或核对
+    """
+    if OrderInfo.mark_paid(order_id, Decimal(total_amount)):
+        return
+
+    order = OrderInfo.objects.filter(order_id=order_id).values("status", "total_amount").first()
+    if order is None:
+        if self.request.retries < self.max_retries:
+            raise self.retry()
+        PayIssue.record(order_id, trade_no, Decimal(total_amount), 3)
+        logger.error("paid order not found, refund required: order=%s trade=%s paid=%s",
+                     order_id, trade_no, total_amount)
+    elif order["status"] == 5:
+        PayIssue.record(order_id, trade_no, Decimal(total_amount), 1)
+        logger.error("paid cancelled order, refund required: order=%s trade=%s paid=%s",
+                     order_id, trade_no, total_amount)
+    elif order["status"] == 1:
+        PayIssue.record(order_id, trade_no, Decimal(total_amount), 2)
+        logger.error("pay amount mismatch: order=%s trade=%s paid=%s expected=%s",
+                     order_id, trade_no, total_amount, order["total_amount"])
@@ -1,3 +1,90 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from celery.exceptions import Retry
+
+from dashop import settings
+from orders.models import OrderInfo
+from orders.tests import make_user
+from pays.gateway import FakeGateway, GatewayError
+from pays.models import PayIssue
+from pays.tasks import apply_trade_status
+from utils.testing import RedisTestCase
+
+
+class ApplyTradeStatusTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        OrderInfo.objects.create(
+            user_profile=self.user, order_id="P1", total_amount=Decimal("20.00"), total_count=2,
+            freight=0, status=1, receiver="张三", address="北京", receiver_mobile="13800000000", tag="家",
+        )
+
+    def status(self):
+        return OrderInfo.objects.get(order_id="P1").status
+
+    def test_paid(self):
+        apply_trade_status("P1", "T1", "20.00")
+        self.assertEqual(self.status(), 2)
+        self.assertFalse(PayIssue.objects.exists())
+
+    def test_repeated_notify(self):
+        apply_trade_status("P1", "T1", "20.00")
+        apply_trade_status("P1", "T1", "20.00")
+        self.assertEqual(self.status(), 2)
+        self.assertFalse(PayIssue.objects.exists())
+
+    def test_cancelled_order_paid_needs_refund(self):
+        OrderInfo.objects.filter(order_id="P1").update(status=5)
+
+        apply_trade_status("P1", "T1", "20.00")
+        apply_trade_status("P1", "T1", "20.00")
+
+        self.assertEqual(self.status(), 5)
+        issue = PayIssue.objects.get()
+        self.assertEqual((issue.order_id, issue.trade_no, issue.reason, issue.status), ("P1", "T1", 1, 1))
+        self.assertEqual(issue.total_amount, Decimal("20.00"))
+
+    def test_amount_mismatch(self):
+        apply_trade_status("P1", "T1", "0.01")
+
+        self.assertEqual(self.status(), 1)
+        self.assertEqual(PayIssue.objects.get().reason, 2)
+
+    def test_order_not_written_yet(self):
+        # 秒杀订单还没有写入MySQL,稍后重试
+        with self.assertRaises(Retry):
+            apply_trade_status.apply(args=("P2", "T2", "20.00"), throw=True)
+
+    def test_retry_outlasts_flash_order_timeout(self):
+        task = apply_trade_status
+        self.assertGreater(task.max_retries * task.default_retry_delay, settings.FLASH_ORDER_TIMEOUT)
+
+    def test_order_missing_after_retries(self):
+        apply_trade_status.apply(args=("P2", "T2", "20.00"), retries=apply_trade_status.max_retries, throw=True)
+
+        issue = PayIssue.objects.get()
+        self.assertEqual((issue.order_id, issue.trade_no, issue.reason), ("P2", "T2", 3))
+
+
+class FakeGatewayTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeGateway.clear()
+        self.addCleanup(FakeGateway.clear)
+        self.gateway = FakeGateway()
+
+    def test_close_missing_trade(self):
+        self.gateway.close("G1")
+        self.assertIsNone(self.gateway.query("G1"))
+
+    def test_close_waiting_trade(self):
+        FakeGateway.set_trade("G1", "WAIT_BUYER_PAY", "20.00")
+        self.gateway.close("G1")
+        self.assertEqual(self.gateway.query("G1")["trade_status"], "TRADE_CLOSED")
+
+    def test_close_paid_trade_fails(self):
+        FakeGateway.set_trade("G1", "TRADE_SUCCESS", "20.00")
+        with self.assertRaises(GatewayError):
+            self.gateway.close("G1")
+        self.assertEqual(self.gateway.query("G1")["trade_status"], "TRADE_SUCCESS")
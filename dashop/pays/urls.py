@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     # ReturnURL: v1/pays/return_url
     path("return_url", views.ReturnUrlView.as_view()),
+    # NotifyURL: v1/pays/notify_url
+    path("notify_url", views.NotifyUrlView.as_view()),
 ]
@@ -0,0 +1,63 @@
+"""
+收货地址缓存
+# Redis-key: addresses_1 其中1代表用户id
+[{"id":1, "receiver":"xxx", ..., "is_default":True}, {...}]
+默认地址放在第1个,其余按id排序,订单确认页直接使用
+新增、修改、删除、设置默认地址后删除缓存
+"""
+from datetime import datetime
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+
+from dashop import settings
+from users.models import Address
+
+FIELDS = ("id", "address", "receiver", "receiver_mobile", "tag", "postcode", "is_default")
+
+
+def address_key(user_id):
+    return f"addresses_{user_id}"
+
+
+def get_addresses(user_id):
+    """
+    功能函数:获取用户所有未删除的收货地址,默认地址在第1个
+    """
+    key = address_key(user_id)
+    addresses = caches["default"].get(key)
+    if addresses is None:
+        rows = Address.objects.filter(user_profile_id=user_id, is_delete=False).order_by("id").values(*FIELDS)
+        addresses = sorted(rows, key=lambda a: not a["is_default"])
+        caches["default"].set(key, addresses, settings.ADDRESS_CACHE_TTL)
+
+    return addresses
+
+
+def invalidate(user_id):
+    """
+    功能函数:删除地址缓存
+    事务提交后再删除一次,避免其他请求在提交前把旧数据写回缓存
+    """
+    key = address_key(user_id)
+    caches["default"].delete(key)
+    transaction.on_commit(lambda: caches["default"].delete(key))
+
+
+def set_default(user_id, addr_id):
+    """
+    功能函数:设置默认地址,一条UPDATE完成
+    UPDATE users_address SET is_default = CASE WHEN id=? THEN 1 ELSE 0 END
+    WHERE user_profile_id=? AND is_delete=0 AND (is_default=1 OR id=?)
+    返回: 地址是否存在
+    """
+    if not any(a["id"] == addr_id for a in get_addresses(user_id)):
+        return False
+
+    Address.objects.filter(Q(is_default=True) | Q(id=addr_id), user_profile_id=user_id, is_delete=False).update(
+        is_default=Case(When(id=addr_id, then=Value(True)), default=Value(False)),
+        updated_time=datetime.now(),
+    )
+    invalidate(user_id)
+    return True
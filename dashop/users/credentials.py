@@ -0,0 +1,185 @@
+"""
+用户密码
+1.新密码使用PBKDF2哈希,迭代次数由PASSWORD_HASH_ITERATIONS配置
+  调整迭代次数后,旧哈希在用户下次登录成功时自动按新的次数重新哈希
+2.旧数据是不加盐的MD5(32位十六进制),登录成功时重新哈希
+3.登录按唯一索引username查询后在Python中校验密码
+4.登录失败次数按(用户名, IP)、IP、用户名分别计数(Redis),规则见LOGIN_FAIL_LIMITS,在查询MySQL和计算哈希之前检查
+  4.1 (用户名, IP)、IP超限:拒绝这个IP,其他IP上的用户不受影响
+  4.2 用户名超限(多个IP猜测同一个账号):只允许最近登录成功过的IP登录,不会把用户本人锁在外面
+Redis中存储的数据结构如下:
+"login_fail:user_ip:liying:127.0.0.1": 3   # 过期时间为窗口长度
+"login_fail:ip:127.0.0.1": 10
+"login_fail:user:liying": 30
+"login_ok:liying": set {"127.0.0.1", ...}  # 登录成功过的IP,过期时间为LOGIN_TRUSTED_IP_TTL
+"""
+import hashlib
+import logging
+
+from django.contrib.auth import hashers
+from django.utils.crypto import constant_time_compare
+from django_redis import get_redis_connection
+
+from dashop import settings
+from users.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    迭代次数可配置,哈希中记录了迭代次数,和配置不同时must_update()返回True
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+def hash_password(raw):
+    """
+    功能函数:新密码的哈希
+    """
+    return hashers.make_password(raw)
+
+
+def is_legacy(encoded):
+    return len(encoded) == 32 and "$" not in encoded
+
+
+def check_password(raw, encoded):
+    """
+    功能函数:校验密码
+    返回: (是否正确, 是否需要重新哈希)
+    """
+    if is_legacy(encoded):
+        return constant_time_compare(hashlib.md5(raw.encode()).hexdigest(), encoded), True
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    return hasher.verify(raw, encoded), hasher.must_update(encoded)
+
+
+# ----------------------------- 登录失败限制 ----------------------------- #
+
+# 失败次数加1,第一次失败时设置过期时间(窗口从第一次失败开始计算)
+# 不使用EXPIRE NX(需要Redis 7.0)
+# KEYS: 计数key...  ARGV: 窗口长度...
+RECORD_FAILURE_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('INCR', KEYS[i]) == 1 then
+        redis.call('EXPIRE', KEYS[i], ARGV[i])
+    end
+end
+return 1
+"""
+
+_scripts = {}
+
+
+def get_redis():
+    return get_redis_connection("default")
+
+
+def run(source, keys, args):
+    # Lua脚本只注册一次,之后通过EVALSHA调用
+    r = get_redis()
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = r.register_script(source)
+    return script(keys=keys, args=args, client=r)
+
+
+def fail_keys(username, ip):
+    return {
+        "user_ip": f"login_fail:user_ip:{username}:{ip}",
+        "ip": f"login_fail:ip:{ip}",
+        "user": f"login_fail:user:{username}",
+    }
+
+
+def trusted_key(username):
+    return f"login_ok:{username}"
+
+
+def blocked_for(username, ip):
+    """
+    功能函数:失败次数超限时返回需要等待的秒数,否则返回0
+    用户名超限时,登录成功过的IP不受限制
+    """
+    keys = fail_keys(username, ip)
+    r = get_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.mget(list(keys.values()))
+    pipe.sismember(trusted_key(username), ip)
+    counts, trusted = pipe.execute()
+    for (name, key), count in zip(keys.items(), counts):
+        limit, _ = settings.LOGIN_FAIL_LIMITS[name]
+        if count is None or int(count) < limit:
+            continue
+        if name == "user" and trusted:
+            continue
+        return max(r.ttl(key), 1)
+    return 0
+
+
+def record_failure(username, ip):
+    keys = fail_keys(username, ip)
+    run(RECORD_FAILURE_SCRIPT, list(keys.values()), [settings.LOGIN_FAIL_LIMITS[name][1] for name in keys])
+
+
+def clear_failures(username, ip):
+    """
+    功能函数:登录成功,清除这个IP上的失败次数并记录为登录成功过的IP
+    用户名的失败次数不清除,其他IP上的猜测不会因为用户本人登录而重新计数
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.delete(fail_keys(username, ip)["user_ip"])
+    pipe.sadd(trusted_key(username), ip)
+    pipe.expire(trusted_key(username), settings.LOGIN_TRUSTED_IP_TTL)
+    pipe.execute()
+
+
+# ----------------------------- 登录 ----------------------------- #
+
+def authenticate(username, password, ip):
+    """
+    功能函数:校验用户名和密码
+    返回: (用户或None, 需要等待的秒数)
+    用户只加载了id、username、password
+    """
+    if not username or not password:
+        return None, 0
+
+    retry_after = blocked_for(username, ip)
+    if retry_after:
+        return None, retry_after
+
+    user = UserProfile.objects.filter(username=username).only("id", "username", "password").first()
+    if user is None:
+        # 用户不存在时也计算一次哈希,响应时间和密码错误时一致
+        hash_password(password)
+        record_failure(username, ip)
+        return None, 0
+
+    ok, needs_rehash = check_password(password, user.password)
+    if not ok:
+        record_failure(username, ip)
+        return None, 0
+
+    clear_failures(username, ip)
+    if needs_rehash:
+        rehash(user, password)
+    return user, 0
+
+
+def rehash(user, password):
+    """
+    功能函数:旧的MD5/迭代次数不同的哈希换成当前配置的哈希
+    只在密码没有被其他请求修改时更新
+    """
+    old = user.password
+    user.password = hash_password(password)
+    UserProfile.objects.filter(id=user.id, password=old).update(password=user.password)
+    logger.info("password rehashed user_id=%s", user.id)
@@ -0,0 +1,219 @@
+"""
+激活邮件批量发送
+1.注册时邮件只写入Redis发件箱(mail_outbox),不直接连接SMTP
+2.发件箱中的第一封邮件触发一个延迟MAIL_BATCH_WINDOW秒的flush任务,积累到MAIL_BATCH_SIZE封时立即flush
+3.flush每次把一批邮件原子地移动到这一批的处理中列表(Lua脚本,不使用需要Redis 6.2的LMOVE),用同一个SMTP连接(一次TLS握手)逐封发送
+  3.1 单封失败(收件人被拒等):放回发件箱重试,超过MAIL_MAX_RETRIES次后进入死信队列
+  3.2 连接失败/超时:这一批未发送的邮件全部进入死信队列,由requeue_dead()放回发件箱
+  3.3 这一批处理完后删除处理中列表;发送过程中进程退出时,超过MAIL_PROCESSING_TIMEOUT秒的处理中列表放回发件箱
+"""
+import json
+import logging
+import smtplib
+import time
+import uuid
+
+from django.core import mail
+from django_redis import get_redis_connection
+
+from dashop import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis-key: 待发送邮件 [{"email": .., "username": .., "verify_url": .., "attempts": 0}, ...]
+OUTBOX_KEY = "mail_outbox"
+# Redis-key: 死信队列 [{..., "error": "...", "failed_at": 1700000000}, ...]
+DEAD_KEY = "mail_dead"
+# Redis-key: 处理中的批次 mail_outbox:processing:<uuid> -> [邮件, ...]
+PROCESSING_PREFIX = f"{OUTBOX_KEY}:processing"
+# Redis-key: 处理中的批次 zset <处理中列表的key> -> 开始时间
+PROCESSING_KEY = "mail_processing"
+
+# 从发件箱头部取出最多ARGV[1]封邮件,追加到处理中列表,并记录开始时间
+# KEYS: mail_outbox, 处理中列表, mail_processing  ARGV: 数量, 当前时间
+# 返回: 处理中列表的邮件
+POP_BATCH_SCRIPT = """
+local n = 0
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('LPOP', KEYS[1])
+    if not item then
+        break
+    end
+    redis.call('RPUSH', KEYS[2], item)
+    n = n + 1
+end
+if n == 0 then
+    return {}
+end
+redis.call('ZADD', KEYS[3], ARGV[2], KEYS[2])
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+# 处理中列表的邮件放回发件箱的头部(保持原来的顺序)
+# KEYS: 处理中列表, mail_outbox, mail_processing
+RECOVER_SCRIPT = """
+local n = 0
+while redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) do
+    n = n + 1
+end
+redis.call('ZREM', KEYS[3], KEYS[1])
+return n
+"""
+
+
+def get_redis():
+    return get_redis_connection("default")
+
+
+def build_active_email(item, connection=None):
+    """
+    功能函数:激活邮件
+    """
+    subject = "达达商城激活邮件"
+    message = f"""
+    尊敬的 {item["username"]} 你好,请点击激活链接进行激活: {item["verify_url"]}
+    """
+    # 标题、正文、发件人、收件人
+    return mail.EmailMessage(subject, message, settings.EMAIL_HOST_USER, [item["email"]], connection=connection)
+
+
+def enqueue(email, username, verify_url):
+    """
+    功能函数:激活邮件写入发件箱
+    """
+    from users.tasks import flush_mail_outbox
+
+    item = {"email": email, "username": username, "verify_url": verify_url, "attempts": 0}
+    size = get_redis().rpush(OUTBOX_KEY, json.dumps(item))
+    if size == 1:
+        # 发件箱中的第一封,等待一个窗口期再发送
+        flush_mail_outbox.apply_async(countdown=settings.MAIL_BATCH_WINDOW)
+    elif size == settings.MAIL_BATCH_SIZE:
+        flush_mail_outbox.delay()
+
+
+def pop_batch(size):
+    """
+    功能函数:原子地把最多size封邮件移动到新的处理中列表
+    返回: (处理中列表的key, 邮件)
+    """
+    key = f"{PROCESSING_PREFIX}:{uuid.uuid4().hex}"
+    items = get_redis().eval(POP_BATCH_SCRIPT, 3, OUTBOX_KEY, key, PROCESSING_KEY, size, time.time())
+    return key, [json.loads(i) for i in items]
+
+
+def done(key):
+    """
+    功能函数:这一批已处理完(发送成功、放回发件箱或进入死信队列),删除处理中列表
+    """
+    pipe = get_redis().pipeline()
+    pipe.delete(key)
+    pipe.zrem(PROCESSING_KEY, key)
+    pipe.execute()
+
+
+def recover_stale(timeout=None):
+    """
+    功能函数:发送过程中进程退出遗留的处理中列表,放回发件箱
+    返回: 放回的数量
+    """
+    timeout = settings.MAIL_PROCESSING_TIMEOUT if timeout is None else timeout
+    r = get_redis()
+    total = 0
+    for key in r.zrangebyscore(PROCESSING_KEY, "-inf", time.time() - timeout):
+        total += r.eval(RECOVER_SCRIPT, 3, key, OUTBOX_KEY, PROCESSING_KEY)
+    if total:
+        logger.warning("%d activation emails recovered from stale batches", total)
+    return total
+
+
+def dead_letter(items, error):
+    if not items:
+        return
+    now = int(time.time())
+    get_redis().rpush(DEAD_KEY, *[json.dumps(dict(i, error=str(error), failed_at=now)) for i in items])
+    logger.error("%d activation emails moved to %s: %s", len(items), DEAD_KEY, error)
+
+
+def send_batch(items):
+    """
+    功能函数:同一个SMTP连接发送一批邮件
+    返回: 发送成功的数量
+    """
+    connection = mail.get_connection()
+    try:
+        connection.open()
+    except (OSError, smtplib.SMTPException) as e:
+        # 连接超时、握手失败
+        dead_letter(items, e)
+        return 0
+
+    sent, retry, dead = 0, [], []
+    try:
+        for n, item in enumerate(items):
+            try:
+                sent += connection.send_messages([build_active_email(item)])
+            except smtplib.SMTPServerDisconnected as e:
+                # 连接断开,这一批剩下的邮件不再尝试
+                dead_letter(items[n:], e)
+                break
+            except smtplib.SMTPException as e:
+                # SMTPException是OSError的子类,需要在OSError之前处理
+                item["attempts"] += 1
+                if item["attempts"] >= settings.MAIL_MAX_RETRIES:
+                    dead.append(item)
+                else:
+                    retry.append(item)
+                logger.warning("activation email to %s failed (%d): %s", item["email"], item["attempts"], e)
+            except OSError as e:
+                # 超时等网络错误
+                dead_letter(items[n:], e)
+                break
+    finally:
+        try:
+            connection.close()
+        except (OSError, smtplib.SMTPException):
+            pass
+
+    if retry:
+        get_redis().rpush(OUTBOX_KEY, *[json.dumps(i) for i in retry])
+    dead_letter(dead, "too many retries")
+    return sent
+
+
+def flush(max_batches=20):
+    """
+    功能函数:发送发件箱中的邮件,每批MAIL_BATCH_SIZE封
+    返回: 发送成功的数量
+    """
+    recover_stale()
+    total = 0
+    for _ in range(max_batches):
+        key, items = pop_batch(settings.MAIL_BATCH_SIZE)
+        if not items:
+            break
+        total += send_batch(items)
+        done(key)
+        if len(items) < settings.MAIL_BATCH_SIZE:
+            break
+    return total
+
+
+def requeue_dead():
+    """
+    功能函数:死信队列中的邮件重置重试次数后放回发件箱
+    返回: 放回的数量
+    """
+    r = get_redis()
+    pipe = r.pipeline()
+    pipe.lrange(DEAD_KEY, 0, -1)
+    pipe.delete(DEAD_KEY)
+    items, _ = pipe.execute()
+    items = [json.loads(i) for i in items]
+    for item in items:
+        item.pop("error", None)
+        item.pop("failed_at", None)
+        item["attempts"] = 0
+    if items:
+        r.rpush(OUTBOX_KEY, *[json.dumps(i) for i in items])
+    return len(items)
@@ -0,0 +1,26 @@
+"""
+查看激活邮件发件箱和死信队列
+python manage.py mail_outbox
+python manage.py mail_outbox --requeue   # 死信队列中的邮件放回发件箱
+"""
+from django.core.management.base import BaseCommand
+
+from users import mail_outbox
+
+
+class Command(BaseCommand):
+    help = "查看激活邮件发件箱/死信队列,放回死信队列中的邮件"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requeue", action="store_true", help="死信队列中的邮件放回发件箱")
+        parser.add_argument("--flush", action="store_true", help="立即发送发件箱中的邮件")
+
+    def handle(self, *args, **options):
+        r = mail_outbox.get_redis()
+        self.stdout.write(f"outbox: {r.llen(mail_outbox.OUTBOX_KEY)} dead: {r.llen(mail_outbox.DEAD_KEY)} "
+                          f"processing batches: {r.zcard(mail_outbox.PROCESSING_KEY)}")
+
+        if options["requeue"]:
+            self.stdout.write(f"requeued {mail_outbox.requeue_dead()}")
+        if options["flush"]:
+            self.stdout.write(f"sent {mail_outbox.flush()}")
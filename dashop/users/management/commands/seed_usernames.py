@@ -0,0 +1,18 @@
+"""
+从MySQL初始化Redis中的用户名集合(注册页检查用户名是否被占用)
+python manage.py seed_usernames
+"""
+from django.core.management.base import BaseCommand
+
+from users.registration import seed_usernames
+
+
+class Command(BaseCommand):
+    help = "从MySQL重建Redis中的用户名集合"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = seed_usernames(options["batch_size"])
+        self.stdout.write(f"seeded {count} usernames")
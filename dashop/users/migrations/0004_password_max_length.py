@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_weiboprofile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='password',
+            field=models.CharField(max_length=128, verbose_name='密码'),
+        ),
+    ]
@@ -7,7 +7,8 @@ class UserProfile(models.Model):
     用户名、密码、邮箱、手机号、是否激活、创建时间、更新时间
     """
     username = models.CharField(max_length=11, verbose_name="用户名", unique=True)
-    password = models.CharField(max_length=32, verbose_name="密码")
+    # 哈希后的密码,见users.credentials
+    password = models.CharField(max_length=128, verbose_name="密码")
     email = models.EmailField(verbose_name="邮箱", unique=True)
     phone = models.CharField(max_length=11, verbose_name="手机号", unique=True)
     is_active = models.BooleanField(default=False, verbose_name="是否激活")
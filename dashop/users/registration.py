@@ -0,0 +1,141 @@
+"""
+用户注册
+1.用户名、邮箱、手机号的唯一性由MySQL的唯一索引保证,注册只执行一条INSERT
+  IntegrityError按唯一索引名映射到冲突的字段
+2.已注册的用户名保存在Redis集合中,前端输入用户名时检查是否被占用,不查询MySQL
+  集合只用于提示,新增/删除用户时在事务提交后更新,最终以INSERT的结果为准
+  集合通过 python manage.py seed_usernames 从MySQL初始化
+Redis中存储的数据结构如下:
+"usernames": set {"liying", ...}
+"usernames_ready": 1          # 集合已初始化,不存在时回退到查询MySQL
+"""
+import logging
+import re
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django_redis import get_redis_connection
+
+from users.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+USERNAMES_KEY = "usernames"
+READY_KEY = "usernames_ready"
+UNIQUE_FIELDS = ("username", "email", "phone")
+
+# MySQL: Duplicate entry 'x' for key 'users_user_profile.username'(8.0) / for key 'username'(5.7)
+# SQLite: UNIQUE constraint failed: users_user_profile.username
+CONFLICT_PATTERNS = (
+    re.compile(r"for key '(?:[\w]+\.)?(\w+)'"),
+    re.compile(r"UNIQUE constraint failed: \w+\.(\w+)"),
+)
+
+
+def get_redis():
+    return get_redis_connection("default")
+
+
+def conflict_field(error, username, email, phone):
+    """
+    功能函数:唯一索引冲突的字段
+    返回: "username" / "email" / "phone",无法判断时返回None
+    """
+    message = str(error)
+    for pattern in CONFLICT_PATTERNS:
+        match = pattern.search(message)
+        if match and match.group(1) in UNIQUE_FIELDS:
+            return match.group(1)
+
+    # 其他数据库或自定义的索引名,查询一次冲突的记录
+    values = {"username": username, "email": email, "phone": phone}
+    row = UserProfile.objects.filter(Q(username=username) | Q(email=email) | Q(phone=phone)) \
+        .values(*UNIQUE_FIELDS).first()
+    if row is None:
+        return None
+    return next((f for f in UNIQUE_FIELDS if row[f] == values[f]), None)
+
+
+def create_user(username, password, email, phone):
+    """
+    功能函数:注册用户,一条INSERT
+    password: 已经哈希后的密码
+    返回: (用户, None) 或 (None, 冲突的字段)
+    """
+    try:
+        if connection.in_atomic_block:
+            # 在外层事务中调用时使用保存点,冲突不影响外层事务
+            with transaction.atomic():
+                user = UserProfile.objects.create(username=username, password=password, email=email, phone=phone)
+        else:
+            # 自动提交模式下只有一条INSERT,不需要BEGIN/COMMIT
+            user = UserProfile.objects.create(username=username, password=password, email=email, phone=phone)
+    except IntegrityError as e:
+        return None, conflict_field(e, username, email, phone) or "username"
+    return user, None
+
+
+def username_taken(username):
+    """
+    功能函数:用户名是否被占用
+    Redis集合未初始化时查询MySQL
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.sismember(USERNAMES_KEY, username)
+    pipe.exists(READY_KEY)
+    taken, ready = pipe.execute()
+    if taken:
+        return True
+    if ready:
+        return False
+    return UserProfile.objects.filter(username=username).exists()
+
+
+def add_username(username):
+    """
+    功能函数:用户名加入集合
+    在事务提交后(自动提交模式下INSERT之后立即)调用,集合只用于提示,Redis出错时不影响注册
+    """
+    try:
+        get_redis().sadd(USERNAMES_KEY, username)
+    except Exception as e:
+        logger.warning("add username to set failed: %s %s", username, e)
+
+
+def remove_username(username):
+    try:
+        get_redis().srem(USERNAMES_KEY, username)
+    except Exception as e:
+        logger.warning("remove username from set failed: %s %s", username, e)
+
+
+def seed_usernames(batch_size=5000):
+    """
+    功能函数:从MySQL重建用户名集合,写入临时key后RENAME替换
+    重建期间注册的用户可能不在新集合中,只影响提示,不影响注册
+    返回: 用户名数量
+    """
+    r = get_redis()
+    tmp_key = f"{USERNAMES_KEY}:seeding"
+    r.delete(tmp_key)
+
+    count, batch = 0, []
+    names = UserProfile.objects.order_by().values_list("username", flat=True).iterator(chunk_size=batch_size)
+    for name in names:
+        batch.append(name)
+        if len(batch) >= batch_size:
+            r.sadd(tmp_key, *batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        r.sadd(tmp_key, *batch)
+        count += len(batch)
+
+    pipe = r.pipeline()
+    if count:
+        pipe.rename(tmp_key, USERNAMES_KEY)
+    else:
+        pipe.delete(USERNAMES_KEY)
+    pipe.set(READY_KEY, 1)
+    pipe.execute()
+    return count
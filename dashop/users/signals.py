@@ -0,0 +1,41 @@
+"""
+用户数据变更信号
+用户信息保存/删除后,删除登录用户缓存;新增/删除用户后更新Redis中的用户名集合
+收货地址保存/删除后(后台修改等),删除地址缓存
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users import address_book, registration
+from users.models import UserProfile, Address
+from users.user_cache import invalidate
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def user_changed(sender, instance, **kwargs):
+    if kwargs.get("created"):
+        # 新用户还没有缓存
+        return
+    username = instance.username
+    invalidate(username)
+    # 事务提交前其他请求可能又写入了旧数据,提交后再删除一次
+    transaction.on_commit(lambda: invalidate(username))
+
+
+@receiver(post_save, sender=UserProfile)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        username = instance.username
+        transaction.on_commit(lambda: registration.add_username(username))
+
+
+@receiver(post_delete, sender=UserProfile)
+def user_deleted(sender, instance, **kwargs):
+    username = instance.username
+    transaction.on_commit(lambda: registration.remove_username(username))
+
+
+@receiver([post_save, post_delete], sender=Address)
+def address_changed(sender, instance, **kwargs):
+    address_book.invalidate(instance.user_profile_id)
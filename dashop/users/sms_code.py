@@ -0,0 +1,142 @@
+"""
+短信验证码
+发送频率限制和验证码都保存在Redis(sms库)中,每个操作只调用一次Lua脚本,并发请求不会重复发送短信
+1.滑动窗口限流:每个手机号、每个IP、全局各自一个zset,成员为发送时间(毫秒),规则见settings.SMS_RATE_LIMITS
+2.所有规则都通过时才记录本次发送并保存验证码
+3.校验验证码:正确时删除(只能使用一次),错误次数达到SMS_CODE_MAX_ATTEMPTS后删除
+  验证码正确但后续操作失败(注册时邮箱/手机号已被注册)时由restore()放回
+Redis中存储的数据结构如下:
+"sms_rl:phone:13603263409": zset <成员> -> 发送时间(毫秒)
+"sms_rl:ip:127.0.0.1": zset
+"sms_rl:global": zset
+"sms_code:13603263409": {"code": "1016", "attempts": 0}
+"""
+import json
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+from dashop import settings
+
+GLOBAL_KEY = "sms_rl:global"
+
+# 检查所有规则,全部通过时记录本次发送并保存验证码
+# KEYS: 限流key..., 验证码key
+# ARGV: 当前时间(毫秒), 成员, 验证码, 验证码有效期(秒), 规则(json: [[key序号, 窗口(毫秒), 次数上限], ...])
+# 返回: {0}成功 {i, 需要等待的毫秒数}第i条规则超限
+ISSUE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rules = cjson.decode(ARGV[5])
+local windows = {}
+for i, rule in ipairs(rules) do
+    local key, window, limit = KEYS[rule[1]], rule[2], rule[3]
+    local count = redis.call('ZCOUNT', key, now - window + 1, '+inf')
+    if count >= limit then
+        local oldest = redis.call('ZRANGEBYSCORE', key, now - window + 1, '+inf', 'WITHSCORES', 'LIMIT', count - limit, 1)
+        return {i, tonumber(oldest[2]) + window - now}
+    end
+    windows[key] = math.max(windows[key] or 0, window)
+end
+for key, window in pairs(windows) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, window)
+end
+local code_key = KEYS[#KEYS]
+redis.call('DEL', code_key)
+redis.call('HSET', code_key, 'code', ARGV[3], 'attempts', 0)
+redis.call('EXPIRE', code_key, ARGV[4])
+return {0}
+"""
+
+# 校验验证码,正确时删除
+# KEYS: 验证码key  ARGV: 用户输入的验证码, 最多尝试次数
+# 返回: 1正确 0错误 -1不存在(已过期/已使用/错误次数过多)
+VERIFY_SCRIPT = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then
+    return -1
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 放回已使用的验证码,期间已经发送了新验证码时不覆盖
+# KEYS: 验证码key  ARGV: 验证码, 验证码有效期(秒)
+RESTORE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'code', ARGV[1], 'attempts', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+def get_redis():
+    return get_redis_connection("sms")
+
+
+def run(source, keys, args):
+    # Lua脚本只注册一次,之后通过EVALSHA调用
+    r = get_redis()
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = r.register_script(source)
+    return script(keys=keys, args=args, client=r)
+
+
+def code_key(mobile):
+    return f"sms_code:{mobile}"
+
+
+def limit_keys(mobile, ip):
+    return {"phone": f"sms_rl:phone:{mobile}", "ip": f"sms_rl:ip:{ip}", "global": GLOBAL_KEY}
+
+
+def issue(mobile, ip, code):
+    """
+    功能函数:检查发送频率并保存验证码
+    返回: (是否允许发送, 超限的规则名, 需要等待的秒数)
+    """
+    keys = limit_keys(mobile, ip)
+    names = list(keys)
+    rules, described = [], []
+    for n, name in enumerate(names, 1):
+        for window, limit in settings.SMS_RATE_LIMITS.get(name, ()):
+            rules.append([n, window * 1000, limit])
+            described.append(name)
+
+    now = int(time.time() * 1000)
+    result = run(ISSUE_SCRIPT, [keys[name] for name in names] + [code_key(mobile)],
+                 [now, f"{now}-{uuid.uuid4().hex[:8]}", code, settings.SMS_CODE_TTL, json.dumps(rules)])
+    if result[0] == 0:
+        return True, None, 0
+    return False, described[result[0] - 1], max(1, -(-int(result[1]) // 1000))
+
+
+def verify(mobile, code):
+    """
+    功能函数:校验并消费验证码
+    返回: 1正确 0错误 -1已过期
+    """
+    if not mobile or not code:
+        return -1 if not mobile else 0
+    return run(VERIFY_SCRIPT, [code_key(mobile)], [str(code), settings.SMS_CODE_MAX_ATTEMPTS])
+
+
+def restore(mobile, code):
+    """
+    功能函数:放回校验通过的验证码,用户修改其他信息后可以再次使用
+    返回: 是否放回
+    """
+    return run(RESTORE_SCRIPT, [code_key(mobile)], [str(code), settings.SMS_CODE_TTL]) == 1
@@ -2,31 +2,45 @@
 users/tasks.py
 存放用户模块应用下所有的异步任务
 """
-from django.core import mail
-from dashop import settings
 from dashop.celery import app
-from utils.sms_api import send_sms
+from users import mail_outbox
+from utils.sms_api import CONNECT_ERROR, chunks, send_sms
 
 
 @app.task
 def async_send_active_email(email, username, verify_url):
     """
     功能函数:发送激活邮件
+    写入发件箱,由flush_mail_outbox批量发送(保留该任务用于处理升级前已经投递的任务)
     """
-    subject = "达达商城激活邮件"
-    message = f"""
-    尊敬的 {username} 你好,请点击激活链接进行激活: {verify_url}
+    mail_outbox.enqueue(email, username, verify_url)
+
+
+@app.task
+def flush_mail_outbox():
     """
+    批量发送发件箱中的激活邮件,每批共用一个SMTP连接
+    """
+    return mail_outbox.flush()
 
-    mail.send_mail(
-        # 标题、正文、发件人、收件人
-        subject=subject,
-        message=message,
-        from_email=settings.EMAIL_HOST_USER,
-        recipient_list=[email]
-    )
+
+@app.task(bind=True, max_retries=3, default_retry_delay=5)
+def async_send_message(self, tid, mobile, datas):
+    """
+    发送短信,mobile可以是以英文逗号分隔的多个号码
+    只在连接失败(请求没有发出)时重试,读取超时不重试,避免重复发送给这一批的所有号码
+    """
+    resp = send_sms(tid, mobile, datas)
+    if resp.get("statusCode") == CONNECT_ERROR["statusCode"]:
+        raise self.retry()
 
 
 @app.task
-def async_send_message(tid, mobile, datas):
-    send_sms(tid, mobile, datas)
+def async_send_bulk_message(tid, mobiles, datas):
+    """
+    群发短信(营销/通知):按服务商单次请求的号码上限拆分,每批一个任务
+    """
+    batches = chunks(mobiles)
+    for batch in batches:
+        async_send_message.delay(tid, batch, datas)
+    return len(batches)
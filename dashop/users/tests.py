@@ -1,3 +1,391 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.db import IntegrityError
+
+from dashop import settings
+from users import address_book, credentials, mail_outbox, registration, sms_code, tasks, user_cache
+from users.models import Address, UserProfile
+from utils import sms_api
+from utils.helper import make_token
+from utils.testing import RedisTestCase
+
+
+class SmsCodeTest(RedisTestCase):
+    def test_issue_and_verify_once(self):
+        self.assertEqual(sms_code.issue("13800000001", "1.1.1.1", "1234"), (True, None, 0))
+
+        self.assertEqual(sms_code.verify("13800000001", "1234"), 1)
+        self.assertEqual(sms_code.verify("13800000001", "1234"), -1)
+
+    def test_phone_limit(self):
+        sms_code.issue("13800000001", "1.1.1.1", "1234")
+
+        allowed, rule, retry_after = sms_code.issue("13800000001", "1.1.1.2", "5678")
+
+        self.assertFalse(allowed)
+        self.assertEqual(rule, "phone")
+        self.assertTrue(0 < retry_after <= 60)
+        # 被拒绝的请求不覆盖已发送的验证码
+        self.assertEqual(sms_code.verify("13800000001", "1234"), 1)
+
+    def test_ip_limit(self):
+        with mock.patch.object(settings, "SMS_RATE_LIMITS", {"ip": [(3600, 2)]}):
+            results = [sms_code.issue(f"1380000000{i}", "1.1.1.1", "1234")[0] for i in range(3)]
+            other_ip = sms_code.issue("13800000009", "1.1.1.2", "1234")[0]
+
+        self.assertEqual(results, [True, True, False])
+        self.assertTrue(other_ip)
+
+    def test_rejected_request_not_counted(self):
+        # 一条规则超限时,其他规则的窗口也不记录本次请求
+        limits = {"phone": [(60, 1)], "global": [(60, 2)]}
+        with mock.patch.object(settings, "SMS_RATE_LIMITS", limits):
+            sms_code.issue("13800000001", "1.1.1.1", "1234")
+            sms_code.issue("13800000001", "1.1.1.1", "1234")
+            allowed = sms_code.issue("13800000002", "1.1.1.1", "1234")[0]
+
+        self.assertTrue(allowed)
+
+    def test_wrong_code_attempts(self):
+        sms_code.issue("13800000001", "1.1.1.1", "1234")
+        for _ in range(settings.SMS_CODE_MAX_ATTEMPTS):
+            self.assertEqual(sms_code.verify("13800000001", "0000"), 0)
+
+        self.assertEqual(sms_code.verify("13800000001", "1234"), -1)
+
+    def test_restore(self):
+        sms_code.issue("13800000001", "1.1.1.1", "1234")
+        sms_code.verify("13800000001", "1234")
+
+        self.assertTrue(sms_code.restore("13800000001", "1234"))
+        self.assertEqual(sms_code.verify("13800000001", "1234"), 1)
+
+    def test_restore_keeps_newer_code(self):
+        sms_code.issue("13800000001", "1.1.1.1", "1234")
+        sms_code.verify("13800000001", "1234")
+        with mock.patch.object(settings, "SMS_RATE_LIMITS", {}):
+            sms_code.issue("13800000001", "1.1.1.1", "5678")
+
+        self.assertFalse(sms_code.restore("13800000001", "1234"))
+        self.assertEqual(sms_code.verify("13800000001", "5678"), 1)
+
+
+class RegistrationTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create(username="existing", password="x", email="old@test.com", phone="13800000001")
+
+    def test_create_user(self):
+        user, conflict = registration.create_user("newuser", "x", "new@test.com", "13800000002")
+
+        self.assertIsNone(conflict)
+        self.assertEqual(UserProfile.objects.get(username="newuser").id, user.id)
+
+    def test_conflict_fields(self):
+        cases = {
+            "username": ("existing", "new@test.com", "13800000002"),
+            "email": ("newuser", "old@test.com", "13800000002"),
+            "phone": ("newuser", "new@test.com", "13800000001"),
+        }
+        for field, (username, email, phone) in cases.items():
+            with self.subTest(field=field):
+                user, conflict = registration.create_user(username, "x", email, phone)
+                self.assertIsNone(user)
+                self.assertEqual(conflict, field)
+
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_conflict_field_from_message(self):
+        messages = {
+            "(1062, \"Duplicate entry 'a@b.com' for key 'users_user_profile.email'\")": "email",
+            "(1062, \"Duplicate entry '138' for key 'phone'\")": "phone",
+            "UNIQUE constraint failed: users_user_profile.username": "username",
+        }
+        for message, field in messages.items():
+            with self.subTest(message=message):
+                self.assertEqual(registration.conflict_field(IntegrityError(message), "a", "b", "c"), field)
+
+    def test_conflict_field_fallback_query(self):
+        error = IntegrityError("(1062, \"Duplicate entry 'x' for key 'uniq_custom'\")")
+        self.assertEqual(registration.conflict_field(error, "other", "x@test.com", "13800000001"), "phone")
+
+    def test_username_set(self):
+        self.assertTrue(registration.username_taken("existing"))
+
+        registration.seed_usernames()
+        with self.captureOnCommitCallbacks(execute=True):
+            registration.create_user("newuser", "x", "new@test.com", "13800000002")
+
+        self.assertTrue(registration.username_taken("newuser"))
+        self.assertFalse(registration.username_taken("nobody"))
+
+    def test_username_set_error_ignored(self):
+        with mock.patch.object(registration, "get_redis", side_effect=ConnectionError("redis down")):
+            with self.captureOnCommitCallbacks(execute=True):
+                user, conflict = registration.create_user("newuser", "x", "new@test.com", "13800000002")
+
+        self.assertIsNone(conflict)
+        self.assertIsNotNone(user)
+
+    def post_register(self, **data):
+        body = {"uname": "newuser", "password": "123456", "email": "new@test.com", "phone": "13800000002",
+                "verify": "1234"}
+        body.update(data)
+        return self.client.post("/v1/users/register", json.dumps(body), content_type="application/json").json()
+
+    def test_register_conflict_restores_code(self):
+        sms_code.issue("13800000002", "1.1.1.1", "1234")
+
+        self.assertEqual(self.post_register(email="old@test.com")["code"], 10119)
+        self.assertEqual(self.post_register()["code"], 200)
+        self.assertTrue(UserProfile.objects.filter(username="newuser").exists())
+
+
+class LoginThrottleTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create(username="owner", password=credentials.hash_password("right-password"),
+                                   email="owner@test.com", phone="13800000001")
+
+    def login(self, password, ip):
+        return credentials.authenticate("owner", password, ip)
+
+    def test_other_ips_cannot_lock_account(self):
+        limit, _ = settings.LOGIN_FAIL_LIMITS["user_ip"]
+        for i in range(limit):
+            self.login("wrong", f"10.0.0.{i}")
+
+        user, retry_after = self.login("right-password", "10.0.1.1")
+
+        self.assertIsNotNone(user)
+        self.assertEqual(retry_after, 0)
+
+    def test_same_ip_blocked(self):
+        limit, window = settings.LOGIN_FAIL_LIMITS["user_ip"]
+        for _ in range(limit):
+            self.login("wrong", "10.0.0.1")
+
+        user, retry_after = self.login("right-password", "10.0.0.1")
+
+        self.assertIsNone(user)
+        self.assertTrue(0 < retry_after <= window)
+
+    def test_user_limit_allows_trusted_ip(self):
+        self.login("right-password", "10.0.0.1")
+        limits = dict(settings.LOGIN_FAIL_LIMITS, user=(3, 3600))
+        with mock.patch.object(settings, "LOGIN_FAIL_LIMITS", limits):
+            for i in range(3):
+                self.login("wrong", f"10.0.2.{i}")
+
+            self.assertGreater(self.login("right-password", "10.0.3.1")[1], 0)
+            self.assertIsNotNone(self.login("right-password", "10.0.0.1")[0])
+
+    def test_legacy_md5_rehashed(self):
+        UserProfile.objects.filter(username="owner").update(password="5f4dcc3b5aa765d61d8327deb882cf99")
+
+        user, _ = self.login("password", "10.0.0.1")
+
+        self.assertIsNotNone(user)
+        self.assertTrue(UserProfile.objects.get(username="owner").password.startswith("pbkdf2_sha256$"))
+
+    def test_failure_window_starts_at_first_failure(self):
+        self.login("wrong", "10.0.0.1")
+        r = credentials.get_redis()
+        key = credentials.fail_keys("owner", "10.0.0.1")["user_ip"]
+        r.expire(key, 10)
+
+        self.login("wrong", "10.0.0.1")
+
+        self.assertEqual(int(r.get(key)), 2)
+        self.assertLessEqual(r.ttl(key), 10)
+
+
+class MailOutboxTest(RedisTestCase):
+    def enqueue(self, count):
+        r = mail_outbox.get_redis()
+        r.rpush(mail_outbox.OUTBOX_KEY, *[json.dumps({"email": f"u{i}@test.com", "username": f"u{i}",
+                                                      "verify_url": "http://test/active", "attempts": 0})
+                                          for i in range(count)])
+
+    def test_flush(self):
+        self.enqueue(3)
+
+        self.assertEqual(mail_outbox.flush(), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        r = mail_outbox.get_redis()
+        self.assertEqual(r.llen(mail_outbox.OUTBOX_KEY), 0)
+        self.assertEqual(r.zcard(mail_outbox.PROCESSING_KEY), 0)
+
+    def test_crashed_batch_recovered(self):
+        self.enqueue(3)
+        mail_outbox.pop_batch(2)
+        r = mail_outbox.get_redis()
+        self.assertEqual(r.llen(mail_outbox.OUTBOX_KEY), 1)
+
+        self.assertEqual(mail_outbox.recover_stale(), 0)
+        self.assertEqual(mail_outbox.recover_stale(timeout=-1), 2)
+
+        emails = [json.loads(i)["email"] for i in r.lrange(mail_outbox.OUTBOX_KEY, 0, -1)]
+        self.assertEqual(emails, ["u0@test.com", "u1@test.com", "u2@test.com"])
+        self.assertEqual(r.zcard(mail_outbox.PROCESSING_KEY), 0)
+
+    def test_pop_empty_outbox(self):
+        key, items = mail_outbox.pop_batch(2)
+
+        self.assertEqual(items, [])
+        self.assertEqual(mail_outbox.get_redis().zcard(mail_outbox.PROCESSING_KEY), 0)
+
+
+class UserCacheTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserProfile.objects.create(username="owner", password="x", email="owner@test.com",
+                                               phone="13800000001")
+
+    def test_lazy_user_cached(self):
+        with self.assertNumQueries(1):
+            user = user_cache.get_lazy_user("owner")
+        self.assertEqual((user.id, user.username), (self.user.id, "owner"))
+
+        with self.assertNumQueries(0):
+            user_cache.get_lazy_user("owner")
+        # 进程内缓存过期后从Redis读取
+        user_cache.local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get_lazy_user("owner").id, self.user.id)
+
+    def test_missing_user(self):
+        self.assertIsNone(user_cache.get_lazy_user("nobody"))
+        self.assertIsNone(user_cache.local_cache.get("nobody"))
+
+    def test_other_fields_loaded_on_access(self):
+        user = user_cache.get_lazy_user("owner")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "owner@test.com")
+
+    def test_save_only_loaded_fields(self):
+        user = user_cache.get_lazy_user("owner")
+        UserProfile.objects.filter(id=self.user.id).update(email="new@test.com")
+
+        user.save()
+
+        self.assertEqual(UserProfile.objects.get(id=self.user.id).email, "new@test.com")
+
+    def test_invalidated_on_change(self):
+        user_cache.get_lazy_user("owner")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+
+        self.assertIsNone(user_cache.get_lazy_user("owner"))
+
+    async def test_async_lazy_user(self):
+        user = await user_cache.aget_lazy_user("owner")
+
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user_cache.local_cache.get("owner"), self.user.id)
+        self.assertIsNone(await user_cache.aget_lazy_user("nobody"))
+
+    def test_local_lru(self):
+        cache = user_cache.LocalLRU(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        expired = user_cache.LocalLRU(2, -1)
+        expired.set("a", 1)
+        self.assertIsNone(expired.get("a"))
+
+
+class AddressBookTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserProfile.objects.create(username="owner", password="x", email="owner@test.com",
+                                               phone="13800000001")
+        self.home = self.make_address("家", is_default=True)
+        self.office = self.make_address("公司")
+
+    def make_address(self, tag, user=None, **fields):
+        return Address.objects.create(user_profile=user or self.user, receiver="张三", address="北京",
+                                      postcode="100000", receiver_mobile="13800000000", tag=tag, **fields)
+
+    def defaults(self):
+        return list(Address.objects.filter(is_default=True).values_list("id", flat=True))
+
+    def test_default_first(self):
+        self.make_address("宿舍")
+        Address.objects.filter(id=self.office.id).update(is_default=True)
+        Address.objects.filter(id=self.home.id).update(is_default=False)
+
+        tags = [a["tag"] for a in address_book.get_addresses(self.user.id)]
+
+        self.assertEqual(tags, ["公司", "家", "宿舍"])
+
+    def test_cached(self):
+        address_book.get_addresses(self.user.id)
+
+        with self.assertNumQueries(0):
+            address_book.get_addresses(self.user.id)
+
+    def test_set_default(self):
+        address_book.get_addresses(self.user.id)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(address_book.set_default(self.user.id, self.office.id))
+
+        self.assertEqual(self.defaults(), [self.office.id])
+        self.assertEqual(address_book.get_addresses(self.user.id)[0]["id"], self.office.id)
+
+    def test_set_default_unknown_address(self):
+        other = UserProfile.objects.create(username="other", password="x", email="other@test.com",
+                                           phone="13800000002")
+        foreign = self.make_address("家", user=other)
+        deleted = self.make_address("宿舍", is_delete=True)
+
+        for addr_id in [foreign.id, deleted.id, 0]:
+            with self.subTest(addr_id=addr_id):
+                self.assertFalse(address_book.set_default(self.user.id, addr_id))
+
+        self.assertEqual(self.defaults(), [self.home.id])
+
+    def test_default_view(self):
+        response = self.client.post("/v1/users/owner/address/default", json.dumps({"id": self.office.id}),
+                                    content_type="application/json", HTTP_AUTHORIZATION=make_token("owner"))
+
+        self.assertEqual(response.json()["code"], 200)
+        self.assertEqual(self.defaults(), [self.office.id])
+
+
+class SmsTaskTest(RedisTestCase):
+    def send(self, resp):
+        with mock.patch.object(tasks, "send_sms", return_value=dict(resp)) as send_sms:
+            tasks.async_send_message.apply(("1", "13800000001", ["1234"]))
+        return send_sms.call_count
+
+    def test_retry_connect_error(self):
+        with self.assertLogs("celery.app.trace", "ERROR"):
+            calls = self.send(sms_api.CONNECT_ERROR)
+
+        self.assertEqual(calls, tasks.async_send_message.max_retries + 1)
+
+    def test_no_retry_after_sent(self):
+        for resp in [sms_api.NO_RESPONSE, sms_api.INVALID_RESPONSE, {"statusCode": sms_api.SUCCESS_CODE}]:
+            with self.subTest(resp=resp):
+                self.assertEqual(self.send(resp), 1)
+
+    def test_bulk_message(self):
+        mobiles = [f"138000000{i:02d}" for i in range(5)]
+        with mock.patch.object(sms_api.RonglianClient, "max_recipients", 2), \
+                mock.patch.object(settings, "SMS_PROVIDER", "ronglian"), \
+                mock.patch.object(tasks, "send_sms", return_value={"statusCode": sms_api.SUCCESS_CODE}) as send_sms:
+            self.assertEqual(tasks.async_send_bulk_message("1", mobiles + mobiles[:1], ["通知"]), 3)
+
+        self.assertEqual([c.args[1] for c in send_sms.call_args_list],
+                         [",".join(mobiles[:2]), ",".join(mobiles[2:4]), mobiles[4]])
@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     # 注册功能:v1/users/register
     path("register", views.register),
+    # 检查用户名是否被占用:v1/users/check?username=xxx
+    path("check", views.check_username_view),
     # 登录功能:v1/users/login
     path("login", views.login),
     # 收货地址[新增和查询]:v1/users/<username>/address
@@ -0,0 +1,131 @@
+"""
+登录用户缓存
+logging_check每个请求都要根据用户名找到用户,而购物车、地址等视图只用到user.id
+1.进程内LRU: username -> id,最多USER_CACHE_SIZE个,USER_CACHE_TTL秒后过期
+2.Redis(default缓存): auth_user_liying -> 1
+两级都没有命中时才查询MySQL,用户信息保存/删除时由信号(users/signals.py)删除缓存
+request.myuser只加载id和username,视图访问其他字段时才查询MySQL
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from dashop import settings
+from users.models import UserProfile
+from utils import async_redis
+
+
+def user_key(username):
+    return f"auth_user_{username}"
+
+
+class LocalLRU:
+    """
+    进程内带过期时间的LRU缓存,线程安全
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expire = item
+            if expire < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRU(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+def get_user_id(username):
+    """
+    功能函数:根据用户名获取用户id,用户不存在返回None
+    """
+    user_id = local_cache.get(username)
+    if user_id is not None:
+        return user_id
+
+    key = user_key(username)
+    user_id = caches["default"].get(key)
+    if user_id is None:
+        user_id = UserProfile.objects.filter(username=username).values_list("id", flat=True).first()
+        if user_id is None:
+            return None
+        caches["default"].set(key, user_id, settings.USER_CACHE_REDIS_TTL)
+
+    local_cache.set(username, user_id)
+    return user_id
+
+
+def get_lazy_user(username):
+    """
+    功能函数:获取只加载了id和username的用户对象
+    其他字段(password、email...)第一次访问时才查询MySQL,save()只保存已加载的字段
+    用户不存在返回None
+    """
+    user_id = get_user_id(username)
+    if user_id is None:
+        return None
+    return UserProfile.from_db("default", ["id", "username"], [user_id, username])
+
+
+async def aget_user_id(username):
+    """
+    功能函数:get_user_id的异步版本,供异步视图使用
+    """
+    user_id = local_cache.get(username)
+    if user_id is not None:
+        return user_id
+
+    key = user_key(username)
+    user_id = await async_redis.cache_get("default", key)
+    if user_id is None:
+        user_id = await UserProfile.objects.filter(username=username).values_list("id", flat=True).afirst()
+        if user_id is None:
+            return None
+        await async_redis.cache_set("default", key, user_id, settings.USER_CACHE_REDIS_TTL)
+
+    local_cache.set(username, user_id)
+    return user_id
+
+
+async def aget_lazy_user(username):
+    user_id = await aget_user_id(username)
+    if user_id is None:
+        return None
+    return UserProfile.from_db("default", ["id", "username"], [user_id, username])
+
+
+def invalidate(username):
+    """
+    功能函数:删除用户缓存
+    其他进程的LRU最多USER_CACHE_TTL秒后过期
+    """
+    local_cache.delete(username)
+    caches["default"].delete(user_key(username))
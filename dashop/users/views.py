@@ -1,5 +1,6 @@
 import base64
 import json
+import logging
 from datetime import datetime
 import random
 import requests
@@ -9,11 +10,25 @@ from django.http import JsonResponse, HttpRequest
 from django.views import View
 from django.core.cache import caches
 
+from users import sms_code
+from users.credentials import authenticate, hash_password
+from users.registration import create_user, username_taken
+from users.address_book import get_addresses, invalidate as invalidate_addresses, set_default
 from users.models import UserProfile, Address, WeiboProfile
 from dashop import settings
-from users.tasks import async_send_active_email, async_send_message
+from users.mail_outbox import enqueue as send_active_email
+from users.tasks import async_send_message
 from utils.logging_dec import logging_check
-from utils.helper import md5_string, make_token, get_verify_url
+from utils.helper import make_token, get_verify_url
+
+logger = logging.getLogger(__name__)
+
+# 注册时唯一索引冲突的错误信息
+CONFLICT_ERRORS = {
+    "username": {"code": 10103, "error": "用户名已被占用"},
+    "email": {"code": 10119, "error": "邮箱已被注册"},
+    "phone": {"code": 10120, "error": "手机号已被注册"},
+}
 
 
 def register(request: HttpRequest) -> JsonResponse:
@@ -21,28 +36,18 @@ def register(request: HttpRequest) -> JsonResponse:
     注册功能视图逻辑
     1.获取请求体数据
     2.数据合法性校验
-    3.确认用户名是否被占用
+    3.确认用户名是否被占用(Redis用户名集合)
       3.1 被占用:直接返回
-      3.2 未被占用:存入数据表
+      3.2 未被占用:校验短信验证码,存入数据表(一条INSERT,用户名/邮箱/手机号冲突由唯一索引判断)
           签发token,返回响应[接口文档]
     """
     data = json.loads(request.body)
-    print(data)
     username = data.get("uname")
     password = data.get("password")
     email = data.get("email")
     phone = data.get("phone")
     verify = data.get("verify")
 
-    # 短信验证码校验
-    key2 = f"sms_{phone}"
-    redis_code = caches["sms"].get(key2)
-    if not redis_code:
-        return JsonResponse({"code": 10110, "error": "验证码已过期,请重新获取"})
-
-    if str(redis_code) != verify:
-        return JsonResponse({"code": 10111, "error": "验证码错误,请重新输入"})
-
     # 2.数据合法性校验
     if len(username) < 6 or len(username) > 11:
         return JsonResponse({"code": 10100, "error": "用户名不合法"})
@@ -53,30 +58,33 @@ def register(request: HttpRequest) -> JsonResponse:
     if len(phone) != 11:
         return JsonResponse({"code": 10102, "error": "手机号不合法"})
 
-    # 3.确认用户名是否被占用
-    user_query = UserProfile.objects.filter(username=username)
-    print(f"user_query -> {user_query}")
-    # 被占用
-    if user_query:
+    # 3.确认用户名是否被占用,避免已被占用时消耗验证码
+    if username_taken(username):
         return JsonResponse({"code": 10103, "error": "用户名已被占用"})
 
+    # 短信验证码校验:放在其他校验之后,校验正确时验证码即被删除,只能使用一次
+    verified = sms_code.verify(phone, verify)
+    if verified == -1:
+        return JsonResponse({"code": 10110, "error": "验证码已过期,请重新获取"})
+
+    if verified == 0:
+        return JsonResponse({"code": 10111, "error": "验证码错误,请重新输入"})
+
     # 存入数据表
-    try:
-        user = UserProfile.objects.create(username=username, password=md5_string(password), email=email, phone=phone)
-        print(f"user -> {user}")
-    except Exception as e:
-        print(e)
+    user, conflict = create_user(username, hash_password(password), email, phone)
+    if conflict:
+        # 验证码已被消费,放回后用户修改邮箱/用户名即可重新提交
+        sms_code.restore(phone, verify)
+        return JsonResponse(CONFLICT_ERRORS[conflict])
+    logger.info("register user_id=%s username=%s", user.id, username)
 
     # 发送激活邮件
     verify_url = get_verify_url(username)
-    async_send_active_email.delay(email, username, verify_url)
+    send_active_email(email, username, verify_url)
 
     # 签发token
     token = make_token(username)
 
-    # 清除短信验证码,释放内存
-    caches["sms"].delete(key2)
-
     # 返回响应
     result = {
         "code": 200,
@@ -97,13 +105,15 @@ def login(request: HttpRequest) -> JsonResponse:
          2.2 正确:生成token,然后返回
        """
     data = json.loads(request.body)
-    print(f"login data ->{data}")
     username = data.get("username")
     password = data.get("password")
-    user_query = UserProfile.objects.filter(username=username, password=md5_string(password))
-    print(f"login user_query -> {user_query}")
+    user, retry_after = authenticate(username, password, request.META.get("REMOTE_ADDR"))
 
-    if not user_query:
+    if retry_after:
+        return JsonResponse({"code": 10118, "error": "登录失败次数过多,请稍后再试", "retry_after": retry_after})
+
+    if user is None:
+        logger.info("login failed username=%s", username)
         return JsonResponse({"code": 10104, "error": "用户名或密码错误"})
 
     # 返回响应
@@ -129,9 +139,8 @@ class AddressView(View):
         2.组装数据返回响应
         {"code":200,"addresslist":[{},{},{},{},{}]}
         """
-        addr_query = Address.objects.filter(user_profile=request.myuser, is_delete=False)
-        addr_list = list(
-            addr_query.values('id', 'address', 'receiver', 'receiver_mobile', 'tag', 'postcode', 'is_default'))
+        # 默认地址在第1个
+        addr_list = get_addresses(request.myuser.id)
 
         result = {
             "code": 200,
@@ -157,11 +166,11 @@ class AddressView(View):
         user = request.myuser
 
         # 查询该用户是否有收货地址
-        address_query = Address.objects.filter(user_profile=user, is_delete=False)
-        is_default = False if address_query else True
+        is_default = not get_addresses(user.id)
 
         Address.objects.create(user_profile=user, receiver=receiver, receiver_mobile=receiver_phone, address=address,
                                postcode=postcode, tag=tag, is_default=is_default)
+        invalidate_addresses(user.id)
 
         return JsonResponse({"code": 200, "data": "新增地址成功"})
 
@@ -177,13 +186,14 @@ class AddressView(View):
         try:
             addr = Address.objects.filter(user_profile=user, id=id, is_delete=False)
         except Exception as e:
-            print(e)
+            logger.warning("address %s not found: %s", id, e)
             return JsonResponse({"code": 10106, "error": "地址不存在"})
 
         data = request.mydata
         data.pop("id")
         data["updated_time"] = datetime.now()
         addr.update(**data)
+        invalidate_addresses(user.id)
         return JsonResponse({"code": 200, "data": "地址修改成功"})
 
     @logging_check
@@ -196,10 +206,11 @@ class AddressView(View):
         try:
             addr = Address.objects.get(user_profile=user, id=id, is_delete=False)
         except Exception as e:
-            print(e)
+            logger.warning("address %s not found: %s", id, e)
             return JsonResponse({"code": 10106, "error": "地址不存在"})
         addr.is_delete = True
         addr.save()
+        invalidate_addresses(user.id)
         return JsonResponse({"code": 200, "data": "地址删除成功"})
 
 
@@ -209,37 +220,16 @@ class DefaultAddressView(View):
         """
         设置默认地址视图逻辑
         1.获取请求体数据[id]
-        2.把原来的默认地址取消默认
-        3.把现在的地址设置为默认
-        4.返回响应
+        2.一条UPDATE:原来的默认地址取消默认,现在的地址设置为默认
+        3.返回响应
         """
-        id = request.mydata.get("id")
-        user = request.myuser
-
-        # 开启事务
-        with transaction.atomic():
-            # 创建存储点
-            sid = transaction.savepoint()
-            try:
-                # 把原来的默认地址取消默认
-                # <QuerySet [<AddrObject>]>
-                old_query = Address.objects.filter(is_default=True, user_profile=user, is_delete=False)
-                if old_query:
-                    old_addr = old_query[0]
-                    old_addr.is_default = False
-                    old_addr.save()
-
-                # 现在的地址设置为默认
-                new_addr = Address.objects.get(id=id, user_profile=user, is_delete=False)
-                new_addr.is_default = True
-                new_addr.save()
-            except Exception as e:
-                # 回滚+返回
-                transaction.savepoint_rollback(sid)
-                return JsonResponse({"code": 10107, "error": "设置默认地址失败"})
+        try:
+            id = int(request.mydata.get("id"))
+        except (TypeError, ValueError):
+            return JsonResponse({"code": 10107, "error": "设置默认地址失败"})
 
-            # 提交事务
-            transaction.savepoint_commit(sid)
+        if not set_default(request.myuser.id, id):
+            return JsonResponse({"code": 10107, "error": "设置默认地址失败"})
 
         return JsonResponse({"code": 200, "data": "设置默认地址成功"})
 
@@ -271,7 +261,7 @@ def active_view(request):
     try:
         user = UserProfile.objects.get(username=username)
     except Exception as e:
-        print(e)
+        logger.warning("active user %s failed: %s", username, e)
         return JsonResponse({"code:": 10109, "error": "服务器繁忙，请稍后再试"})
 
     user.is_active = True
@@ -288,28 +278,34 @@ def sms_view(request):
     3.返回响应
     """
     mobile = json.loads(request.body).get("phone")
-    # Redis: {"sms_13603263409": 1016}
-    # 判断1分钟之内是否发过
-    key1 = f"sms_ex_{mobile}"
-    r = caches["sms"].get(key1)
-    if r:
-        return JsonResponse({"code": 10109, "error": "发送过于频繁"})
 
+    # 按手机号、IP、全局检查发送频率,通过时保存验证码(一次Lua脚本调用)
     code = random.randint(1000, 9999)
-    datas = (code, 5)
+    allowed, rule, retry_after = sms_code.issue(mobile, request.META.get("REMOTE_ADDR"), code)
+    if not allowed:
+        logger.info("sms limited by %s mobile=%s", rule, mobile)
+        return JsonResponse({"code": 10109, "error": "发送过于频繁", "retry_after": retry_after})
+
+    datas = (code, settings.SMS_CODE_TTL // 60)
     # celery异步发送短信验证码
     async_send_message.delay("1", mobile, datas)
 
-    # 存入Redis数据库
-    # 60s:用于控制短信发送频率
-    caches["sms"].set(key1, code, 60)
-    # 300s:用于短信验证码的校验
-    key2 = f"sms_{mobile}"
-    caches["sms"].set(key2, code, 300)
-
     return JsonResponse({"code": 200, "data": "验证码发送成功"})
 
 
+def check_username_view(request):
+    """
+    检查用户名是否被占用视图逻辑(注册页输入用户名时调用)
+    只查询Redis中的用户名集合,不查询MySQL
+    响应: {"code":200, "data": {"username": "xxx", "available": true}}
+    """
+    username = request.GET.get("username", "")
+    if len(username) < 6 or len(username) > 11:
+        return JsonResponse({"code": 10100, "error": "用户名不合法"})
+
+    return JsonResponse({"code": 200, "data": {"username": username, "available": not username_taken(username)}})
+
+
 class WeiboCodeView(View):
     def get(self, request):
         """
@@ -335,7 +331,6 @@ class WeiboTokenView(View):
         2.利用code获取访问令牌access_token
         """
         code = request.GET.get("code")
-        print(f"weibo code -> {code}")
         # 访问令牌微博接口文档
         url = "https://api.weibo.com/oauth2/access_token"
         data = {
@@ -346,7 +341,8 @@ class WeiboTokenView(View):
             "redirect_uri": settings.WEIBO_REDIRECT_URI
         }
         resp = requests.post(url=url, data=data).json()
-        print(f"weibo token resp -> {resp}")
+        # 响应中包含access_token,只记录uid和错误信息
+        logger.info("weibo token uid=%s error=%s", resp.get("uid"), resp.get("error"))
         """
         resp返回格式如下：
                {
@@ -374,14 +370,14 @@ class WeiboTokenView(View):
             wuser = WeiboProfile.objects.get(wuid=wuid)
         except Exception as e:
             # 第一次扫码登录
-            print("第一次扫码登录")
+            logger.info("weibo first login uid=%s", wuid)
             WeiboProfile.objects.create(wuid=wuid, access_token=access_token)
             return JsonResponse({"code": 201, "uid": wuid})
 
         user = wuser.user_profile
         if not user:
             # 没有和正式用户绑定过
-            print("没有和正式用户绑定过")
+            logger.info("weibo uid=%s not bound", wuid)
             return JsonResponse({"code": 201, "uid": wuid})
 
         # 已经正式绑定过
@@ -418,8 +414,7 @@ class WeiboTokenView(View):
             return JsonResponse({"code": 10115, "error": "手机号不合法"})
 
         # 校验用户名是否被占用
-        user_query = UserProfile.objects.filter(username=username)
-        if user_query:
+        if username_taken(username):
             # 被占用
             return JsonResponse({"code": 10116, "error": "用户名被占用"})
 
@@ -428,8 +423,12 @@ class WeiboTokenView(View):
             sid = transaction.savepoint()
             try:
                 # 存入数据表
-                user = UserProfile.objects.create(username=username, password=md5_string(password), email=email,
-                                                  phone=phone)
+                user, conflict = create_user(username, hash_password(password), email, phone)
+                if conflict:
+                    transaction.savepoint_rollback(sid)
+                    if conflict == "username":
+                        return JsonResponse({"code": 10116, "error": "用户名被占用"})
+                    return JsonResponse(CONFLICT_ERRORS[conflict])
                 # 绑定
                 wuser = WeiboProfile.objects.get(wuid=wuid)
                 wuser.user_profile = user
@@ -443,7 +442,7 @@ class WeiboTokenView(View):
 
         # 发送激活邮件
         verify_url = get_verify_url(username)
-        async_send_active_email.delay(email, username, verify_url)
+        send_active_email(email, username, verify_url)
 
         token = make_token(username)
 
@@ -463,9 +462,11 @@ class BindUserView(View):
         password = data.get("password")
         wuid = data.get("uid")
 
-        try:
-            user = UserProfile.objects.get(username=username, password=md5_string(password))
-        except Exception as e:
+        user, retry_after = authenticate(username, password, request.META.get("REMOTE_ADDR"))
+        if retry_after:
+            return JsonResponse({"code": 10118, "error": "登录失败次数过多,请稍后再试", "retry_after": retry_after})
+
+        if user is None:
             return JsonResponse({"code": 10111, "error": "用户名或密码错误"})
 
         # 微博用户和正式用户进行绑定
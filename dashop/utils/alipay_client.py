@@ -0,0 +1,97 @@
+"""
+支付宝客户端
+每个进程只读取和解析一次密钥文件,orders(生成支付地址)和pays(支付结果通知)共用同一个客户端
+1.fork出的子进程(gunicorn/celery worker)重新创建客户端
+2.每隔ALIPAY_KEY_CHECK_INTERVAL秒检查一次密钥文件的修改时间,文件变化后重新加载
+"""
+import logging
+import os
+import threading
+import time
+
+from alipay import AliPay
+
+from dashop import settings
+
+logger = logging.getLogger(__name__)
+
+PRIVATE_KEY_FILE = "app_private_key.pem"
+PUBLIC_KEY_FILE = "alipay_public_key.pem"
+
+_lock = threading.Lock()
+_state = {"pid": None, "client": None, "mtimes": None, "checked": 0.0}
+
+
+def _reset_after_fork():
+    # 子进程中锁可能处于被持有的状态,重新创建
+    global _lock
+    _lock = threading.Lock()
+    _state.update(pid=None, client=None, mtimes=None, checked=0.0)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def key_paths():
+    return [os.path.join(settings.ALIPAY_KEY_DIR, name) for name in (PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)]
+
+
+def key_mtimes():
+    return tuple(os.stat(path).st_mtime_ns for path in key_paths())
+
+
+def build_alipay():
+    """
+    功能函数:读取密钥文件,创建支付宝客户端
+    """
+    private_path, public_path = key_paths()
+    with open(private_path) as f:
+        private_key = f.read()
+    with open(public_path) as f:
+        public_key = f.read()
+
+    return AliPay(
+        # 应用ID:控制台获取
+        appid=settings.ALIPAY_APPID,
+        # 异步通知地址[有支付结果]
+        app_notify_url=settings.ALIPAY_NOTIFY_URL,
+        # 应用私钥[用于签名]
+        app_private_key_string=private_key,
+        # 支付宝公钥[用于签名]
+        alipay_public_key_string=public_key,
+        # 签名使用算法:非对称加密
+        sign_type="RSA2",
+        # False:线上环境,True:沙箱环境
+        debug=True
+    )
+
+
+def get_alipay():
+    """
+    功能函数:获取当前进程的支付宝客户端
+    """
+    client = _state["client"]
+    now = time.monotonic()
+    if client is not None and _state["pid"] == os.getpid() \
+            and now - _state["checked"] < settings.ALIPAY_KEY_CHECK_INTERVAL:
+        return client
+
+    with _lock:
+        client = _state["client"]
+        if client is not None and _state["pid"] == os.getpid():
+            try:
+                mtimes = key_mtimes()
+            except OSError as e:
+                # 密钥文件正在替换,继续使用已加载的密钥
+                logger.warning("alipay key files stat error: %s", e)
+                mtimes = _state["mtimes"]
+            if mtimes == _state["mtimes"]:
+                _state["checked"] = now
+                return client
+            logger.info("alipay key files changed, reloading")
+
+        mtimes = key_mtimes()
+        client = build_alipay()
+        _state.update(pid=os.getpid(), client=client, mtimes=mtimes, checked=now)
+        return client
@@ -0,0 +1,63 @@
+"""
+异步Redis客户端(redis.asyncio)
+ASGI下的异步视图使用,和django_redis读写同一个Redis库、同样的key和序列化格式:
+1.连接地址来自CACHES[alias]["LOCATION"](读取当前生效的配置模块,和django_redis一致)
+2.key通过caches[alias].make_key()生成(前缀和版本号)
+3.值通过caches[alias].client.decode()/encode()转换
+连接池和事件循环绑定,每个事件循环一个客户端
+"""
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.cache import caches
+
+# {事件循环: {alias: 客户端}}
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis(alias="default"):
+    """
+    功能函数:获取当前事件循环的异步Redis客户端
+    必须在协程中调用
+    """
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    client = clients.get(alias)
+    if client is None:
+        location = settings.CACHES[alias]["LOCATION"]
+        pool = aioredis.ConnectionPool.from_url(location, **settings.ASYNC_REDIS_POOL_KWARGS)
+        client = clients[alias] = aioredis.Redis(connection_pool=pool)
+
+    return client
+
+
+async def cache_get(alias, key):
+    """
+    功能函数:读取django_redis缓存中的数据,不存在返回None
+    """
+    cache = caches[alias]
+    raw = await get_async_redis(alias).get(cache.make_key(key))
+    return None if raw is None else cache.client.decode(raw)
+
+
+async def cache_get_many(alias, keys):
+    """
+    功能函数:批量读取django_redis缓存中的数据
+    返回: {key: value},不存在的key不在字典中
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    cache = caches[alias]
+    values = await get_async_redis(alias).mget([cache.make_key(k) for k in keys])
+    return {k: cache.client.decode(v) for k, v in zip(keys, values) if v is not None}
+
+
+async def cache_set(alias, key, value, timeout):
+    """
+    功能函数:写入django_redis缓存,timeout为None时永久存储
+    """
+    cache = caches[alias]
+    await get_async_redis(alias).set(cache.make_key(key), cache.client.encode(value), ex=timeout)
@@ -2,6 +2,8 @@ import base64
 import hashlib
 import random
 import time
+from functools import lru_cache
+
 import jwt
 
 from django.core.cache import caches
@@ -17,13 +19,33 @@ def md5_string(s):
     return m.hexdigest()
 
 
+@lru_cache(maxsize=1)
+def get_jwt_key():
+    """
+    功能函数:签名密钥,只转换一次
+    """
+    return settings.JWT_TOKEN_KEY.encode()
+
+
 def make_token(username, expire=3600 * 24):
     """
     功能函数:签发token
     """
     payload = {"exp": time.time() + expire, "username": username}
-    key = settings.JWT_TOKEN_KEY
-    return jwt.encode(payload, key, algorithm="HS256")
+    return jwt.encode(payload, get_jwt_key(), algorithm="HS256")
+
+
+def decode_token(token):
+    """
+    功能函数:校验token
+    成功返回payload,失败(格式错误、签名错误、已过期)返回None
+    """
+    if not token or token.count(".") != 2:
+        return None
+    try:
+        return jwt.decode(token, get_jwt_key(), algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
 
 
 def get_verify_url(username):
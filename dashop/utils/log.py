@@ -0,0 +1,211 @@
+"""
+结构化日志
+1.JsonFormatter: 每条日志一行JSON,包含请求ID和路由
+2.RequestIdMiddleware: 读取/生成X-Request-ID,保存在contextvar中,并按路由决定当前请求的日志是否抽样输出
+3.QueueLogHandler: 请求线程只把日志放入内存队列,由后台线程(QueueListener)写入真正的handler
+  队列满时丢弃日志并计数,输出慢(磁盘/网络)不会阻塞请求
+配置见settings.LOGGING
+"""
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import weakref
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.module_loading import import_string
+
+from dashop import settings
+
+request_id = ContextVar("request_id", default="-")
+route = ContextVar("route", default="-")
+# 当前请求的INFO及以下日志是否输出
+sampled = ContextVar("log_sampled", default=True)
+
+# LogRecord自带的属性,其余属性(extra=...)作为JSON字段输出
+RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class RequestFilter(logging.Filter):
+    """
+    在打日志的线程中记录请求ID和路由(QueueListener在后台线程中格式化,读不到请求的contextvar)
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        record.route = route.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    WARNING及以上全部输出,其余日志按请求抽样
+    """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or sampled.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)) + f".{record.msecs:03.0f}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "route": getattr(record, "route", "-"),
+            "process": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and key not in data:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_handlers = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # 队列满时等待后台线程取走日志,put_nowait会抛出queue.Full导致无法停止
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    LOGGING中的用法:
+    "class": "utils.log.QueueLogHandler",
+    "target": "logging.StreamHandler",      # 后台线程中实际输出日志的handler
+    "target_kwargs": {},
+    "formatter": "json",                     # 设置给target
+    """
+
+    def __init__(self, target="logging.StreamHandler", target_kwargs=None, maxsize=None):
+        self.maxsize = maxsize or settings.LOG_QUEUE_SIZE
+        super().__init__(queue.Queue(self.maxsize))
+        self.target = import_string(target)(**(target_kwargs or {}))
+        self.dropped = 0
+        self.listener = None
+        self.start()
+
+    def start(self):
+        self.listener = _Listener(self.queue, self.target)
+        self.listener.start()
+        _handlers.add(self)
+
+    def setFormatter(self, fmt):
+        # 格式化在后台线程中由target完成
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # 合并参数、提前格式化异常,避免后台线程格式化时参数已经被修改
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.listener is None:
+            # 第三方库(如python-alipay-sdk)导入时调用dictConfig会close所有已有的handler,
+            # handler仍然挂在logger上,重新启动后台线程
+            with _lock:
+                if self.listener is None:
+                    self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # 停止后台线程前会写完队列中的日志
+        _handlers.discard(self)
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.flush()
+        super().close()
+
+
+def _restart_after_fork():
+    # 子进程中没有父进程的后台线程,重新创建锁、队列和线程
+    global _lock
+    _lock = threading.Lock()
+    for handler in list(_handlers):
+        handler.queue = queue.Queue(handler.maxsize)
+        handler.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_sample_rate(path):
+    return settings.LOG_SAMPLE_RATES.get(path, settings.LOG_SAMPLE_RATE)
+
+
+class RequestIdMiddleware:
+    """
+    1.请求头X-Request-ID存在时沿用(nginx等上游生成),否则生成新的
+    2.响应头返回X-Request-ID
+    3.路由确定后(process_view)按LOG_SAMPLE_RATES决定当前请求的INFO日志是否输出
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        tokens = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish(tokens)
+        response["X-Request-ID"] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish(tokens)
+        response["X-Request-ID"] = request.request_id
+        return response
+
+    def start(self, request):
+        request.request_id = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex
+        return request_id.set(request.request_id), route.set("-"), sampled.set(True)
+
+    def finish(self, tokens):
+        for var, token in zip((request_id, route, sampled), tokens):
+            var.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        path = request.resolver_match.route
+        route.set(path)
+        rate = get_sample_rate(path)
+        if rate < 1:
+            sampled.set(random.random() < rate)
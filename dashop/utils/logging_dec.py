@@ -1,8 +1,7 @@
 import json
-import jwt
-from dashop import settings
-from django.http import JsonResponse, HttpRequest
-from users.models import UserProfile
+from django.http import JsonResponse
+from users.user_cache import aget_lazy_user, get_lazy_user
+from utils.helper import decode_token
 
 
 def logging_check(func):
@@ -12,16 +11,14 @@ def logging_check(func):
     2.校验token
       2.1 失败:则直接返回
       2.2 成功:执行视图func(...)
+    request.myuser只加载了id和username,访问其他字段时才查询MySQL
     """
 
     def wrapper(self, request, username, *args, **kwargs):
         token = request.headers.get("Authorization")
-        print(f"token -> {token}, {username}")
 
-        try:
-            payload = jwt.decode(token, settings.JWT_TOKEN_KEY, algorithms="HS256")
-        except Exception as e:
-            print(e)
+        payload = decode_token(token)
+        if payload is None:
             # token有问题
             return JsonResponse({"code": 403})
 
@@ -30,7 +27,10 @@ def logging_check(func):
             # 用户名不匹配
             return JsonResponse({"code": 403})
 
-        user = UserProfile.objects.get(username=username)
+        user = get_lazy_user(username)
+        if user is None:
+            # 用户已删除
+            return JsonResponse({"code": 403})
         request.myuser = user
 
         # 封装mydata属性:请求体数据
@@ -41,3 +41,30 @@ def logging_check(func):
         return func(self, request, username, *args, **kwargs)
 
     return wrapper
+
+
+def alogging_check(func):
+    """
+    logging_check的异步版本,装饰异步视图
+    查询用户时不阻塞事件循环
+    """
+
+    async def wrapper(self, request, username, *args, **kwargs):
+        token = request.headers.get("Authorization")
+
+        payload = decode_token(token)
+        if payload is None or username != payload.get("username"):
+            return JsonResponse({"code": 403})
+
+        user = await aget_lazy_user(username)
+        if user is None:
+            return JsonResponse({"code": 403})
+        request.myuser = user
+
+        request_data = request.body
+        if request_data:
+            request.mydata = json.loads(request_data)
+
+        return await func(self, request, username, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,337 @@
+"""
+请求统计中间件
+1.按METRICS_SAMPLE_RATE抽样记录每个请求的:SQL次数/耗时、Redis命令次数/耗时、请求总耗时
+2.SQL通过connection.execute_wrapper统计,Redis通过包装redis-py的execute_command/Pipeline.execute统计
+  统计数据保存在contextvar中,run_parallel线程池和sync_to_async中执行的查询也计入当前请求
+3.按路由(如v1/goods/detail/<int:sku_id>)汇总成直方图,每METRICS_FLUSH_INTERVAL秒合并到Redis中(多进程共享)
+4./metrics 输出Prometheus文本格式
+5.METRICS_HEADER=True时所有请求都统计,并写入Server-Timing响应头,在浏览器开发者工具中查看
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+import redis
+import redis.asyncio
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django_redis import get_redis_connection
+
+from dashop import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis-key: 汇总数据 metrics:<method>:<route> -> {"db_queries:5": 10, "db_queries:sum": 32, ...}
+METRICS_KEY = "metrics"
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# 指标名: (说明, 分桶)
+METRICS = {
+    "request_duration_seconds": ("请求总耗时(秒)", TIME_BUCKETS),
+    "db_queries": ("每个请求的SQL次数", COUNT_BUCKETS),
+    "db_duration_seconds": ("每个请求的SQL总耗时(秒)", TIME_BUCKETS),
+    "redis_commands": ("每个请求的Redis命令次数(pipeline算一次)", COUNT_BUCKETS),
+    "redis_duration_seconds": ("每个请求的Redis总耗时(秒)", TIME_BUCKETS),
+}
+
+_current = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """
+    一个请求的统计数据,可能在多个线程中累加
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+
+    def add_db(self, seconds):
+        with self.lock:
+            self.db_queries += 1
+            self.db_time += seconds
+
+    def add_redis(self, seconds):
+        with self.lock:
+            self.redis_commands += 1
+            self.redis_time += seconds
+
+    def values(self, duration):
+        return {
+            "request_duration_seconds": duration,
+            "db_queries": self.db_queries,
+            "db_duration_seconds": self.db_time,
+            "redis_commands": self.redis_commands,
+            "redis_duration_seconds": self.redis_time,
+        }
+
+    def server_timing(self, duration):
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries", '
+                f'redis;dur={self.redis_time * 1000:.1f};desc="{self.redis_commands} commands", '
+                f'app;dur={duration * 1000:.1f}')
+
+
+# ----------------------------- SQL/Redis统计 ----------------------------- #
+
+def sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_db(time.perf_counter() - start)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    # 每个线程各自的数据库连接都需要安装,重连时不重复安装
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def timed(func):
+    def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.add_redis(time.perf_counter() - start)
+
+    wrapper.metrics_wrapped = True
+    return wrapper
+
+
+def atimed(func):
+    async def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return await func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stats.add_redis(time.perf_counter() - start)
+
+    wrapper.metrics_wrapped = True
+    return wrapper
+
+
+_installed = []
+
+
+def install():
+    """
+    功能函数:安装SQL和Redis统计,只安装一次
+    Pipeline重写了execute_command(只是缓存命令),所以pipeline按execute()统计一次往返
+    """
+    if _installed:
+        return
+    _installed.append(True)
+    connection_created.connect(install_sql_wrapper, dispatch_uid="metrics_sql_wrapper")
+    for cls, name, wrap in ((redis.Redis, "execute_command", timed),
+                            (redis.client.Pipeline, "execute", timed),
+                            (redis.asyncio.Redis, "execute_command", atimed),
+                            (redis.asyncio.client.Pipeline, "execute", atimed)):
+        func = getattr(cls, name)
+        if not getattr(func, "metrics_wrapped", False):
+            setattr(cls, name, wrap(func))
+
+
+# ----------------------------- 汇总 ----------------------------- #
+
+class Registry:
+    """
+    进程内的直方图,定期合并到Redis
+    {(method, route): {指标名: [各分桶次数..., +Inf次数, 总和]}}
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.last_flush = time.monotonic()
+
+    def observe(self, method, route, values):
+        with self.lock:
+            series = self.data.setdefault((method, route), {})
+            for name, value in values.items():
+                buckets = METRICS[name][1]
+                counts = series.setdefault(name, [0] * (len(buckets) + 2))
+                counts[bucket_index(buckets, value)] += 1
+                counts[-1] += value
+
+    def due(self):
+        return time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+    def flush(self):
+        """
+        功能函数:把进程内的数据合并到Redis,Redis不可用时丢弃这段时间的数据
+        """
+        with self.lock:
+            data, self.data = self.data, {}
+            self.last_flush = time.monotonic()
+        if not data:
+            return
+
+        try:
+            pipe = get_redis_connection("default").pipeline(transaction=False)
+            for (method, route), series in data.items():
+                key = f"{METRICS_KEY}:{method}:{route}"
+                for name, counts in series.items():
+                    buckets = METRICS[name][1]
+                    for le, count in zip(buckets + ("+Inf",), counts):
+                        if count:
+                            pipe.hincrby(key, f"{name}:{le}", count)
+                    pipe.hincrby(key, f"{name}:count", sum(counts[:-1]))
+                    pipe.hincrbyfloat(key, f"{name}:sum", counts[-1])
+            pipe.execute()
+        except Exception as e:
+            logger.warning("metrics flush error: %s", e)
+
+
+def bucket_index(buckets, value):
+    for i, le in enumerate(buckets):
+        if value <= le:
+            return i
+    return len(buckets)
+
+
+registry = Registry()
+
+
+def get_route(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.route or match.view_name
+
+
+def start():
+    """
+    功能函数:按抽样率决定是否统计当前请求
+    返回: (RequestStats或None, contextvar token)
+    """
+    if not (settings.METRICS_HEADER or random.random() < settings.METRICS_SAMPLE_RATE):
+        return None, None
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish(request, response, stats, token):
+    _current.reset(token)
+    duration = time.perf_counter() - stats.start
+    registry.observe(request.method, get_route(request), stats.values(duration))
+    if settings.METRICS_HEADER:
+        timing = stats.server_timing(duration)
+        if response.has_header("Server-Timing"):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response["Server-Timing"] = timing
+
+
+class MetricsMiddleware:
+    """
+    放在MIDDLEWARE的第一位,统计的耗时包含其他中间件
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats, token = start()
+        if stats is None:
+            return self.get_response(request)
+        response = self.get_response(request)
+        finish(request, response, stats, token)
+        if registry.due():
+            registry.flush()
+        return response
+
+    async def __acall__(self, request):
+        stats, token = start()
+        if stats is None:
+            return await self.get_response(request)
+        response = await self.get_response(request)
+        finish(request, response, stats, token)
+        if registry.due():
+            await sync_to_async(registry.flush)()
+        return response
+
+
+# ----------------------------- Prometheus ----------------------------- #
+
+def load():
+    """
+    功能函数:读取Redis中的汇总数据
+    {(method, route): {"db_queries:5": 10.0, ...}}
+    """
+    r = get_redis_connection("default")
+    data = {}
+    for key in r.scan_iter(f"{METRICS_KEY}:*"):
+        method, route = key.decode()[len(METRICS_KEY) + 1:].split(":", 1)
+        data[(method, route)] = {k.decode(): float(v) for k, v in r.hgetall(key).items()}
+    return data
+
+
+def reset():
+    r = get_redis_connection("default")
+    keys = list(r.scan_iter(f"{METRICS_KEY}:*"))
+    if keys:
+        r.delete(*keys)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render(data):
+    """
+    功能函数:Prometheus文本格式,分桶为累计值
+    """
+    lines = [
+        "# HELP dashop_metrics_sample_rate 请求统计抽样率,统计的请求数 = 实际请求数 * 抽样率",
+        "# TYPE dashop_metrics_sample_rate gauge",
+        f"dashop_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}",
+    ]
+    for name, (help_text, buckets) in METRICS.items():
+        metric = f"dashop_{name}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (method, route), fields in sorted(data.items()):
+            labels = f'method="{method}",route="{escape(route)}"'
+            total = 0
+            for le in buckets + ("+Inf",):
+                total += fields.get(f"{name}:{le}", 0)
+                lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {total:.0f}')
+            lines.append(f"{metric}_sum{{{labels}}} {fields.get(f'{name}:sum', 0):g}")
+            lines.append(f"{metric}_count{{{labels}}} {fields.get(f'{name}:count', 0):.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Prometheus抓取接口,只允许METRICS_ALLOWED_IPS访问
+    """
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    registry.flush()
+    return HttpResponse(render(load()), content_type="text/plain; version=0.0.4; charset=utf-8")
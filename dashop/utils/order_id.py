@@ -0,0 +1,191 @@
+"""
+订单编号生成器
+格式: 年月日时分秒(14位) + 毫秒(3位) + 机器号(4位) + 序号(4位),共25位
+2023081510450012300070001
+1.各进程在本地生成,不需要访问数据库
+2.长度固定,按字符串排序就是按时间排序,订单表主键索引按顺序插入
+3.机器号每个进程唯一,同一毫秒内用序号区分,不会重复
+  机器号由每个进程从Redis租用(SET NX EX),配置了ORDER_ID_HOST_ID时为 主机号(2位) + 主机内的进程号(2位)
+  3.1 租约时间为ORDER_ID_LEASE_TTL,生成订单编号时每过三分之一的租约时间续期一次(心跳)
+  3.2 续期时发现租约已被其他进程占用(进程长时间空闲),重新租用,不会和正在使用的机器号重复
+  3.3 进程退出时释放租约,进程回收(gunicorn max_requests、celery max_tasks_per_child)不会耗尽机器号
+  3.4 所有机器号都被占用、Redis不可用且租约可能已经到期时抛出OrderIdError
+Redis中存储的数据结构如下:
+"order_id_lease:7": "host:1234:1f2e3d4c"   # 机器号7的租约,值为持有者,过期时间为ORDER_ID_LEASE_TTL
+"""
+import atexit
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+from dashop import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKER = 9999
+MAX_SEQ = 9999
+# 配置主机号时,每台主机的进程号范围
+MAX_HOST = 99
+MAX_SLOT = 99
+# Redis-key: 机器号的租约 order_id_lease:<机器号>
+LEASE_PREFIX = "order_id_lease"
+
+# 从随机位置开始依次尝试,租用第一个空闲的机器号
+# ARGV: 租约key前缀, 第一个机器号, 机器号数量, 起始位置, 持有者, 租约时间
+# 返回: 机器号,全部被占用时返回-1
+ACQUIRE_SCRIPT = """
+local first, n, start = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+for i = 0, n - 1 do
+    local worker_id = first + (start + i) % n
+    if redis.call('SET', ARGV[1] .. ':' .. worker_id, ARGV[5], 'NX', 'EX', ARGV[6]) then
+        return worker_id
+    end
+end
+return -1
+"""
+
+# 租约仍由自己持有时续期
+# KEYS: 租约key  ARGV: 持有者, 租约时间
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 租约仍由自己持有时释放
+# KEYS: 租约key  ARGV: 持有者
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class OrderIdError(Exception):
+    """
+    没有可用的机器号
+    """
+
+
+def lease_key(worker_id):
+    return f"{LEASE_PREFIX}:{worker_id}"
+
+
+class OrderIdGenerator:
+    """
+    Snowflake风格的订单编号生成器
+    fork出的子进程(gunicorn/celery worker)会重新租用机器号
+    """
+
+    def __init__(self, host_id=None):
+        self._lock = threading.Lock()
+        self._host_id = None if host_id in (None, "") else int(host_id)
+        if self._host_id is not None and not 0 <= self._host_id <= MAX_HOST:
+            raise ValueError(f"ORDER_ID_HOST_ID must be 0-{MAX_HOST}")
+        self._pid = None
+        self._owner = None
+        self._worker_id = None
+        self._renewed = 0
+        self._last_ms = 0
+        self._seq = 0
+
+    def _acquire(self):
+        """
+        功能函数:租用一个空闲的机器号
+        配置了主机号时在主机内租用进程号: 主机号 * 100 + 进程号
+        """
+        if self._host_id is None:
+            first, n = 0, MAX_WORKER + 1
+        else:
+            first, n = self._host_id * (MAX_SLOT + 1), MAX_SLOT + 1
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        renewed = time.monotonic()
+        worker_id = get_redis_connection("default").eval(
+            ACQUIRE_SCRIPT, 0, LEASE_PREFIX, first, n, random.randrange(n), owner, settings.ORDER_ID_LEASE_TTL)
+        if worker_id < 0:
+            raise OrderIdError(f"all {n} order id workers are in use")
+
+        self._pid, self._owner, self._worker_id, self._renewed = os.getpid(), owner, worker_id, renewed
+        self._last_ms = 0
+        self._seq = 0
+        logger.info("order id worker_id=%04d", worker_id)
+
+    def _heartbeat(self):
+        """
+        功能函数:确保当前进程持有一个有效的机器号租约
+        新进程(或fork出的子进程)租用机器号,每过三分之一的租约时间续期一次
+        """
+        if self._pid != os.getpid():
+            self._acquire()
+            return
+
+        ttl = settings.ORDER_ID_LEASE_TTL
+        now = time.monotonic()
+        if now - self._renewed < ttl / 3:
+            return
+        try:
+            renewed = get_redis_connection("default").eval(
+                RENEW_SCRIPT, 1, lease_key(self._worker_id), self._owner, ttl)
+        except Exception:
+            if now - self._renewed < ttl:
+                # 租约还没有到期,其他进程不能占用这个机器号,下次再续期
+                logger.warning("order id lease renew failed: worker_id=%04d", self._worker_id, exc_info=True)
+                return
+            raise OrderIdError("order id lease expired and cannot be renewed")
+        if renewed:
+            self._renewed = now
+        else:
+            # 进程长时间空闲,租约已经到期(可能被其他进程占用)
+            logger.warning("order id lease lost: worker_id=%04d", self._worker_id)
+            self._acquire()
+
+    def release(self):
+        """
+        功能函数:进程退出时释放机器号的租约
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            try:
+                get_redis_connection("default").eval(RELEASE_SCRIPT, 1, lease_key(self._worker_id), self._owner)
+            except Exception as e:
+                logger.warning("order id lease release failed: worker_id=%04d %s", self._worker_id, e)
+            self._pid = None
+
+    def next_id(self):
+        with self._lock:
+            self._heartbeat()
+
+            now = int(time.time() * 1000)
+            if now > self._last_ms:
+                self._last_ms = now
+                self._seq = 0
+            else:
+                # 同一毫秒内或者时钟回拨:序号递增,序号用完时借用下一毫秒
+                self._seq += 1
+                if self._seq > MAX_SEQ:
+                    self._last_ms += 1
+                    self._seq = 0
+            ms, seq, worker_id = self._last_ms, self._seq, self._worker_id
+
+        prefix = time.strftime("%Y%m%d%H%M%S", time.localtime(ms // 1000))
+        return f"{prefix}{ms % 1000:03d}{worker_id:04d}{seq:04d}"
+
+
+generator = OrderIdGenerator(settings.ORDER_ID_HOST_ID)
+atexit.register(generator.release)
+
+
+def new_order_id():
+    """
+    功能函数:生成订单编号
+    """
+    return generator.next_id()
@@ -0,0 +1,65 @@
+"""
+并发执行互不依赖的查询
+1.每个调用在进程内共用的线程池中执行,记录各自的耗时(毫秒)
+2.线程中的数据库连接在调用前后按CONN_MAX_AGE处理,和请求开始/结束时一样
+  CONN_MAX_AGE>0时线程池中的线程复用各自的连接,CONN_HEALTH_CHECKS在复用前检查连接
+3.调用在提交时的contextvars上下文中执行,请求统计(utils.metrics)会计入这些查询
+4.耗时可以通过server_timing()写入Server-Timing响应头,在浏览器开发者工具中查看
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from dashop import settings
+
+_lock = threading.Lock()
+_state = {"pid": None, "executor": None}
+
+
+def get_executor():
+    # fork出的子进程不能使用父进程的线程池
+    if _state["pid"] != os.getpid():
+        with _lock:
+            if _state["pid"] != os.getpid():
+                _state["executor"] = ThreadPoolExecutor(max_workers=settings.PARALLEL_WORKERS,
+                                                        thread_name_prefix="parallel")
+                _state["pid"] = os.getpid()
+    return _state["executor"]
+
+
+def timed_call(func):
+    close_old_connections()
+    start = time.perf_counter()
+    try:
+        return func(), (time.perf_counter() - start) * 1000
+    finally:
+        close_old_connections()
+
+
+def run_parallel(calls):
+    """
+    功能函数:并发执行多个调用,任意一个抛出异常时抛出该异常
+    calls: {名称: 无参函数}
+    返回: ({名称: 返回值}, {名称: 耗时毫秒})
+    """
+    executor = get_executor()
+    futures = {name: executor.submit(contextvars.copy_context().run, timed_call, func)
+               for name, func in calls.items()}
+
+    results, timings = {}, {}
+    for name, future in futures.items():
+        results[name], timings[name] = future.result()
+
+    return results, timings
+
+
+def server_timing(timings):
+    """
+    功能函数:Server-Timing响应头
+    addresses;dur=1.2, skus;dur=3.4
+    """
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
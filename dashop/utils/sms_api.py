@@ -1,19 +1,154 @@
 """
 短信接口
+1.每个进程一个客户端,容联云客户端使用requests.Session保持HTTPS长连接(ronglian_sms_sdk每次请求都新建连接)
+2.SMS_PROVIDER=stub时使用本地模拟客户端,不发送真实短信(压测用)
+3.群发时用chunks()按服务商单次请求的号码数量上限拆分(users.tasks.async_send_bulk_message)
+4.只有连接没有建立(请求一定没有发出)时返回CONNECT_ERROR,可以重试;
+  读取超时等请求可能已经被服务商接受的错误返回NO_RESPONSE,重试可能重复发送
 """
-from ronglian_sms_sdk import SmsSDK
-from dashop.settings import (
-    SMS_ACCOUNT_SID,
-    SMS_TOKEN,
-    SMS_APP_ID,
-)
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
 
-accId = SMS_ACCOUNT_SID
-accToken = SMS_TOKEN
-appId = SMS_APP_ID
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from dashop import settings
+
+logger = logging.getLogger(__name__)
+
+# 请求失败时返回的结果,错误码和容联云SDK一致
+# 连接失败,请求没有发出
+CONNECT_ERROR = {"statusCode": "172001", "statusMsg": "网络错误"}
+# 请求已发出,没有收到响应(读取超时、连接中断)
+NO_RESPONSE = {"statusCode": "172002", "statusMsg": "无返回"}
+# 响应不是JSON
+INVALID_RESPONSE = {"statusCode": "172003", "statusMsg": "返回包体错误"}
+SUCCESS_CODE = "000000"
+
+
+def not_sent(error):
+    """
+    功能函数:请求是否一定没有发出(连接超时、连接被拒绝、DNS解析失败、TLS握手失败)
+    """
+    if isinstance(error, (requests.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, ConnectTimeoutError)
+
+
+class RonglianClient:
+    """
+    容联云短信接口,协议和ronglian_sms_sdk.SmsSDK相同
+    """
+    url = "https://app.cloopen.com:8883"
+    send_uri = "/2013-12-26/Accounts/{}/SMS/TemplateSMS"
+    # 单次请求最多200个号码
+    max_recipients = 200
+
+    def __init__(self, acc_id, acc_token, app_id, pool_size=10, timeout=(2, 5)):
+        self.acc_id = acc_id
+        self.acc_token = acc_token
+        self.app_id = app_id
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            "Content-Type": "application/json;charset=utf-8",
+            "Accept": "application/json",
+            "Accept-Charset": "UTF-8",
+        })
+
+    def send(self, tid, mobile, datas):
+        """
+        功能函数:发送模板短信
+        mobile: 手机号,多个号码以英文逗号分隔
+        返回: 接口响应 {"statusCode": "000000", "templateSMS": {...}}
+        """
+        timestamp = time.strftime("%Y%m%d%H%M%S", time.localtime())
+        sig = hashlib.md5(f"{self.acc_id}{self.acc_token}{timestamp}".encode()).hexdigest().upper()
+        url = f"{self.url}{self.send_uri.format(self.acc_id)}?sig={sig}"
+        authorization = base64.b64encode(f"{self.acc_id}:{timestamp}".encode()).decode()
+        body = {"to": mobile, "appId": self.app_id, "templateId": tid, "datas": datas}
+        try:
+            r = self.session.post(url, data=json.dumps(body), headers={"Authorization": authorization},
+                                  timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning("sms request error: %s", e)
+            return dict(CONNECT_ERROR if not_sent(e) else NO_RESPONSE)
+
+        if r.status_code != requests.codes.ok:
+            return {"statusCode": str(r.status_code)}
+        try:
+            return r.json()
+        except ValueError:
+            return dict(INVALID_RESPONSE, body=r.text[:200])
+
+
+class StubClient:
+    """
+    本地模拟客户端,记录最近发送的短信,SMS_STUB_DELAY模拟接口耗时
+    """
+    max_recipients = RonglianClient.max_recipients
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = deque(maxlen=1000)
+
+    def send(self, tid, mobile, datas):
+        if self.delay:
+            time.sleep(self.delay)
+        self.sent.append((tid, mobile, datas))
+        logger.info("stub sms tid=%s recipients=%d", tid, mobile.count(",") + 1)
+        return {"statusCode": SUCCESS_CODE, "templateSMS": {"smsMessageSid": f"stub{len(self.sent)}"}}
+
+
+_lock = threading.Lock()
+_state = {"pid": None, "client": None}
+
+
+def build_client():
+    if settings.SMS_PROVIDER == "stub":
+        return StubClient(settings.SMS_STUB_DELAY)
+    return RonglianClient(settings.SMS_ACCOUNT_SID, settings.SMS_TOKEN, settings.SMS_APP_ID,
+                          pool_size=settings.SMS_POOL_SIZE)
+
+
+def get_client():
+    """
+    功能函数:当前进程的短信客户端,fork出的子进程(celery worker)重新创建,不共用父进程的连接
+    """
+    if _state["pid"] != os.getpid():
+        with _lock:
+            if _state["pid"] != os.getpid():
+                _state["client"] = build_client()
+                _state["pid"] = os.getpid()
+    return _state["client"]
 
 
 def send_sms(tid, mobile, datas):
-    sdk = SmsSDK(accId, accToken, appId)
-    resp = sdk.sendMessage(tid, mobile, datas)
+    """
+    功能函数:发送短信
+    返回: 接口响应(dict)
+    """
+    resp = get_client().send(tid, mobile, datas)
+    if resp.get("statusCode") != SUCCESS_CODE:
+        logger.warning("sms to %s failed: %s", mobile, resp)
     return resp
+
+
+def chunks(mobiles, size=None):
+    """
+    功能函数:按单次请求的号码上限拆分,去掉重复号码
+    返回: ["138...,139...", ...]
+    """
+    size = size or get_client().max_recipients
+    mobiles = list(dict.fromkeys(mobiles))
+    return [",".join(mobiles[i:i + size]) for i in range(0, len(mobiles), size)]
+
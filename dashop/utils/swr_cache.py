@@ -0,0 +1,255 @@
+"""
+防缓存击穿的缓存工具
+1.同一个key同一时刻只有一个请求重建数据(Redis锁)
+2.重建期间其他请求直接返回旧数据(stale-while-revalidate),没有旧数据时等待重建完成后读取
+3.数据过期前按概率提前刷新(XFetch算法),热点key不会在同一时刻集中过期
+4.命中/未命中/返回旧数据等次数先在进程内累加,每METRICS_FLUSH_INTERVAL秒合并到Redis中(多进程共享),用于调整参数
+  命中时不增加Redis往返
+"""
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from dashop import settings
+from utils.async_redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Redis-key: 统计数据 swr_stats:<name> -> {"hit": 10, "miss": 1, ...}
+STATS_KEY = "swr_stats"
+# 等待其他请求重建数据时的轮询间隔(秒)
+POLL_INTERVAL = 0.05
+
+
+class Stats:
+    """
+    进程内的统计次数,定期合并到Redis
+    {(name, outcome): 次数}
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.last_flush = time.monotonic()
+
+    def incr(self, name, outcome):
+        """
+        返回: 是否需要合并到Redis
+        """
+        with self.lock:
+            self.counts[(name, outcome)] += 1
+        return time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+    def take(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.last_flush = time.monotonic()
+        return counts
+
+    def flush(self):
+        """
+        功能函数:合并到Redis,Redis不可用时丢弃这段时间的数据
+        """
+        counts = self.take()
+        if not counts:
+            return
+        try:
+            pipe = get_redis_connection("default").pipeline(transaction=False)
+            for (name, outcome), count in counts.items():
+                pipe.hincrby(f"{STATS_KEY}:{name}", outcome, count)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("swr stats error: %s", e)
+
+    async def aflush(self):
+        counts = self.take()
+        if not counts:
+            return
+        try:
+            pipe = get_async_redis("default").pipeline(transaction=False)
+            for (name, outcome), count in counts.items():
+                pipe.hincrby(f"{STATS_KEY}:{name}", outcome, count)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("swr stats error: %s", e)
+
+
+stats = Stats()
+
+
+def record(name, outcome):
+    """
+    功能函数:统计次数+1,统计失败不影响请求
+    outcome: hit-命中 miss-未命中 stale-返回旧数据 refresh-刷新 wait-等待其他请求重建
+    """
+    if name and stats.incr(name, outcome):
+        stats.flush()
+
+
+async def arecord(name, outcome):
+    """
+    功能函数:record的异步版本
+    """
+    if name and stats.incr(name, outcome):
+        await stats.aflush()
+
+
+def get_stats():
+    """
+    功能函数:获取所有统计数据(当前进程未合并的数据先合并)
+    {"detail": {"hit": 10, "miss": 1}, ...}
+    """
+    stats.flush()
+    r = get_redis_connection("default")
+    result = {}
+    for key in r.scan_iter(f"{STATS_KEY}:*"):
+        name = key.decode()[len(STATS_KEY) + 1:]
+        result[name] = {k.decode(): int(v) for k, v in r.hgetall(key).items()}
+
+    return result
+
+
+def reset_stats():
+    stats.take()
+    r = get_redis_connection("default")
+    keys = list(r.scan_iter(f"{STATS_KEY}:*"))
+    if keys:
+        r.delete(*keys)
+
+
+def release(lock):
+    try:
+        lock.release()
+    except LockError:
+        # 锁已超时被自动释放
+        pass
+
+
+def single_flight(alias, key, build, read, lock_timeout=10, wait=3.0, name=None):
+    """
+    功能函数:缓存未命中时,同一个key只允许一个请求执行build()
+    其他请求等待重建完成,通过read()读取结果
+    等待超时或重建的请求没有写入数据时,自己执行build()
+    """
+    lock = caches[alias].lock(f"lock:{key}", timeout=lock_timeout)
+    if lock.acquire(blocking=False):
+        record(name, "miss")
+        try:
+            return build()
+        finally:
+            release(lock)
+
+    record(name, "wait")
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = read()
+        if value is not None:
+            return value
+        if not lock.locked():
+            break
+
+    return build()
+
+
+def swr_get(alias, key, build, timeout, stale=None, beta=1.0, lock_timeout=10, cacheable=None, name=None):
+    """
+    功能函数:读取缓存,必要时重建
+    缓存中存储: (value, 过期时间戳, 重建耗时)
+    timeout: 新鲜期(秒)
+    stale: 过期后还可以返回旧数据的时间(秒),默认等于timeout
+    beta: 提前刷新系数,越大越早刷新,0表示不提前刷新
+    cacheable: 判断build()结果是否可以缓存的函数
+    返回: (value, outcome)
+    """
+    cache = caches[alias]
+    stale = timeout if stale is None else stale
+
+    def rebuild():
+        start = time.time()
+        value = build()
+        if cacheable is None or cacheable(value):
+            delta = time.time() - start
+            cache.set(key, (value, time.time() + timeout, delta), timeout + stale)
+        return value
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, expire, delta = entry
+        # XFetch: now - delta * beta * ln(rand) >= expire 时提前刷新
+        if time.time() - delta * beta * math.log(random.random() or 1e-12) < expire:
+            record(name, "hit")
+            return value, "hit"
+
+        lock = cache.lock(f"lock:{key}", timeout=lock_timeout)
+        if not lock.acquire(blocking=False):
+            # 其他请求正在刷新,返回旧数据
+            record(name, "stale")
+            return value, "stale"
+
+        record(name, "refresh")
+        try:
+            return rebuild(), "refresh"
+        finally:
+            release(lock)
+
+    def read():
+        entry = cache.get(key)
+        return None if entry is None else entry[0]
+
+    return single_flight(alias, key, rebuild, read, lock_timeout, name=name), "miss"
+
+
+def swr_cache_page(timeout, cache="default", stale=None, beta=1.0, key_prefix="", name=None):
+    """
+    防缓存击穿的cache_page
+    用法和cache_page相同:
+    @swr_cache_page(60 * 5, cache="index")
+    只缓存GET/HEAD请求的200响应,响应头X-Cache: hit/miss/stale/refresh
+    """
+
+    def decorator(view):
+        stats_name = name or view.__name__
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+            key = f"swr_page:{key_prefix}:{url}"
+
+            def build():
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                return {
+                    "content": response.content,
+                    "status": response.status_code,
+                    "headers": dict(response.items()),
+                }
+
+            value, outcome = swr_get(cache, key, build, timeout, stale, beta,
+                                     cacheable=lambda v: isinstance(v, dict), name=stats_name)
+            if not isinstance(value, dict):
+                return value
+
+            response = HttpResponse(value["content"], status=value["status"])
+            for k, v in value["headers"].items():
+                response[k] = v
+            response["X-Cache"] = outcome
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,51 @@
+"""
+测试工具
+RedisTestCase: 所有Redis缓存换成进程内的fakeredis,每个测试前清空,不需要(也不会修改)真实的Redis
+celery任务在当前进程中同步执行,不需要消息队列
+运行测试(安装测试依赖: pdm install -G test):
+python manage.py test                                        # MySQL(创建测试库)
+PYTHONPATH=../bench python manage.py test --settings=settings  # SQLite,不依赖MySQL
+"""
+import fakeredis
+import fakeredis.aioredis
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+
+from dashop.celery import app
+from users.user_cache import local_cache
+
+
+def fake_caches(server):
+    """
+    功能函数:CACHES中的每个Redis库换成fakeredis
+    django_redis按LOCATION缓存连接池,换一个地址,不复用已经创建的真实连接池
+    """
+    caches = {}
+    for alias, conf in settings.CACHES.items():
+        db = conf["LOCATION"].rsplit("/", 1)[-1]
+        options = dict(conf.get("OPTIONS", {}),
+                       CONNECTION_POOL_KWARGS={"connection_class": fakeredis.FakeConnection, "server": server})
+        caches[alias] = dict(conf, LOCATION=f"redis://dashop-test:6379/{db}", OPTIONS=options)
+    return caches
+
+
+class RedisTestCase(TestCase):
+    server = fakeredis.FakeServer()
+
+    @classmethod
+    def setUpClass(cls):
+        redis_settings = override_settings(
+            CACHES=fake_caches(cls.server),
+            ASYNC_REDIS_POOL_KWARGS={"connection_class": fakeredis.aioredis.FakeConnection, "server": cls.server},
+        )
+        redis_settings.enable()
+        cls.addClassCleanup(redis_settings.disable)
+        cls.addClassCleanup(setattr, app.conf, "task_always_eager", app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        super().setUpClass()
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            get_redis_connection(alias).flushdb()
+        local_cache.clear()
@@ -0,0 +1,287 @@
+import json
+import logging
+import sys
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django_redis import get_redis_connection
+from urllib3.exceptions import ConnectTimeoutError
+
+from dashop import settings
+from users.models import UserProfile
+from utils import log, metrics, sms_api
+from utils.parallel import run_parallel
+from utils.testing import RedisTestCase
+
+
+class MetricsTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.install()
+        # 测试库的连接在安装前已经创建
+        metrics.install_sql_wrapper(None, connection)
+        metrics.registry.data.clear()
+        for name, value in {"METRICS_HEADER": True, "METRICS_FLUSH_INTERVAL": 3600}.items():
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def count(self, method, route, name):
+        return sum(metrics.registry.data[(method, route)][name][:-1])
+
+    def test_request_counted(self):
+        response = self.client.get("/v1/users/check", {"username": "newuser"})
+
+        self.assertEqual(self.count("GET", "v1/users/check", "request_duration_seconds"), 1)
+        self.assertIn("redis;dur=", response["Server-Timing"])
+        self.assertIn("app;dur=", response["Server-Timing"])
+
+    def test_sql_and_redis_counted(self):
+        stats, token = metrics.start()
+        try:
+            UserProfile.objects.count()
+            pipe = get_redis_connection("default").pipeline()
+            pipe.get("a").get("b")
+            pipe.execute()
+        finally:
+            metrics._current.reset(token)
+
+        # pipeline只算一次往返
+        self.assertEqual((stats.db_queries, stats.redis_commands), (1, 1))
+
+    def test_parallel_calls_counted(self):
+        stats, token = metrics.start()
+        try:
+            run_parallel({"a": get_redis_connection("default").ping, "b": get_redis_connection("default").ping})
+        finally:
+            metrics._current.reset(token)
+
+        self.assertEqual(stats.redis_commands, 2)
+
+    def test_not_sampled(self):
+        with mock.patch.object(settings, "METRICS_HEADER", False), \
+                mock.patch.object(settings, "METRICS_SAMPLE_RATE", 0):
+            response = self.client.get("/v1/users/check", {"username": "newuser"})
+
+        self.assertEqual(metrics.registry.data, {})
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_flush_and_render(self):
+        values = {"db_queries": 3, "redis_commands": 0}
+        metrics.registry.observe("GET", "v1/goods", values)
+        metrics.registry.observe("GET", "v1/goods", values)
+        metrics.registry.flush()
+        metrics.registry.observe("GET", "v1/goods", {"db_queries": 200})
+        metrics.registry.flush()
+
+        text = metrics.render(metrics.load())
+
+        labels = 'method="GET",route="v1/goods"'
+        self.assertIn(f'dashop_db_queries_bucket{{{labels},le="2"}} 0', text)
+        self.assertIn(f'dashop_db_queries_bucket{{{labels},le="5"}} 2', text)
+        self.assertIn(f'dashop_db_queries_bucket{{{labels},le="+Inf"}} 3', text)
+        self.assertIn(f"dashop_db_queries_sum{{{labels}}} 206", text)
+        self.assertIn(f"dashop_db_queries_count{{{labels}}} 3", text)
+        self.assertIn(f'dashop_redis_commands_bucket{{{labels},le="0"}} 2', text)
+
+    def test_flush_error_ignored(self):
+        metrics.registry.observe("GET", "v1/goods", {"db_queries": 1})
+
+        with mock.patch.object(metrics, "get_redis_connection", side_effect=ConnectionError("redis down")), \
+                self.assertLogs("utils.metrics", "WARNING"):
+            metrics.registry.flush()
+
+        self.assertEqual(metrics.registry.data, {})
+
+    def test_metrics_view(self):
+        self.client.get("/v1/users/check", {"username": "newuser"})
+
+        response = self.client.get("/metrics")
+        with self.assertLogs("django.request", "WARNING"):
+            forbidden = self.client.get("/metrics", REMOTE_ADDR="10.0.0.1")
+
+        self.assertIn('route="v1/users/check"', response.content.decode())
+        self.assertEqual(forbidden.status_code, 403)
+
+
+class ListHandler(logging.Handler):
+    """
+    QueueLogHandler的target:记录后台线程输出的日志,entered/unblocked用于阻塞后台线程
+    """
+
+    def __init__(self, block=False):
+        super().__init__()
+        self.records = []
+        self.entered = threading.Event()
+        self.unblocked = threading.Event()
+        if not block:
+            self.unblocked.set()
+
+    def emit(self, record):
+        self.entered.set()
+        self.unblocked.wait(5)
+        self.records.append(self.format(record))
+
+
+class LogTest(RedisTestCase):
+    def make_record(self, msg, *args, level=logging.INFO, **extra):
+        return logging.getLogger("dashop.test").makeRecord("dashop.test", level, __file__, 1, msg, args, None,
+                                                           extra=extra)
+
+    def test_json_format(self):
+        record = self.make_record("order %s paid", "A1", order_id="A1", amount=object)
+        log.RequestFilter().filter(record)
+
+        data = json.loads(log.JsonFormatter().format(record))
+
+        self.assertEqual(data["message"], "order A1 paid")
+        self.assertEqual((data["level"], data["logger"], data["request_id"]), ("INFO", "dashop.test", "-"))
+        self.assertEqual(data["order_id"], "A1")
+        self.assertEqual(data["amount"], str(object))
+
+    def test_exception_formatted(self):
+        try:
+            raise KeyError("missing")
+        except KeyError:
+            record = self.make_record("failed", level=logging.ERROR)
+            record.exc_info = sys.exc_info()
+
+        data = json.loads(log.JsonFormatter().format(record))
+
+        self.assertIn("KeyError: 'missing'", data["exc"])
+
+    def run_middleware(self, path="v1/goods", **headers):
+        seen = {}
+
+        def get_response(request):
+            middleware.process_view(request, None, (), {})
+            seen.update(request_id=log.request_id.get(), route=log.route.get(), sampled=log.sampled.get())
+            return HttpResponse()
+
+        middleware = log.RequestIdMiddleware(get_response)
+        request = RequestFactory().get("/", **headers)
+        request.resolver_match = SimpleNamespace(route=path)
+        response = middleware(request)
+        return response, seen
+
+    def test_request_id(self):
+        response, seen = self.run_middleware(HTTP_X_REQUEST_ID="abc")
+        self.assertEqual(response["X-Request-ID"], "abc")
+        self.assertEqual((seen["request_id"], seen["route"]), ("abc", "v1/goods"))
+        # 请求结束后恢复
+        self.assertEqual(log.request_id.get(), "-")
+
+        response, seen = self.run_middleware()
+        self.assertEqual(len(response["X-Request-ID"]), 32)
+        self.assertEqual(seen["request_id"], response["X-Request-ID"])
+
+    def test_sampling(self):
+        with mock.patch.object(settings, "LOG_SAMPLE_RATES", {"v1/goods": 0}):
+            self.assertFalse(self.run_middleware()[1]["sampled"])
+            self.assertTrue(self.run_middleware("v1/orders")[1]["sampled"])
+
+        token = log.sampled.set(False)
+        try:
+            sampling = log.SamplingFilter()
+            self.assertFalse(sampling.filter(self.make_record("info")))
+            self.assertTrue(sampling.filter(self.make_record("warning", level=logging.WARNING)))
+        finally:
+            log.sampled.reset(token)
+
+    def make_handler(self, target, maxsize=None):
+        handler = log.QueueLogHandler(target="utils.tests.ListHandler", target_kwargs=target, maxsize=maxsize)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_queue_handler(self):
+        handler = self.make_handler({})
+        items = ["a"]
+        handler.handle(self.make_record("items %s", items))
+        # 入队时已经合并参数,之后修改参数不影响日志
+        items.append("b")
+
+        handler.close()
+
+        self.assertEqual(handler.target.records, ["items ['a']"])
+
+    def test_queue_full_dropped(self):
+        handler = self.make_handler({"block": True}, maxsize=1)
+        handler.handle(self.make_record("1"))
+        self.assertTrue(handler.target.entered.wait(5))
+
+        handler.handle(self.make_record("2"))
+        handler.handle(self.make_record("3"))
+        handler.target.unblocked.set()
+        handler.close()
+
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.target.records, ["1", "2"])
+
+
+class SmsClientTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = sms_api.RonglianClient("acc", "token", "app")
+
+    def send(self, response=None, error=None):
+        with mock.patch.object(self.client.session, "post", return_value=response, side_effect=error) as post:
+            return self.client.send("1", "13800000001,13800000002", ["1234", 5]), post
+
+    def make_response(self, status=200, body=""):
+        response = requests.Response()
+        response.status_code = status
+        response._content = body.encode()
+        return response
+
+    def test_send(self):
+        resp, post = self.send(self.make_response(body='{"statusCode": "000000"}'))
+
+        self.assertEqual(resp, {"statusCode": "000000"})
+        (url,), kwargs = post.call_args
+        self.assertIn("/Accounts/acc/SMS/TemplateSMS?sig=", url)
+        self.assertEqual(json.loads(kwargs["data"]),
+                         {"to": "13800000001,13800000002", "appId": "app", "templateId": "1", "datas": ["1234", 5]})
+
+    def test_request_errors(self):
+        connect_timeout = requests.ConnectionError(mock.Mock(reason=ConnectTimeoutError()))
+        errors = {
+            requests.ConnectTimeout(): sms_api.CONNECT_ERROR,
+            requests.exceptions.SSLError(): sms_api.CONNECT_ERROR,
+            connect_timeout: sms_api.CONNECT_ERROR,
+            # 请求可能已经被服务商接受
+            requests.ReadTimeout(): sms_api.NO_RESPONSE,
+            requests.ConnectionError("connection reset"): sms_api.NO_RESPONSE,
+        }
+        for error, expected in errors.items():
+            with self.subTest(error=error), self.assertLogs("utils.sms_api", "WARNING"):
+                self.assertEqual(self.send(error=error)[0], expected)
+
+    def test_bad_responses(self):
+        self.assertEqual(self.send(self.make_response(status=502))[0], {"statusCode": "502"})
+
+        resp = self.send(self.make_response(body="<html>"))[0]
+        self.assertEqual((resp["statusCode"], resp["body"]), (sms_api.INVALID_RESPONSE["statusCode"], "<html>"))
+
+    def test_chunks(self):
+        mobiles = ["13800000001", "13800000002", "13800000001", "13800000003"]
+
+        self.assertEqual(sms_api.chunks(mobiles, size=2), ["13800000001,13800000002", "13800000003"])
+
+    def test_client_per_process(self):
+        self.addCleanup(sms_api._state.update, dict(sms_api._state))
+        sms_api._state.update(pid=None, client=None)
+        with mock.patch.object(settings, "SMS_PROVIDER", "stub"):
+            client = sms_api.get_client()
+            self.assertIs(sms_api.get_client(), client)
+            # fork出的子进程
+            sms_api._state["pid"] = -1
+            self.assertIsNot(sms_api.get_client(), client)
+
+        sms_api.send_sms("1", "13800000001", ["1234"])
+        self.assertEqual(sms_api.get_client().sent[-1], ("1", "13800000001", ["1234"]))